@@ -0,0 +1,147 @@
+"""
+Deterministic generator of large, realistic 6502 programs.
+
+The same parameters and seed always give the same program, so timings can
+be compared from one run to the next.
+"""
+
+import random
+
+
+# Instructions for each kind of operand
+IMPLIED = ["NOP", "TAX", "TXA", "INX", "DEY", "CLC", "SEC", "PHA", "PLA"]
+IMMEDIATE = ["LDA", "LDX", "LDY", "ADC", "SBC", "CMP", "AND", "ORA"]
+ZEROPAGE = ["LDA", "STA", "INC", "DEC", "LDX", "STY", "ADC"]
+ABSOLUTE = ["JMP", "JSR", "LDA", "STA", "ORA"]
+BRANCHES = ["BCC", "BCS", "BEQ", "BMI", "BNE", "BPL", "BVC"]
+
+# A branch never crosses more than this many lines, so it stays in range
+MAX_BRANCH_LINES = 30
+
+
+class Program(object):
+    """Parameters for a generated program.
+
+    lines: number of statements.
+    labels: fraction of lines that define a label.
+    forward: fraction of label references that point forwards.
+    branches: fraction of lines that are branches.
+    org_every, org_gap: start a new .ORG segment every org_every lines,
+        org_gap bytes after the end of the last one (0 for a single
+        segment).
+    data: fraction of lines that are .BYTE or .WORD.
+    """
+
+    def __init__(self, lines=1000, labels=0.1, forward=0.5, branches=0.1,
+                 org_every=500, org_gap=0x100, data=0.15, org=0x0200,
+                 seed=6502):
+        self.lines = lines
+        self.labels = labels
+        self.forward = forward
+        self.branches = branches
+        self.org_every = org_every
+        self.org_gap = org_gap
+        self.data = data
+        self.org = org
+        self.seed = seed
+
+    def generate(self):
+        """Return the program source as a list of lines."""
+        r = random.Random(self.seed)
+        out = []
+
+        variables = ["v%d" % i for i in range(16)]
+        for i, name in enumerate(variables):
+            out.append("%s = $%02X" % (name, 0x10 + i))
+
+        out.append(".ORG $%04X" % self.org)
+        pc = self.org
+
+        # Labels are numbered in the order they're defined.  A label is
+        # forced after MAX_BRANCH_LINES lines without one and at the start
+        # of every segment, so a branch to the closest label either way is
+        # always in range.
+        self.defined = 0
+        self.highest = 0
+        lines_since = MAX_BRANCH_LINES
+
+        for i in range(self.lines):
+            if self.org_every and i and i % self.org_every == 0:
+                pc += self.org_gap
+                out.append(".ORG $%04X" % pc)
+                lines_since = MAX_BRANCH_LINES
+
+            prefix = ""
+            if r.random() < self.labels or lines_since >= MAX_BRANCH_LINES:
+                prefix = "L%d: " % self.defined
+                self.defined += 1
+                lines_since = 0
+            lines_since += 1
+
+            # Forward branches mustn't cross into the next segment
+            to_org = self.org_every - i % self.org_every \
+                if self.org_every else self.lines
+            line, size = self.statement(r, to_org > MAX_BRANCH_LINES)
+            out.append(prefix + line)
+            pc += size
+
+            if pc > 0x10000:
+                raise ValueError("Program doesn't fit in 64K")
+
+        # Define every label that a forward reference used
+        for n in range(self.defined, self.highest + 1):
+            out.append("L%d: NOP" % n)
+            pc += 1
+
+        if pc > 0x10000:
+            raise ValueError("Program doesn't fit in 64K")
+
+        return out
+
+    def reference(self, r):
+        """Pick a label to refer to, forwards or backwards."""
+        if r.random() < self.forward:
+            n = self.defined + r.randrange(100)
+            self.highest = max(self.highest, n)
+        else:
+            n = r.randrange(self.defined)
+        return "L%d" % n
+
+    def statement(self, r, forward_branch):
+        """Return a random statement and its size."""
+        x = r.random()
+
+        if x < self.branches:
+            # Branch to the closest label either way, which is in range
+            if forward_branch and r.random() < self.forward:
+                target = self.defined
+                self.highest = max(self.highest, target)
+            else:
+                target = self.defined - 1
+            return "  %s L%d" % (r.choice(BRANCHES), target), 2
+        x -= self.branches
+
+        if x < self.data:
+            if r.random() < 0.5:
+                return "  .BYTE $%02X" % r.randrange(1, 0x100), 1
+            if r.random() < 0.5:
+                return "  .WORD $%04X" % r.randrange(1, 0x10000), 2
+            return "  .WORD %s" % self.reference(r), 2
+
+        kind = r.random()
+        if kind < 0.2:
+            return "  " + r.choice(IMPLIED), 1
+        if kind < 0.45:
+            return "  %s #$%02X" % (
+                r.choice(IMMEDIATE), r.randrange(0x100)
+            ), 2
+        if kind < 0.7:
+            return "  %s %s" % (r.choice(ZEROPAGE), r.choice(
+                ["v%d" % r.randrange(16), "$%02X" % r.randrange(1, 0x100)]
+            )), 2
+        return "  %s %s" % (
+            r.choice(ABSOLUTE), self.reference(r)
+        ), 3
+
+    def source(self):
+        return "\n".join(self.generate())
@@ -0,0 +1,153 @@
+"""
+Time the assembler on generated programs and compare against a baseline.
+
+    python -m benchmarks.run            # run and check against baseline.json
+    python -m benchmarks.run --save     # record a new baseline
+
+Each size is assembled --repeat times with a cold operand cache and the
+best time for each phase is kept: pass one (assembleLine over every
+line), resolveLabels and writing the output file.  Peak memory is measured
+separately with tracemalloc, which would otherwise slow the timed runs.
+The run fails if lines/sec drops, or peak memory grows, by more than
+--threshold compared to the baseline.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from py65asm.assembler import Assembler
+
+from .generate import Program
+
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "baseline.json")
+
+SIZES = [1000, 4000, 16000]
+
+
+def assemble(source, dest):
+    """Assemble source, writing it to dest.  Returns the time taken by
+    each phase."""
+    a = Assembler()
+    a.cache.clear()
+
+    start = time.time()
+    a.begin()
+    for line in a.lines(source):
+        a.assembleLine(line)
+    assembled = time.time()
+    a.resolveLabels()
+    resolved = time.time()
+    with open(dest, 'wb') as f:
+        a.writeOutput(f)
+    written = time.time()
+
+    return {
+        'assemble': assembled - start,
+        'resolveLabels': resolved - assembled,
+        'output': written - resolved,
+    }
+
+
+def peakMemory(source):
+    """Return the peak memory allocated while assembling source, in KB."""
+    if tracemalloc is None:
+        return None
+    tracemalloc.start()
+    Assembler().assemble(source, flat=False)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak // 1024
+
+
+def measure(lines, repeat):
+    source = Program(lines).source()
+    fd, dest = tempfile.mkstemp(suffix='.bin')
+    os.close(fd)
+    try:
+        runs = [assemble(source, dest) for i in range(repeat)]
+    finally:
+        os.remove(dest)
+
+    result = {}
+    for phase in runs[0]:
+        result[phase] = round(min([run[phase] for run in runs]), 6)
+    result['lines_per_sec'] = int(
+        lines / (result['assemble'] + result['resolveLabels'])
+    )
+    result['peak_kb'] = peakMemory(source)
+    return result
+
+
+def compare(results, baseline, threshold):
+    """Return a list of the regressions in results against baseline."""
+    problems = []
+    for size, result in sorted(results.items()):
+        base = baseline.get(size)
+        if base is None:
+            continue
+        if result['lines_per_sec'] < base['lines_per_sec'] * (1 - threshold):
+            problems.append("%s lines: %d lines/sec, baseline %d" % (
+                size, result['lines_per_sec'], base['lines_per_sec']
+            ))
+        if result['peak_kb'] is not None and base.get('peak_kb') and \
+                result['peak_kb'] > base['peak_kb'] * (1 + threshold):
+            problems.append("%s lines: peak %d KB, baseline %d KB" % (
+                size, result['peak_kb'], base['peak_kb']
+            ))
+    return problems
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    p.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    p.add_argument('--repeat', type=int, default=5)
+    p.add_argument('--baseline', default=BASELINE)
+    p.add_argument('--threshold', type=float, default=0.25,
+                   help='allowed regression, as a fraction (default 0.25)')
+    p.add_argument('--save', action='store_true',
+                   help='save the results as the new baseline')
+    args = p.parse_args(argv)
+
+    results = {}
+    sys.stdout.write("%8s %10s %10s %10s %12s %9s\n" % (
+        "lines", "assemble", "resolve", "output", "lines/sec", "peak KB"
+    ))
+    for size in args.sizes:
+        r = measure(size, args.repeat)
+        results[str(size)] = r
+        sys.stdout.write("%8d %9.1fms %9.1fms %9.1fms %12d %9s\n" % (
+            size, r['assemble'] * 1000, r['resolveLabels'] * 1000,
+            r['output'] * 1000, r['lines_per_sec'], r['peak_kb']
+        ))
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+        return 0
+
+    if not os.path.exists(args.baseline):
+        sys.stdout.write("No baseline at %s\n" % args.baseline)
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    problems = compare(results, baseline, args.threshold)
+    for problem in problems:
+        sys.stdout.write("REGRESSION: %s\n" % problem)
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,275 @@
+"""
+An asyncio front end: assemble without blocking the event loop.
+
+    result = await assemble_async(source, org=0xc000, timeout=10,
+                                  progress=show)
+
+The assembly runs in a thread pool, or in the process pool given to an
+AsyncAssembler, which also limits how many run at once: callers beyond
+the limit wait their turn, as Progress('queued').  Cancelling the task,
+or running past timeout, stops the assembly at its next check, every
+REPORT_EVERY lines; the slot it held is only given back once it has
+stopped.
+
+progress is called on the event loop with a Progress for each phase and
+every REPORT_EVERY lines.  The phases are 'queued', then 'reading' and
+'sizing' if zero_page or relax is set, 'assembling', 'resolving' and
+'done'.
+
+This module needs Python 3.7 or later and is not imported by the rest of
+the package.  With a process pool the options must be picklable, so a
+listing file or stats hook can't be given.
+"""
+
+import asyncio
+import concurrent.futures
+import multiprocessing
+import threading
+
+from .assembler import Assembler
+from .segments import SegmentMap
+
+
+# Lines assembled between progress reports and checks for cancellation
+REPORT_EVERY = 1000
+
+
+class Cancelled(Exception):
+    """Raised inside a worker whose assembly is no longer wanted."""
+
+
+class Progress(object):
+    """How far an assembly has got: its phase, and the number of source
+    lines read so far in it."""
+    __slots__ = ('phase', 'lines')
+
+    def __init__(self, phase, lines=0):
+        self.phase = phase
+        self.lines = lines
+
+    def __repr__(self):
+        return "Progress(%r, %d)" % (self.phase, self.lines)
+
+
+class Result(object):
+    """The outcome of an assembly: the flat image in data (None unless
+    flat was asked for), the SegmentMap, the symbols, the number of
+    branches relaxed and the stats, if enabled."""
+    __slots__ = ('data', 'segments', 'symbols', 'relaxed', 'stats')
+
+    def __init__(self, data, segments, symbols, relaxed, stats):
+        self.data = data
+        self.segments = segments
+        self.symbols = symbols
+        self.relaxed = relaxed
+        self.stats = stats
+
+
+class _LoopQueue(object):
+    """Hands the items put into it from a worker thread to callback, on
+    the event loop."""
+
+    def __init__(self, loop, callback):
+        self.loop = loop
+        self.callback = callback
+
+    def put(self, item):
+        self.loop.call_soon_threadsafe(self.callback, item)
+
+
+class _Channel(object):
+    """Carries progress out of a worker, through queue (which may be
+    None), and the request to stop, event, into it."""
+
+    def __init__(self, queue, event):
+        self.queue = queue
+        self.event = event
+
+    def report(self, phase, lines=0):
+        if self.queue is not None:
+            self.queue.put(Progress(phase, lines))
+
+    def check(self):
+        if self.event.is_set():
+            raise Cancelled()
+
+
+class _Reporting(Assembler):
+    """An Assembler that reports its progress on a _Channel and stops if
+    asked to."""
+
+    def __init__(self, channel, **options):
+        self.channel = channel
+        self.lineCount = 0
+        Assembler.__init__(self, **options)
+
+    def lines(self, asm):
+        lines = Assembler.lines(self, asm)
+        # With sizing passes every line is read before any is assembled
+        sizing = self.zero_page or self.relax
+        return self.counted(lines, 'reading' if sizing else 'assembling')
+
+    def size(self, lines):
+        lines = Assembler.size(self, lines)
+        return self.counted(lines, 'assembling')
+
+    def counted(self, lines, phase):
+        channel = self.channel
+        channel.report(phase)
+        n = 0
+        for n, line in enumerate(lines, 1):
+            if n % REPORT_EVERY == 0:
+                channel.check()
+                channel.report(phase, n)
+            yield line
+        self.lineCount = n
+        if phase == 'reading':
+            channel.report('sizing', n)
+
+    def resolveLabels(self):
+        self.channel.check()
+        if not self.sizing:
+            self.channel.report('resolving', self.lineCount)
+        Assembler.resolveLabels(self)
+
+
+def _assemble(source, path, flat, options, channel):
+    """Carry out one assembly in a worker thread or process."""
+    channel.check()
+    a = _Reporting(channel, **options)
+    if path is not None:
+        with open(path) as f:
+            segments = a.assemble(f, flat=False)
+    else:
+        segments = a.assemble(source, flat=False)
+
+    # Copied, as .INCBIN data is a memory map, which can't be sent back
+    # from a process
+    out = SegmentMap()
+    for s in segments.segments:
+        if len(s):
+            out.add(s.start, bytearray(s.data))
+    result = Result(out.flatten(a.fill) if flat else None, out,
+                    dict(a.symbols), a.relaxed, a.stats)
+    channel.report('done', a.lineCount)
+    return result
+
+
+async def _forward(loop, queue, callback):
+    """Pass the items from a worker process's queue to callback until a
+    None."""
+    while True:
+        item = await loop.run_in_executor(None, queue.get)
+        if item is None:
+            return
+        callback(item)
+
+
+class AsyncAssembler(object):
+    """Runs assemblies on executor, a concurrent.futures thread or process
+    pool (by default a thread pool of its own), at most limit at once.
+    options are passed to each Assembler."""
+
+    def __init__(self, executor=None, limit=4, **options):
+        self.ownExecutor = executor is None
+        if executor is None:
+            executor = concurrent.futures.ThreadPoolExecutor(limit)
+        self.executor = executor
+        self.processes = isinstance(
+            executor, concurrent.futures.ProcessPoolExecutor
+        )
+        self.limit = limit
+        self.options = options
+        # Made on first use, inside the event loop, and again if it is
+        # used from another loop
+        self.semaphore = None
+        self.loop = None
+        self.manager = None
+
+    async def assemble(self, source=None, path=None, timeout=None,
+                       progress=None, flat=True, **options):
+        """Assemble the text source, or the file at path, and return a
+        Result.  options override those given to the AsyncAssembler.
+        Raises asyncio.TimeoutError after timeout seconds."""
+        loop = asyncio.get_running_loop()
+        if self.semaphore is None or self.loop is not loop:
+            self.semaphore = asyncio.Semaphore(self.limit)
+            self.loop = loop
+        options = dict(self.options, **options)
+
+        forward = None
+        if self.processes:
+            if self.manager is None:
+                self.manager = multiprocessing.Manager()
+            queue = self.manager.Queue() if progress is not None else None
+            event = self.manager.Event()
+            if progress is not None:
+                forward = loop.create_task(_forward(loop, queue, progress))
+        else:
+            queue = None
+            if progress is not None:
+                queue = _LoopQueue(loop, progress)
+            event = threading.Event()
+        channel = _Channel(queue, event)
+
+        if progress is not None:
+            progress(Progress('queued'))
+        try:
+            return await asyncio.wait_for(
+                self.submit(loop, channel, source, path, flat, options),
+                timeout
+            )
+        finally:
+            # Stops the worker if it is still going
+            event.set()
+            if forward is not None:
+                queue.put(None)
+                await forward
+
+    async def submit(self, loop, channel, source, path, flat, options):
+        """Run the assembly once there is a free slot."""
+        # The semaphore may be replaced before the worker stops, by a call
+        # from another loop, so the one acquired is the one released
+        semaphore = self.semaphore
+        await semaphore.acquire()
+        try:
+            future = self.executor.submit(_assemble, source, path, flat,
+                                          options, channel)
+        except Exception:
+            semaphore.release()
+            raise
+
+        def release(f):
+            # The slot is free once the worker has stopped, which may be
+            # after the caller stopped waiting for it
+            try:
+                loop.call_soon_threadsafe(semaphore.release)
+            except RuntimeError:
+                # The loop has been closed
+                pass
+
+        future.add_done_callback(release)
+        return await asyncio.wrap_future(future)
+
+    def close(self):
+        """Shut down the executor, if it is the AsyncAssembler's own, and
+        the manager used with a process pool."""
+        if self.ownExecutor:
+            self.executor.shutdown()
+        if self.manager is not None:
+            self.manager.shutdown()
+            self.manager = None
+
+
+_default = None
+
+
+async def assemble_async(source=None, path=None, timeout=None,
+                         progress=None, flat=True, **options):
+    """Assemble source, or the file at path, on a shared AsyncAssembler
+    with its own thread pool.  See AsyncAssembler.assemble."""
+    global _default
+    if _default is None:
+        _default = AsyncAssembler()
+    return await _default.assemble(source, path, timeout, progress, flat,
+                                   **options)
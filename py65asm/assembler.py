@@ -1,106 +1,468 @@
+import copy
+import os
+import struct
+import threading
+from collections import deque
+
+from .cache import LRUCache
+from .expressions import Expression, compileExpression
+from .formats import WRITERS, writeOutput
+from .include import Unit, unit_cache, mapFile
+from .lexer import tokenize, parseOperand, Operand, LABEL, OP, NUMBER, \
+    STRING, SYMBOL, string_types
+from .listing import Listing
+from .macros import macro_cache, localize
 from .ops import ops
-import re
-
-
-# Handle file check for python 3
-import sys
-if sys.version_info[0] == 3:
-    from io import IOBase
-    file = IOBase
-
-num_formats = [
-    '\$([\dabcdefABCDEF]{1,4})',
-    '%([01]{1,16})',
-    '0([01234567]{1,6})',
-    '(-*\d{1,5})',
-    '(\w[\w\d]*)'
-]
-
-num_bases = [16, 2, 8, 10, None]
-
-arg_regex = [
-    ('im', ''.join([
-        '^#', '(?:', '|'.join(num_formats), ')$'
-    ])),
-    ('z', ''.join([
-        '^(?:', '|'.join(num_formats), ')$'
-    ])),
-    ('zx', ''.join([
-        '^(?:', '|'.join(num_formats), ')', ',[xX]$'
-    ])),
-    ('zy', ''.join([
-        '^(?:', '|'.join(num_formats), ')', ',[yY]$'
-    ])),
-    ('ix', ''.join([
-        '^\(', '(?:',
-        '|'.join(num_formats),
-        ')', ',[xX]\)$',
-    ])),
-    ('iy', ''.join([
-        '^\(', '(?:',
-        '|'.join(num_formats),
-        ')', '\),[yY]$',
-    ])),
-    ('i', ''.join([
-        '^\(', '(?:',
-        '|'.join(num_formats),
-        ')', '\)$',
-    ])),
-]
+from .segments import SegmentMap
+from .stats import measure
+
+
+branches = ["BCC", "BCS", "BEQ", "BMI", "BNE", "BPL", "BVC", "BVS"]
+
+# The branch taken in the opposite case, used to jump over a JMP when a
+# branch is relaxed
+inverse = {
+    "BCC": "BCS", "BCS": "BCC", "BEQ": "BNE", "BNE": "BEQ",
+    "BMI": "BPL", "BPL": "BMI", "BVC": "BVS", "BVS": "BVC",
+}
+
+# The instructions that take A as an operand, meaning the accumulator
+accumulator = ["ASL", "LSR", "ROL", "ROR"]
+
+
+# Parsed operands, keyed by their text.  Shared by every Assembler that
+# isn't given a cache of its own.
+operand_cache = LRUCache(4096)
+
+
+class Fixup(object):
+    """A reference to a symbol that is patched into the code buffer as soon
+    as the symbol is defined.
+
+    kind is one of 'abs16', 'zp8', 'rel8', 'word' or 'byte'.  address is
+    where the operand is assembled to, inside segment.  branch numbers the
+    branches that can be relaxed.  For an expression, expr is the
+    Expression and symbol the name it is currently waiting on.
+    """
+    __slots__ = ('segment', 'address', 'kind', 'symbol', 'done', 'branch',
+                 'expr')
+
+    def __init__(self, segment, address, kind, symbol, branch=None,
+                 expr=None):
+        self.segment = segment
+        self.address = address
+        self.kind = kind
+        self.symbol = symbol
+        self.done = False
+        self.branch = branch
+        self.expr = expr
+
+
+def splitArguments(tokens):
+    """Split tokens at each comma into a list of token lists."""
+    args = [[]]
+    for t in tokens:
+        if t.text == ',':
+            args.append([])
+        else:
+            args[-1].append(t)
+    return args
+
+
+def checkByte(n, name=None):
+    """Raise an exception unless n fits in a byte, signed or unsigned.
+    name is the symbol or expression it is the value of, if any."""
+    if not -0x80 <= n <= 0xff:
+        if name is None:
+            raise Exception("Value out of range for a byte: %d" % n)
+        raise Exception("Value out of range for a byte: %s = %d" % (name, n))
+
+
+def packValues(values, size):
+    """Return the numbers values as bytes, or as little-endian words if
+    size is 2."""
+    if size == 1:
+        for n in values:
+            checkByte(n)
+        return bytearray([n & 0xff for n in values])
+    return bytearray(struct.pack('<%dH' % len(values),
+                                 *[n & 0xffff for n in values]))
+
+
+def encodeText(t):
+    """Return the characters of the STRING token t as bytes."""
+    codes = [ord(c) for c in t.value]
+    if codes and max(codes) > 0xff:
+        raise Exception("Character out of range in %s" % t.text)
+    return bytearray(codes)
+
+
+def iterLines(text):
+    """Yield the lines of text one at a time without splitting it all up
+    front."""
+    start = 0
+    while True:
+        end = text.find('\n', start)
+        if end < 0:
+            yield text[start:]
+            return
+        yield text[start:end]
+        start = end + 1
 
 
 class Assembler:
 
-    def __init__(self, org=None):
-        self.symbols = {}
-        self.out = []
+    def __init__(self, org=None, fill=0, cache=None, include_path=None,
+                 units=None, stats=False, hook=None, zero_page=False,
+                 relax=False, max_passes=8, listing=None, macros=None,
+                 max_macro_depth=64, max_macro_lines=1000000,
+                 output_format='bin', symbols=None):
+        self.cache = cache if cache is not None else operand_cache
+        self.units = units if units is not None else unit_cache
+        # Directories searched for .INCLUDE files after the including file's
+        self.includePath = list(include_path or [])
+        # Timings and counters for the last assemble(), if enabled.  hook is
+        # called with them after each one.
+        self.stats = {} if stats or hook is not None else None
+        self.hook = hook
+        # How assemble() writes its output file, one of formats.WRITERS
+        if output_format not in WRITERS:
+            raise Exception("Unknown output format: %s" % output_format)
+        self.output_format = output_format
+        # File object that a listing of each assembly is written to
+        self.listingFile = listing
+        # Macros are nested at most max_macro_depth deep, and at most
+        # max_macro_lines statements are expanded in an assembly
+        self.macroCache = macros if macros is not None else macro_cache
+        self.max_macro_depth = max_macro_depth
+        self.max_macro_lines = max_macro_lines
+        # Size forward references to zero page symbols as zero page, and
+        # turn branches that are out of range into a branch over a JMP,
+        # taking up to max_passes passes to settle.  zeroPage holds the
+        # symbols being assembled as zero page and longBranches the numbers
+        # of the branches that have been relaxed.
+        self.zero_page = zero_page
+        self.relax = relax
+        self.max_passes = max_passes
+        self.fill = fill
         if org is not None:
             self.org = org
-            self.start = self.org
         else:
             self.org = 0
-            self.start = self.org
+        # Symbols given by the caller, which every assembly starts from:
+        # those passed in, and any set in symbols before the first one
+        self.given = dict(symbols or {})
+        # Held while a context() is made and while one is published
+        self.lock = threading.Lock()
+        self.reset()
+        self.symbols = self.given
 
-    def assemble(self, asm, output_dest=None):
-        self.out = []
+    def reset(self):
+        """Set up the state of a new assembly.  Everything set here belongs
+        to one assembly; everything set in __init__ is options and caches,
+        which are only read, so can be shared between threads."""
+        self.directory = ''
+        self.zeroPage = set()
+        self.longBranches = set()
+        self.relaxed = 0
+        self.sizing = False
+        self.sizePasses = 0
+        self.symbols = dict(self.given)
+        self.labels = {}
+        self.start = self.org
+        self.begin()
 
-        if isinstance(asm, str):
-            lines = asm.split('\n')
-        elif isinstance(asm, file):
-            lines = list(asm.readlines())
+    def context(self):
+        """Return an Assembler with the same options and shared caches as
+        this one, and state of its own, to carry out one assembly.  It
+        starts with the symbols given to this one, but none defined by an
+        earlier assembly."""
+        with self.lock:
+            c = copy.copy(self)
+        c.reset()
+        return c
 
-        for l in lines:
-            l = l.strip()
-            if l:
-                if l[0] == ";": #Comment
-                    continue
+    def publish(self, c):
+        """Make the results of the assembly done by the context() c this
+        Assembler's, for callers that read its symbols or segments."""
+        with self.lock:
+            self.__dict__.update(c.__dict__)
 
-                if ";" in l: #Strip trailing comment
-                    l = l[:l.index(";")]
+    def begin(self):
+        """Reset the output and label state ready for a new assembly."""
+        self.segments = SegmentMap()
+        self.setSegment(self.segments.add(self.start))
+        self.labels = {}
+        # Labels defined in a still empty segment, which a following .ORG
+        # would move
+        self.floating = []
+        # Unresolved fixups by symbol name, and in the order they were made
+        self.pending = {}
+        self.unresolved = deque()
+        self.flushed = 0
+        # Paths of the .INCLUDE files being assembled, innermost last
+        self.including = []
+        # Set when the current segment is empty only because it follows an
+        # .INCBIN, so its address is already settled
+        self.contiguous = False
+        # Forward referenced symbols that could use zero page addressing
+        self.candidates = set()
+        # Branches seen so far, and those found to be out of range
+        self.branchCount = 0
+        self.farBranches = []
+        # .CYCLES budgets by label, and the label they would apply to
+        self.budgets = {}
+        self.lastLabel = None
+        # Macros by upper-cased name, and a frozenset of those names, the
+        # one being defined, if any, and counts for local labels and the
+        # expansion limits
+        self.macros = {}
+        self.macroNames = frozenset()
+        self.defining = None
+        self.expansions = 0
+        self.macroDepth = 0
+        self.macroLines = 0
+        # Names made public with .EXPORT, for object files
+        self.exports = []
+        # The number of the source line being assembled, counting from 1,
+        # or None when not assembling one, as while resolving labels
+        self.lineNumber = None
+        if self.stats is not None:
+            self.stats = {'lines': 0, 'instructions': 0, 'fixups': 0}
+        self.listing = None
+        if self.listingFile is not None:
+            self.listing = Listing(self.listingFile)
 
-                tokens = l.split()
+    def assemble(self, asm, output_dest=None, flat=True):
+        """Assemble asm and return the flat binary image, or the SegmentMap
+        if flat is False.
 
-                self.assembleTokens(tokens)
+        asm may be a string, a file object or any other iterable of lines.
+
+        Each call starts from nothing: no symbols are kept from an earlier
+        one.  The work is done in a context() of its own, so one Assembler
+        can be called from many threads at once; its symbols and segments
+        are those of whichever call finished last, so threads that need
+        them should call assemble() on a context() of their own.
+        """
+        c = self.context()
+        try:
+            return c.run(asm, output_dest, flat)
+        finally:
+            self.publish(c)
+
+    def run(self, asm, output_dest=None, flat=True):
+        """Carry out assemble() in this Assembler's own state."""
+        lines = self.lines(asm)
+        if self.stats is not None:
+            measure(self, lines, output_dest)
+        else:
+            if self.zero_page or self.relax:
+                lines = self.size(lines)
+            self.begin()
+            self.assembleLines(lines)
+            self.resolveLabels()
+            self.writeFile(output_dest)
+
+        if not flat:
+            return self.segments
+
+        return self.segments.flatten(self.fill)
+
+    def assemble_iter(self, asm):
+        """Assemble asm lazily, yielding (address, bytes) chunks of output as
+        soon as they can no longer change.
+
+        Chunks are yielded in source order and dropped from memory once
+        yielded, so only the code after the earliest unresolved forward
+        reference is held at any time.  Like assemble(), it works in a
+        context() of its own.
+        """
+        c = self.context()
+        try:
+            for c.lineNumber, line in enumerate(c.lines(asm), 1):
+                c.assembleLine(line)
+                for chunk in c.flush():
+                    yield chunk
+            c.lineNumber = None
+
+            c.resolveLabels()
+            for chunk in c.flush():
+                yield chunk
+        finally:
+            self.publish(c)
+
+    def assembleLines(self, lines):
+        for self.lineNumber, line in enumerate(lines, 1):
+            self.assembleLine(line)
+        self.lineNumber = None
 
-        self.resolveLabels()
+    def writeFile(self, output_dest):
+        """Write the output to the file at the path output_dest, if given.
+        Returns the number of bytes written."""
+        if not output_dest:
+            return 0
+        with open(output_dest, 'wb') as f:
+            return self.writeOutput(f)
 
-        if output_dest:
-            with open(output_dest, 'wb') as f:
-                f.write(bytearray(self.out))
+    def writeOutput(self, f):
+        """Write the output to the file object or descriptor f in the
+        output format.  Returns the number of bytes written."""
+        return writeOutput(f, self.segments, self.output_format, self.fill)
 
+    def lines(self, asm):
+        if isinstance(asm, string_types):
+            self.directory = ''
+            return iterLines(asm)
+        # Includes in a file are relative to it
+        self.directory = os.path.dirname(getattr(asm, 'name', ''))
+        return asm
 
+    def assembleLine(self, line):
+        tokens = tokenize(line)
+        if self.listing is not None:
+            before = self.listing.mark(self)
+            if tokens:
+                self.assembleStatement(tokens)
+            self.listing.add(self, line, tokens, before)
+        elif tokens:
+            self.assembleStatement(tokens)
 
-        return self.out
+    def assembleStatement(self, tokens):
+        self.assembleTokens(tokens)
+        if self.floating and len(self.out):
+            self.fixFloating()
+
+    def size(self, lines):
+        """Find the forward referenced symbols that end up in zero page and
+        the branches that are out of range.
+
+        The program is assembled again with those symbols sized as zero
+        page and those branches relaxed until nothing changes.  Relaxing
+        only adds to the code, so the set of branches only grows.  If
+        nothing has settled after max_passes passes every forward reference
+        is left absolute and any branch still out of range is an error.
+        Returns the lines, to be assembled a final time.
+        """
+        lines = list(lines)
+        # Each statement keeps the number of its line, for errors
+        statements = []
+        for self.lineNumber, line in enumerate(lines, 1):
+            tokens = tokenize(line)
+            if tokens:
+                statements.append((self.lineNumber, tokens))
+        symbols = dict(self.symbols)
+
+        self.zeroPage = set()
+        self.longBranches = set()
+        self.sizing = True
+        try:
+            for self.sizePasses in range(1, self.max_passes + 1):
+                self.symbols = dict(symbols)
+                self.begin()
+                for self.lineNumber, tokens in statements:
+                    self.assembleStatement(tokens)
+                self.lineNumber = None
+                self.resolveLabels()
+
+                fits = set()
+                for v in self.candidates:
+                    n = self.evaluate(v)
+                    if n is not None and 0 <= n <= 0xff:
+                        fits.add(v)
+                if fits == self.zeroPage and not self.farBranches:
+                    break
+                self.zeroPage = fits
+                self.longBranches.update(self.farBranches)
+            else:
+                self.zeroPage = set()
+        finally:
+            self.sizing = False
+
+        self.symbols = symbols
+        self.relaxed = len(self.longBranches)
+        return lines
+
+    def flush(self):
+        """Yield and discard every (address, bytes) chunk of output that is
+        final: everything before the earliest unresolved fixup."""
+        while self.unresolved and self.unresolved[0].done:
+            self.unresolved.popleft()
+        limit = None
+        if self.unresolved:
+            f = self.unresolved[0]
+            limit = (f.segment, f.address)
+        if self.listing is not None and self.listing.pending:
+            # The listing still needs the bytes from its first unwritten
+            # line on, which is never after the earliest fixup
+            i, offset = self.listing.pending[0][2]
+            segment = self.segments.segments[i]
+            limit = (segment, segment.origin + offset)
+
+        segments = self.segments.segments
+        while self.flushed < len(segments):
+            segment = segments[self.flushed]
+            if limit is not None and segment is limit[0]:
+                n = limit[1] - segment.start
+            else:
+                n = len(segment.data)
+
+            if n:
+                yield segment.start, segment.data[:n]
+                segment.discard(n)
+
+            if segment is self.segment or len(segment.data):
+                break
+            self.flushed += 1
+
+    def setSegment(self, segment):
+        self.segment = segment
+        self.out = segment.data
+
+    def pc(self):
+        """Return the address the next byte will be assembled to."""
+        return self.segment.start + len(self.out)
 
     def assembleTokens(self, tokens):
-        op = tokens[0].upper()
-        if op in ops:
+        if self.defining is not None:
+            self.recordMacro(tokens)
+            return
+
+        if tokens[0].kind == LABEL:
+            name = tokens[0].value
+            if self.macros and name.upper() in self.macros and \
+                    (len(tokens) == 1 or tokens[1].text != "="):
+                # A macro invoked at the start of a line
+                self.expandMacro(name.upper(), tokens[1:])
+                return
+            if len(tokens) > 1 and tokens[1].text == "=": #variable
+                if len(tokens) == 3 and tokens[2].text == "*": #label = * is equal to label:
+                    self.defineLabel(name)
+                else:
+                    self.defineVariable(name, self.getValue(tokens[2:]))
+                return
+
+            self.defineLabel(name)
+            if len(tokens) == 1:
+                return
+            tokens = tokens[1:] #Label on same line as code
+
+        op = tokens[0].value
+        if tokens[0].kind == OP and op in ops:
+            if self.stats is not None:
+                self.stats['instructions'] += 1
             if len(tokens) == 1: #Implied
                 self.out.append(ops[op]['im'])
                 return
 
-            t, n = self.getArgument(tokens[1])
-            if n is not None:
+            o = self.getOperand(tokens[1:])
+            if o.value == 'A' and op not in accumulator:
+                # To any other instruction a lone A is a symbol
+                o = Operand('z', symbol=tokens[1].text)
+            t, n, v = self.resolveOperand(o)
+            if op in branches:
+                self.assembleBranch(op, t, n, v, tokens[1:])
+            elif n is not None:
                 # If zero page is not available switch to absolute
                 if t not in ops[op] and t == 'z':
                     t = 'a'
@@ -109,155 +471,629 @@ class Assembler:
                 if t in ['a', 'ax', 'ay', 'i']:
                     self.out.append(n & 0xff)
                     self.out.append(n >> 8)
+                elif n == 'A': #Accumulator has no operand byte
+                    if op not in accumulator:
+                        raise Exception("%s has no accumulator mode" % op)
                 else:
+                    checkByte(n, v.text if isinstance(v, Expression) else v)
                     self.out.append(n)
-            else: #Unresolved variable
-                self.out.append(tokens[0])
-                self.out.append(tokens[1])
-                if op not in ["BCC", "BCS", "BEQ", "BMI", "BNE", "BPL", "BVC"]:
-                    self.out.append("") #Create a blank space to make sure that the length is correct.
-        elif op == ".BYTE":
-            n = self.getNumber(tokens[1])
-            if n:
-                self.out.append(n)
-            else:
-                self.out.append(tokens[1])
-        elif op == ".WORD":
-            n = self.getNumber(tokens[1])
-            if n:
-                self.out.append(n & 0xff)
-                self.out.append(n >> 8)
+            else: #Unresolved symbol, patched in once it is defined
+                if t == 'im' and isinstance(v, Expression):
+                    # Such as #<label; a bare #symbol keeps its full word
+                    self.out.append(ops[op]['im'])
+                    self.addFixup('byte', v)
+                elif t in ['ix', 'iy']:
+                    self.out.append(ops[op][t])
+                    self.addFixup('zp8', v)
+                elif self.zero_page and self.isZeroPage(op, t, v):
+                    self.out.append(ops[op][t])
+                    self.addFixup('zp8', v)
+                else:
+                    # The value isn't known yet so reserve a full word
+                    self.out.append(ops[op][t.replace("z", "a")])
+                    self.addFixup('abs16', v)
+        elif op == ".BYTE" or op == ".WORD":
+            data = self.encodeLiterals(tokens)
+            if data is not None:
+                self.out.extend(data)
             else:
-                self.out.append("WORD")
-                self.out.append(tokens[1])
+                self.encodeData(tokens)
+        elif op == ".TEXT":
+            for arg in splitArguments(tokens[1:]):
+                if len(arg) != 1 or arg[0].kind != STRING:
+                    raise Exception(
+                        "Expected a string at column %d" % tokens[0].col
+                    )
+                self.out.extend(encodeText(arg[0]))
+        elif op == ".FILL":
+            self.encodeFill(tokens)
+        elif op == ".TABLE":
+            self.encodeTable(tokens)
         elif op == ".ORG":
-            n = self.getNumber(tokens[1])
-            #Is this before any code has been generated?  Set the start to this
-            if len(self.out) == 0 or not [i for i in self.out if type(i) != str]:
-                self.start = n
+            self.setOrigin(self.getDefined(tokens[1:]))
+        elif op == ".CYCLES":
+            self.setBudget(self.getDefined(tokens[1:]))
+        elif op == ".EXPORT":
+            self.export(tokens)
+        elif op == ".INCLUDE":
+            if len(tokens) != 2 or tokens[1].kind != STRING:
+                raise Exception(
+                    "Expected a file name at column %d" % tokens[0].col
+                )
+            self.include(tokens[1].value)
+        elif op == ".MACRO":
+            self.defineMacro(tokens)
+        elif op == ".ENDM":
+            raise Exception(".ENDM without .MACRO")
+        elif op in self.macros:
+            self.expandMacro(op, tokens[1:])
+        elif op == ".INCBIN":
+            args = splitArguments(tokens[1:])
+            if len(args) > 3 or len(args[0]) != 1 or args[0][0].kind != STRING:
+                raise Exception(
+                    "Expected a file name at column %d" % tokens[0].col
+                )
+            self.incbin(
+                args[0][0].value, *[self.getDefined(a) for a in args[1:]]
+            )
+        else:
+            raise Exception(
+                "Unknown instruction at column %d: %s" %
+                (tokens[0].col, tokens[0].text)
+            )
+
+    def include(self, name):
+        """Assemble the file name in place of the .INCLUDE line."""
+        path = self.findInclude(name)
+        if path in self.including:
+            raise Exception("Recursive .INCLUDE: %s" % name)
+
+        self.including.append(path)
+        for tokens, data in self.loadUnit(path).statements:
+            if data is not None and self.defining is None:
+                self.out.extend(data)
+                if self.stats is not None and tokens[0].kind == OP:
+                    self.stats['instructions'] += 1
             else:
-                #self.out.extend([0]**n - len)
-                self.out.append("ORG")
-                self.out.append(str(n))
-        else: #Label or variable
-            if len(tokens) > 1 and tokens[1] == "=": #variable
-                if tokens[2] == "*": #label = * is equal to lable:
-                    self.out.append("LABEL")
-                    self.out.append(tokens[0])
-                else:
-                    n  = self.getNumber(tokens[2])
-                    self.symbols[tokens[0]] = n
+                self.assembleTokens(tokens)
+            if self.floating and len(self.out):
+                self.fixFloating()
+        self.including.pop()
+
+    def incbin(self, name, offset=0, length=None):
+        """Place the contents of the file name in the output as a view of a
+        memory map of it, without copying."""
+        view = mapFile(self.findInclude(name), offset, length)
+        if not len(view):
+            return
+
+        # The labels before it now have a settled address
+        self.fixFloating()
+        start = self.pc()
+        self.segments.add(start, view)
+        self.setSegment(self.segments.add(start + len(view)))
+        self.contiguous = True
+
+    def findInclude(self, name):
+        """Return the path of the file to include for name."""
+        if self.including:
+            here = os.path.dirname(self.including[-1])
+        else:
+            here = self.directory
+        for directory in [here] + self.includePath:
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                return os.path.abspath(path)
+        raise Exception("Include file not found: %s" % name)
+
+    def loadUnit(self, path):
+        """Return the parsed Unit for the file at path, from the unit cache
+        when a file with the same contents has been parsed before."""
+        with open(path, 'rb') as f:
+            content = f.read()
+        key = self.units.key(content)
+        unit = self.units.get(key)
+        if unit is None:
+            unit = self.parseUnit(content.decode('utf-8'))
+            self.units.put(key, unit)
+        return unit
+
+    def parseUnit(self, text):
+        """Tokenize text and encode every statement that doesn't depend on
+        a symbol."""
+        unit = Unit()
+        for line in iterLines(text):
+            tokens = tokenize(line)
+            if tokens:
+                unit.statements.append((tokens, self.encodeConstant(tokens)))
+        return unit
+
+    def encodeConstant(self, tokens):
+        """Return the bytes for an instruction whose operand is a literal,
+        or a .BYTE or .WORD list of numbers, or None for anything else.
+        Branches are always None, as every branch is assembled as a fixup,
+        which belongs to the segment it is assembled in."""
+        if tokens[0].value in ('.BYTE', '.WORD'):
+            return self.encodeLiterals(tokens)
+        if tokens[0].kind != OP or tokens[0].value not in ops or \
+                tokens[0].value in branches:
+            return None
+        if len(tokens) > 1:
+            o = self.getOperand(tokens[1:])
+            if o.symbol is not None or o.expr is not None:
+                return None
+
+        out = self.out
+        self.out = bytearray()
+        self.assembleTokens(tokens)
+        data, self.out = self.out, out
+        return data
+
+    def encodeLiterals(self, tokens):
+        """Return the bytes of a .BYTE or .WORD list made up only of plain
+        numbers, packed in one go, or None if it holds anything else."""
+        if len(tokens) % 2:
+            return None
+        for t in tokens[2::2]:
+            if t.text != ',':
+                return None
+        values = tokens[1::2]
+        for t in values:
+            if t.kind != NUMBER:
+                return None
+        return packValues([t.value for t in values],
+                          1 if tokens[0].value == '.BYTE' else 2)
+
+    def encodeData(self, tokens):
+        """Assemble a .BYTE or .WORD list of values, any of which may be
+        a symbol or expression, or for .BYTE a string."""
+        word = tokens[0].value == '.WORD'
+        for arg in splitArguments(tokens[1:]):
+            if not arg:
+                raise Exception(
+                    "Expected a value at column %d" % tokens[0].col
+                )
+            if len(arg) == 1 and arg[0].kind == STRING and not word:
+                self.out.extend(encodeText(arg[0]))
+                continue
+            n = self.getValue(arg)
+            if n is None:
+                self.addFixup('word' if word else 'byte',
+                              self.getReference(arg))
+            elif word:
+                self.out.append(n & 0xff)
+                self.out.append((n >> 8) & 0xff)
             else:
-                self.out.append("LABEL")
-                self.out.append(tokens[0].rstrip(":"))
-                if len(tokens) > 1: #Label on same line as code
-                    self.assembleTokens(tokens[1:])
+                e = self.getExpression(arg)
+                checkByte(n, e.text if isinstance(e, Expression) else e)
+                self.out.append(n & 0xff)
 
-    def resolveLabels(self):
-        i = 0
-        while i < len(self.out):
+    def encodeFill(self, tokens):
+        """Assemble .FILL count[, value]: count bytes of value, or 0."""
+        args = splitArguments(tokens[1:])
+        if len(args) > 2:
+            raise Exception(
+                "Expected a count and a value at column %d" % tokens[0].col
+            )
+        count = self.getDefined(args[0])
+        value = self.getDefined(args[1]) if len(args) == 2 else 0
+        if count < 0:
+            raise Exception("Negative .FILL count: %d" % count)
+        checkByte(value)
+        self.out.extend(bytearray([value & 0xff]) * count)
+
+    def encodeTable(self, tokens):
+        """Assemble .TABLE name, first, last, expression[, size]: the value
+        of expression for name from first to last, as bytes, or as words
+        if size is 2."""
+        args = splitArguments(tokens[1:])
+        if len(args) not in (4, 5) or len(args[0]) != 1 or \
+                args[0][0].kind != SYMBOL or not all(args):
+            raise Exception(
+                "Expected .TABLE name, first, last, expression at column %d"
+                % tokens[0].col
+            )
+        name = args[0][0].value
+        first = self.getDefined(args[1])
+        last = self.getDefined(args[2])
+        size = self.getDefined(args[4]) if len(args) == 5 else 1
+        if size not in (1, 2):
+            raise Exception("Invalid .TABLE size: %d" % size)
 
-            if type(self.out[i]) == str and self.out[i] == "ORG":
-                self.out = self.out[:i] + [0]*(int(self.out[i+1])-i - self.start) + self.out[i+2:]
-            elif type(self.out[i]) == str and self.out[i] == "LABEL":
-                self.out.pop(i) #Remove the "LABEL" tag
-                self.symbols[self.out[i]] = i + self.start #Add the label to the symbols
-                #Resolve this label
-                j = 0
-                l = len(self.out)
+        e = self.getExpression(args[3])
+        count = max(last - first + 1, 0)
+        if e == name:
+            values = range(first, last + 1)
+        elif isinstance(e, int):
+            values = [e] * count
+        else:
+            # Every other symbol must already have a value; look them up
+            # once rather than for each entry
+            names = e.symbols if isinstance(e, Expression) else (e,)
+            known = {}
+            for symbol in names:
+                if symbol != name:
+                    known[symbol] = self.valueOf(symbol)
+                    if known[symbol] is None:
+                        raise Exception("Undefined symbol: %s" % symbol)
+            if not isinstance(e, Expression):
+                values = [known[e]] * count
+            else:
+                values = []
+                lookup = known.get
+                for i in range(first, last + 1):
+                    known[name] = i
+                    values.append(e.evaluate(lookup))
+        self.out.extend(packValues(values, size))
+
+    def defineMacro(self, tokens):
+        """Start recording the body of the macro named by .MACRO name
+        param, ..."""
+        if len(tokens) < 2 or tokens[1].kind != SYMBOL:
+            raise Exception(
+                "Expected a macro name at column %d" % tokens[0].col
+            )
+        name = tokens[1].value
+        if name.upper() in ops:
+            raise Exception("Macro name is an instruction: %s" % name)
+
+        params = []
+        if len(tokens) > 2:
+            for arg in splitArguments(tokens[2:]):
+                if len(arg) != 1 or arg[0].kind != SYMBOL:
+                    raise Exception(
+                        "Expected a parameter name at column %d" %
+                        (arg[0].col if arg else tokens[0].col)
+                    )
+                params.append(arg[0].value)
+        self.defining = (name, params, [])
 
-                # Keep track of the number of 'LABEL' tags that are still in self.out because
-                # we need to compensate for them in branch instructions that go backwards
-                num_labels = 0
+    def recordMacro(self, tokens):
+        """Add a statement to the macro being defined, or finish it at
+        .ENDM."""
+        name, params, body = self.defining
+        if tokens[0].value == ".ENDM":
+            self.macros[name.upper()] = self.macroCache.define(
+                name, params, body
+            )
+            self.macroNames = frozenset(self.macros)
+            self.defining = None
+        elif tokens[0].value == ".MACRO":
+            raise Exception(".MACRO inside macro %s" % name)
+        else:
+            body.append(tokens)
+
+    def expandMacro(self, name, tokens):
+        """Assemble the macro name with the arguments in tokens."""
+        macro = self.macros[name]
+        args = tuple([''.join([t.text for t in arg])
+                      for arg in splitArguments(tokens)]) if tokens else ()
+        statements = macro.expand(args, self.macroNames)
 
-                while j < len(self.out):
-                    if type(self.out[j]) == str and self.out[j] == "LABEL":
-                        num_labels += 1
-                    elif type(self.out[j]) == str and j != i and \
-                        re.search("^[\(#]*%s([\),]|$)" % self.out[i], self.out[j]):
+        if self.macroDepth >= self.max_macro_depth:
+            raise Exception("Macro expansion too deep: %s" % macro.name)
+        self.macroLines += len(statements)
+        if self.macroLines > self.max_macro_lines:
+            raise Exception("Macro expansion too large: %s" % macro.name)
 
-                        if type(self.out[j-1]) == int: #BYTE
-                            self.out[j] = self.getNumber(self.out[j])
-                            continue
-                        elif self.out[j-1] == "WORD":
-                            n = self.getNumber(self.out[j])
-                            self.out[j-1] = n & 0xff
-                            self.out[j] = n >> 8
-                            continue
+        n = self.expansions
+        self.expansions += 1
+        self.macroDepth += 1
+        try:
+            for tokens, local in statements:
+                if local:
+                    tokens = localize(tokens, local, n)
+                self.assembleStatement(tokens)
+        finally:
+            self.macroDepth -= 1
+
+    def assembleBranch(self, op, t, n, v, tokens):
+        """Assemble a branch to the address n, or to v if n isn't known
+        yet.  A known address is made a constant Expression so every
+        branch is range checked, and relaxed, by the same fixup."""
+        if t not in ['z', 'a']:
+            raise Exception(
+                "Invalid branch target at column %d" % tokens[0].col
+            )
+        if n is not None:
+            v = Expression(''.join([t.text for t in tokens]), (),
+                           lambda lookup: n)
+        if self.relax:
+            self.addBranch(op, v)
+        else:
+            self.out.append(ops[op]['z'])
+            self.addFixup('rel8', v)
 
-                        new = []
-                        t, n = self.getArgument(self.out[j])
-                        op = self.out[j-1].upper()
+    def addBranch(self, op, v):
+        """Assemble a branch to v, a symbol or Expression, that can be
+        relaxed, as the inverse branch over a JMP if it was out of range
+        last pass."""
+        n = self.branchCount
+        self.branchCount += 1
+        if n in self.longBranches:
+            self.out.append(ops[inverse[op]]['z'])
+            self.out.append(3)
+            self.out.append(ops['JMP']['a'])
+            self.addFixup('abs16', v)
+        else:
+            self.out.append(ops[op]['z'])
+            self.addFixup('rel8', v, n)
 
-                        if op in ["BCC", "BCS", "BEQ", "BMI", "BNE", "BPL", "BVC"]:
-                            new.append(ops[op]['z'])
-                            c = j + self.start - num_labels*2
-                            if n < c:
-                                d = n - c
-                            else:
-                                d = n - c - 1
+    def isZeroPage(self, op, t, v):
+        """Note v as a symbol that could be zero page in this instruction,
+        and return whether the last sizing pass found that it is."""
+        if t not in ['z', 'zx', 'zy'] or t not in ops[op]:
+            return False
+        self.candidates.add(v)
+        return v in self.zeroPage
 
-                            if d > 127 or d < -128:
-                                    raise Exception("Branch target too far")
+    def export(self, tokens):
+        """Note the names listed after .EXPORT, which only matter when
+        assembling an object file."""
+        for arg in splitArguments(tokens[1:]):
+            if len(arg) != 1 or arg[0].kind != SYMBOL:
+                raise Exception(
+                    "Expected a symbol name at column %d" % tokens[0].col
+                )
+            self.exports.append(arg[0].value)
 
-                            new.append(d & 0xff)
+    def setOrigin(self, n):
+        #Nothing assembled in this segment yet? Just move it.
+        if len(self.out) == 0:
+            for label in self.floating:
+                self.labels[label] = n
+            if len(self.segments) == 0:
+                self.start = n
+            self.segment.rebase(n)
+        else:
+            self.setSegment(self.segments.add(n))
+        self.contiguous = False
 
-                            self.out = self.out[:j-1] + new + self.out[j+1:]
+    def defineVariable(self, name, n):
+        self.symbols[name] = n
+        if n is not None:
+            self.resolveSymbol(name, n)
 
-                        else:
-                            if 'z' in t:
-                                t = t.replace("z", "a")
-                            new.append(ops[op][t])
+    def defineLabel(self, name):
+        if name in self.labels:
+            raise Exception("Label defined twice: %s" % name)
+        self.labels[name] = self.pc()
+        self.lastLabel = name
+        if len(self.out) or self.contiguous:
+            self.resolveSymbol(name, self.labels[name])
+        else:
+            self.floating.append(name)
 
-                            new.append(n & 0xff)
-                            new.append(n >> 8)
+    def fixFloating(self):
+        """Resolve the labels that were waiting on their segment's address."""
+        floating, self.floating = self.floating, []
+        for label in floating:
+            self.resolveSymbol(label, self.labels[label])
 
-                            self.out = self.out[:j-1] + new + self.out[j+2:]
+    def addFixup(self, kind, symbol, branch=None):
+        """Record a reference to symbol, a name or an Expression, at the
+        current position and reserve space for it in the output.  Backward
+        references are patched straight away."""
+        expr = None
+        if isinstance(symbol, Expression):
+            expr, symbol = symbol, self.missingSymbol(symbol)
+        f = Fixup(self.segment, self.pc(), kind, symbol, branch, expr)
+        if self.stats is not None:
+            self.stats['fixups'] += 1
+        if kind in ['abs16', 'word']:
+            self.out.extend(b'\0\0')
+        else:
+            self.out.append(0)
 
-                    j += 1
+        if expr is not None and symbol is None:
+            self.patch(f, None)
+            return
+        if symbol in self.labels and symbol not in self.floating:
+            self.patch(f, self.labels[symbol])
+            return
+        self.pending.setdefault(symbol, []).append(f)
+        self.unresolved.append(f)
 
-                self.out.pop(i)
+    def valueOf(self, name):
+        """Return the settled value of the symbol name, or None."""
+        if name in self.labels:
+            if name in self.floating:
+                return None
+            return self.labels[name]
+        return self.symbols.get(name, None)
 
-            i += 1
+    def missingSymbol(self, expr):
+        """Return the first symbol in expr without a settled value, or None
+        if they all have one."""
+        for name in expr.symbols:
+            if self.valueOf(name) is None:
+                return name
+        return None
 
+    def evaluate(self, v):
+        """Return the value of v, a symbol name or an Expression, once the
+        assembly is complete, or None if it has no fixed value."""
+        if isinstance(v, Expression):
+            return v.evaluate(self.symbols.get)
+        return self.symbols[v]
 
-    def getNumber(self, arg):
-        for i in range(len(num_bases)):
-            if num_bases[i]:
-                s = re.match(num_formats[i], arg)
-                if s and s.group(1):
-                    return int(s.group(1), num_bases[i])
-            else:
-                return self.symbols.get(arg, None)
+    def resolveSymbol(self, name, n):
+        """Patch every fixup waiting on name now that its value is n."""
+        for f in self.pending.pop(name, ()):
+            self.patch(f, n)
 
+    def patch(self, f, n):
+        if f.expr is not None:
+            # An expression waits on each of its symbols in turn
+            missing = self.missingSymbol(f.expr)
+            if missing is not None:
+                f.symbol = missing
+                self.pending.setdefault(missing, []).append(f)
+                return
+            n = f.expr.evaluate(self.valueOf)
+
+        out = f.segment.data
+        i = f.address - f.segment.start
+        if f.kind == 'rel8':
+            d = n - (f.address + 1)
+            if d > 127 or d < -128:
+                if self.sizing and f.branch is not None:
+                    # Relaxed on the next pass
+                    self.farBranches.append(f.branch)
+                    f.done = True
+                    return
+                raise Exception("Branch target too far")
+            out[i] = d & 0xff
+        elif f.kind in ['abs16', 'word']:
+            out[i] = n & 0xff
+            out[i + 1] = n >> 8
+        else:
+            # A sizing pass may place a zero page symbol too high; the
+            # next pass assembles it as absolute
+            if not self.sizing:
+                checkByte(n, f.expr.text if f.expr is not None else f.symbol)
+            out[i] = n & 0xff
+        f.done = True
+
+    def resolveLabels(self):
+        """Finish off the assembly: settle any remaining labels, add them to
+        the symbol table and check nothing is left unresolved."""
+        if self.defining is not None:
+            raise Exception("Missing .ENDM for macro %s" % self.defining[0])
+
+        self.fixFloating()
+        self.symbols.update(self.labels)
+
+        for symbol in self.pending:
+            raise Exception("Undefined symbol: %s" % symbol)
+
+        self.segments.check()
+
+        if self.budgets and not self.sizing:
+            self.checkCycles()
+
+        if self.listing is not None:
+            self.listing.finish(self)
+
+    def setBudget(self, n):
+        """Limit the block the last label starts to n cycles."""
+        if self.lastLabel is None:
+            raise Exception(".CYCLES without a label")
+        self.budgets[self.lastLabel] = n
+
+    def cycles(self):
+        """Return the cycle counts of the assembled code as a list of
+        timing.Blocks, one per label."""
+        # Imported here as the disassembler depends on this module
+        from .timing import analyze
+        return analyze(self.segments, self.labels)
+
+    def checkCycles(self):
+        """Raise an exception if a block takes more than its .CYCLES."""
+        for segment in self.segments.segments:
+            if segment.start != segment.origin:
+                raise Exception(".CYCLES can't be checked when streaming")
+
+        blocks = dict([(b.address, b) for b in self.cycles()])
+        for label, n in sorted(self.budgets.items()):
+            block = blocks.get(self.labels[label])
+            worst = block.max_cycles if block else 0
+            if worst > n:
+                raise Exception(
+                    "Block %s takes up to %d cycles, more than %d" %
+                    (label, worst, n)
+                )
+
+    def getOperand(self, tokens):
+        """Return the Operand for tokens, from the cache when its text has
+        been seen before."""
+        text = ''.join([t.text for t in tokens])
+        o = self.cache.get(text)
+        if o is None:
+            o = self.cacheOperand(tokens, text)
+        return o
+
+    def cacheOperand(self, tokens, text):
+        """Parse tokens and add the Operand to the cache under text."""
+        o = parseOperand(tokens)
+        if o is None:
+            raise Exception("Invalid operand: %s" % text)
+        self.cache.put(text, o)
+        return o
+
+    def getExpression(self, tokens):
+        """Return the compiled expression for tokens: a number, a symbol
+        name or an Expression.  Values are compiled as expressions rather
+        than parsed as operands, where a leading ( would mean indirect, and
+        cached apart from them."""
+        text = ''.join([t.text for t in tokens])
+        key = ('value', text)
+        e = self.cache.get(key)
+        if e is None:
+            e = compileExpression(tokens)
+            if e is None:
+                raise Exception("Invalid expression: %s" % text)
+            self.cache.put(key, e)
+        return e
+
+    def getValue(self, tokens):
+        """Return the value of the expression in tokens, or None if a symbol
+        in it has no settled value yet."""
+        e = self.getExpression(tokens)
+        if isinstance(e, Expression):
+            return e.evaluate(self.valueOf)
+        if isinstance(e, int):
+            return e
+        return self.valueOf(e)
+
+    def getReference(self, tokens):
+        """Return what a fixup for the value of tokens waits on: a symbol
+        name or an Expression."""
+        return self.getExpression(tokens)
+
+    def getDefined(self, tokens):
+        """Return the value of tokens, which must already be defined."""
+        n = self.getValue(tokens)
+        if n is None:
+            e = self.getExpression(tokens)
+            names = e.symbols if isinstance(e, Expression) else (e,)
+            missing = [name for name in names if self.valueOf(name) is None]
+            raise Exception("Undefined symbol: %s" % (missing or names)[0])
+        return n
+
+    def getNumber(self, arg):
+        return self.getValue(tokenize(arg, operand=True))
 
     def getArgument(self, arg):
-        if re.match('A', arg):
-            return ('im', 'A')
-
-        for r in arg_regex:
-            s = re.match(r[1], arg)
-            if s:
-                if s.group(1):
-                    t, n, v  = (r[0], int(s.group(1), 16), s.group(1))
-                    break
-                elif s.group(2):
-                    t, n, v  = (r[0], int(s.group(2), 2), s.group(2))
-                    break
-                elif s.group(3):
-                    t, n, v  = (r[0], int(s.group(3), 8), s.group(3))
-                    break
-                elif s.group(4):
-                    t, n, v  = (r[0], int(s.group(4), 10), s.group(4))
-                    break
-                elif s.group(5):
-                    t, n, v  = (r[0], self.symbols.get(s.group(5), None), s.group(5))
-                    break
+        t, n, v = self.parseArgument(arg)
+        return t, n
+
+    def parseArgument(self, arg):
+        """Return the addressing mode, value and symbol name of arg.  The
+        value is None if the symbol isn't defined yet."""
+        o = self.cache.get(arg)
+        if o is None:
+            o = self.cacheOperand(tokenize(arg, operand=True), arg)
+        return self.resolveOperand(o)
 
-        if t[0] == "z" and n and (n > 0xff or len(v) == 4):
+    def resolveOperand(self, o):
+        """Look up the symbol in Operand o and pick the final addressing
+        mode.  Returns the mode, value and symbol name."""
+        if o.value == 'A':
+            return ('im', 'A', None)
+
+        t, n, v = o.mode, o.value, o.symbol
+        if v is not None:
+            n = self.symbols.get(v, None)
+        elif o.expr is not None:
+            v = o.expr
+            n = v.evaluate(self.symbols.get)
+
+        if t[0] == "z" and n is not None and (n > 0xff or o.wide):
             t = t.replace("z", "a")
 
         if n is not None and n < 0:
+            checkByte(n, v.text if isinstance(v, Expression) else v)
             n = n & 0xff
 
-        return t, n
+        return t, n, v
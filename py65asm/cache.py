@@ -0,0 +1,96 @@
+import threading
+from collections import OrderedDict
+
+try:
+    from _collections import OrderedDict as _COrderedDict
+except ImportError:
+    _COrderedDict = None
+
+
+def _moveToEnd(d, key):
+    # Python 2's OrderedDict has no move_to_end
+    d[key] = d.pop(key)
+
+
+moveToEnd = getattr(OrderedDict, 'move_to_end', _moveToEnd)
+
+# Whether each OrderedDict operation is atomic, as the C implementation's
+# are.  Python 2's is written in Python, so a thread can be switched out
+# halfway through relinking an entry.
+atomic = OrderedDict is _COrderedDict
+
+
+class LRUCache(object):
+    """A bounded mapping that discards the least recently used entry once
+    it holds maxsize items.  hits and misses count lookups through get().
+
+    It can be shared between threads.  Where OrderedDict is the C one each
+    step is a single atomic operation, so no lock is taken, and when two
+    threads race the worst outcome is a miss for an entry another thread
+    is moving, or an extra eviction; hits and misses are then only
+    approximate.  Elsewhere, as on Python 2, every step holds a lock.
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = None if atomic else threading.Lock()
+
+    def get(self, key, default=None):
+        if self.lock is not None:
+            with self.lock:
+                return self.lookup(key, default)
+        return self.lookup(key, default)
+
+    def lookup(self, key, default):
+        try:
+            value = self.data[key]
+            # Moved rather than removed and added again, which would keep
+            # growing the dict's table until it is resized
+            moveToEnd(self.data, key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if self.lock is not None:
+            with self.lock:
+                return self.store(key, value)
+        return self.store(key, value)
+
+    def store(self, key, value):
+        self.data.pop(key, None)
+        self.data[key] = value
+        if len(self.data) > self.maxsize:
+            try:
+                self.data.popitem(last=False)
+            except KeyError:
+                # Emptied by another thread in the meantime
+                pass
+
+    def clear(self):
+        if self.lock is not None:
+            with self.lock:
+                self.data.clear()
+        else:
+            self.data.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self.data),
+            'maxsize': self.maxsize
+        }
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
@@ -0,0 +1,92 @@
+"""
+A thin client for the assembler server: the same command line as py65asm,
+with the work done by a running py65asm-server --socket PATH.
+
+Paths are made absolute, so the server can be started from anywhere.
+Nothing but the option parsing is imported from the package, so the
+client starts quickly.  --jobs is accepted, but the server answers one
+request at a time.
+"""
+
+import json
+import os
+import socket
+import sys
+import time
+
+from .py65asm import parser, makeJobs, report
+
+
+def request(job):
+    """Return the server request for an assembleFile() job."""
+    (source, dest, org, fill, include_path, zero_page, relax, listing,
+     symbols, vice, relocatable, output_format) = job
+
+    def absolute(path):
+        return os.path.abspath(path) if path else None
+
+    return {
+        'path': absolute(source), 'output': absolute(dest),
+        'org': org, 'fill': fill,
+        'include_path': [absolute(d) for d in include_path],
+        'zero_page': zero_page, 'relax': relax,
+        'listing': absolute(listing), 'symbols': absolute(symbols),
+        'vice': vice, 'object': relocatable,
+        'output_format': output_format, 'format': 'none',
+    }
+
+
+def results(path, jobs):
+    """Send the jobs to the server listening at path and yield their
+    (source, dest, size, relaxed, seconds, error) results."""
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.connect(path)
+    try:
+        f = s.makefile('rwb')
+        for job in jobs:
+            f.write(json.dumps(request(job)).encode('utf-8') + b'\n')
+            f.flush()
+            line = f.readline()
+            if not line:
+                raise Exception("The server closed the connection")
+            response = json.loads(line.decode('utf-8'))
+            error = None
+            if not response['ok']:
+                error = '; '.join([
+                    "line %d: %s" % (d['line'], d['message'])
+                    if d.get('line') else d['message']
+                    for d in response['diagnostics']
+                ])
+            yield (job[0], job[1], response.get('size'),
+                   response.get('relaxed', 0), response['seconds'], error)
+        f.close()
+    finally:
+        s.close()
+
+
+def main(argv=None):
+    p = parser()
+    p.prog = 'py65asm-client'
+    p.add_argument('--socket', metavar='PATH',
+                   default=os.environ.get('PY65ASM_SOCKET'),
+                   help='the server socket (default: $PY65ASM_SOCKET)')
+    args = p.parse_args(argv)
+    if args.link:
+        # Linking is quick, so it is done here
+        from .py65asm import linkFiles, linkArguments
+        return report(args, [linkFiles(*linkArguments(p, args))], 1,
+                      time.time())
+    if not args.socket:
+        p.error("give the server's --socket or set PY65ASM_SOCKET")
+    jobs = makeJobs(p, args)
+
+    try:
+        return report(args, results(args.socket, jobs), len(jobs),
+                      time.time())
+    except socket.error as e:
+        sys.stderr.write("py65asm-client: %s: %s\n" % (args.socket, e))
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,187 @@
+"""
+Table-driven disassembler.
+
+The 256-entry opcode table is generated from ops, so anything the
+assembler can produce can be read back, and the listing reassembles to the
+same bytes.
+"""
+
+from .assembler import branches
+from .ops import ops
+
+
+# Operand size for each addressing mode.  'im' covers implied and
+# accumulator instructions as well as immediate ones, see imLength().
+MODE_LENGTHS = {
+    'im': None, 'z': 2, 'zx': 2, 'zy': 2, 'ix': 2, 'iy': 2,
+    'a': 3, 'ax': 3, 'ay': 3, 'i': 3,
+}
+
+OPERAND_FORMATS = {
+    'z': '%s', 'zx': '%s,X', 'zy': '%s,Y', 'ix': '(%s,X)', 'iy': '(%s),Y',
+    'a': '%s', 'ax': '%s,X', 'ay': '%s,Y', 'i': '(%s)',
+}
+
+
+def imLength(opcode):
+    """Return the length of an 'im' instruction: immediate operands are in
+    columns 9 and B of the opcode matrix, plus LDY, LDX, CPY and CPX."""
+    if opcode & 0x0f in (0x09, 0x0b) or opcode in (0xa0, 0xa2, 0xc0, 0xe0):
+        return 2
+    return 1
+
+
+def buildOpcodes():
+    """Return the inverse of ops: a list of (mnemonic, mode, length) for
+    every opcode, or None where an opcode isn't used."""
+    table = [None] * 256
+    for mnemonic, modes in ops.items():
+        for mode, opcode in modes.items():
+            length = MODE_LENGTHS[mode] or imLength(opcode)
+            table[opcode] = (mnemonic, mode, length)
+    return table
+
+
+opcodes = buildOpcodes()
+
+# Instruction length by opcode; unused opcodes are a single .BYTE
+lengths = [entry[2] if entry else 1 for entry in opcodes]
+
+branchOpcodes = frozenset([ops[b]['z'] for b in branches])
+jumpOpcodes = frozenset([ops['JMP']['a'], ops['JSR']['a']])
+
+
+def boundaries(data):
+    """Return the offsets of the instructions in data, decoding from the
+    first byte."""
+    starts = []
+    i = 0
+    n = len(data)
+    while i < n:
+        starts.append(i)
+        i += lengths[data[i]]
+    return starts
+
+
+class Disassembler(object):
+    """Turns an image back into source.
+
+    symbols is a name to value mapping such as Assembler.symbols.  Names
+    are used for the addresses of instructions and for operands; other
+    branch and jump targets get an L<address> label.
+
+    >>> Disassembler({'start': 0x8000}).disassemble(
+    ...     bytearray([0xa9, 0x01, 0xd0, 0xfc]), 0x8000)
+    '.ORG $8000\\nstart: LDA #$01\\n    BNE start'
+    """
+
+    def __init__(self, symbols=None):
+        self.symbols = symbols or {}
+
+    def disassemble(self, data, org=0):
+        """Return the source for data, which starts at address org."""
+        return '\n'.join(self.lines(data, org))
+
+    def lines(self, data, org=0):
+        """Return the source lines for data, which starts at address org."""
+        n = len(data)
+        starts = boundaries(data)
+
+        # The first name, in sorted order, for each value
+        names = {}
+        for name in sorted(self.symbols):
+            if self.symbols[name] is not None:
+                names.setdefault(self.symbols[name], name)
+
+        # Labels are only put on instructions, or the end of the image
+        labels = {}
+        starting = set(starts)
+        starting.add(n)
+        for value, name in names.items():
+            if org <= value <= org + n and value - org in starting:
+                labels[value] = name
+
+        # Branch, JMP and JSR targets get a label if they have no name
+        for i in starts:
+            opcode = data[i]
+            if opcode in branchOpcodes and i + 1 < n:
+                target = self.branchTarget(data, i, org)
+            elif opcode in jumpOpcodes and i + 2 < n:
+                target = data[i + 1] | data[i + 2] << 8
+            else:
+                continue
+            if target not in labels and org <= target <= org + n \
+                    and target - org in starting:
+                labels[target] = "L%04X" % target
+
+        self.names = names
+        self.labels = labels
+        self.variables = set()
+
+        body = [".ORG $%04X" % org]
+        for i in starts:
+            address = org + i
+            for text in self.instruction(data, i, address):
+                if address in labels:
+                    body.append("%s: %s" % (labels[address], text))
+                    address = None
+                else:
+                    body.append("    " + text)
+        if org + n in labels:
+            body.append("%s:" % labels[org + n])
+
+        equates = ["%s = $%02X" % (name, value) if value < 0x100 else
+                   "%s = $%04X" % (name, value)
+                   for value, name in sorted(
+                       [(self.symbols[v], v) for v in self.variables])]
+        return equates + body
+
+    def branchTarget(self, data, i, org):
+        d = data[i + 1]
+        return org + i + 2 + (d - 0x100 if d > 0x7f else d)
+
+    def instruction(self, data, i, address):
+        """Return the source for the instruction at offset i.  This is
+        usually one line, but is a .BYTE line per byte for anything that
+        wouldn't reassemble to the same bytes."""
+        opcode = data[i]
+        entry = opcodes[opcode]
+        if entry is None or i + entry[2] > len(data):
+            return [".BYTE $%02X" % b for b in data[i:i + lengths[opcode]]]
+
+        mnemonic, mode, length = entry
+        if length == 1:
+            return [mnemonic]
+        if mode == 'im':
+            return ["%s #$%02X" % (mnemonic, data[i + 1])]
+
+        if opcode in branchOpcodes:
+            target = self.branchTarget(data, i, address - i)
+            if target not in self.labels:
+                return [".BYTE $%02X" % b for b in data[i:i + 2]]
+            return ["%s %s" % (mnemonic, self.labels[target])]
+
+        if length == 2:
+            operand = self.zeroPage(data[i + 1])
+        else:
+            operand = self.absolute(data[i + 1] | data[i + 2] << 8)
+        return ["%s %s" % (mnemonic, OPERAND_FORMATS[mode] % operand)]
+
+    def zeroPage(self, value):
+        # Labels are always assembled as absolute, so only variables can
+        # name a zero page operand
+        name = self.names.get(value)
+        if name is None or value in self.labels:
+            return "$%02X" % value
+        self.variables.add(name)
+        return name
+
+    def absolute(self, value):
+        if value in self.labels:
+            return self.labels[value]
+        name = self.names.get(value)
+        # A variable below $100 would be assembled as zero page
+        if name is None or value < 0x100:
+            return "$%04X" % value
+        self.variables.add(name)
+        return name
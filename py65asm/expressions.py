@@ -0,0 +1,192 @@
+"""
+Operand expressions.
+
+compileExpression() parses the tokens of an operand once, folding every
+constant sub-expression as it goes.  What is left is either a plain
+number, a single symbol name, or an Expression: a closure over the parse
+tree that is evaluated against the symbol table, when assembling and again
+when a fixup waiting on it is patched.
+
+Operators, from loosest to tightest binding:
+
+    |   ^   &   << >>   + -   * /   unary - < >
+
+Unary < and > take the low and high byte of a value.  Division is integer
+division.
+"""
+
+import operator
+
+from .lexer import NUMBER, SYMBOL, string_types
+
+
+def _divide(a, b):
+    if b == 0:
+        raise Exception("Division by zero")
+    return a // b
+
+
+def _shift(f):
+    def shift(a, b):
+        if b < 0:
+            raise Exception("Negative shift count")
+        return f(a, b)
+    return shift
+
+
+BINARY = {
+    '|': operator.or_, '^': operator.xor, '&': operator.and_,
+    '<<': _shift(operator.lshift), '>>': _shift(operator.rshift),
+    '+': operator.add, '-': operator.sub,
+    '*': operator.mul, '/': _divide,
+}
+
+UNARY = {
+    '-': operator.neg,
+    '<': lambda n: n & 0xff,
+    '>': lambda n: (n >> 8) & 0xff,
+}
+
+# Binary operators by precedence level, loosest first
+LEVELS = [('|',), ('^',), ('&',), ('<<', '>>'), ('+', '-'), ('*', '/')]
+
+
+class _Undefined(Exception):
+    """Raised inside an evaluation when a symbol has no value yet."""
+
+
+class _Invalid(Exception):
+    """Raised by the parser for tokens that aren't an expression."""
+
+
+class Expression(object):
+    """An expression that refers to symbols.  symbols holds their names,
+    in the order they first appear.  Expressions with the same text are
+    equal."""
+    __slots__ = ('text', 'symbols', 'function')
+
+    def __init__(self, text, symbols, function):
+        self.text = text
+        self.symbols = symbols
+        self.function = function
+
+    def evaluate(self, lookup):
+        """Return the value of the expression, using lookup(name) for the
+        value of each symbol, or None if any of them is None."""
+        try:
+            return self.function(lookup)
+        except _Undefined:
+            return None
+
+    def __eq__(self, other):
+        return isinstance(other, Expression) and self.text == other.text
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.text)
+
+    def __repr__(self):
+        return "Expression(%r)" % self.text
+
+
+class _Parser(object):
+    """Recursive descent over a list of tokens, building a tree of ints
+    (constants), strs (symbol names) and (operator, operand, ...) tuples.
+    Constant sub-trees are folded as they are built."""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.i = 0
+        self.names = []
+
+    def peek(self):
+        if self.i < len(self.tokens):
+            return self.tokens[self.i].text
+        return None
+
+    def parse(self):
+        node = self.binary(0)
+        if self.i != len(self.tokens):
+            raise _Invalid()
+        return node
+
+    def binary(self, level):
+        if level == len(LEVELS):
+            return self.unary()
+        node = self.binary(level + 1)
+        while self.peek() in LEVELS[level]:
+            op = self.peek()
+            self.i += 1
+            right = self.binary(level + 1)
+            if isinstance(node, int) and isinstance(right, int):
+                node = BINARY[op](node, right)
+            else:
+                node = (op, node, right)
+        return node
+
+    def unary(self):
+        op = self.peek()
+        if op in UNARY:
+            self.i += 1
+            node = self.unary()
+            if isinstance(node, int):
+                return UNARY[op](node)
+            return (op, node)
+        return self.primary()
+
+    def primary(self):
+        if self.i >= len(self.tokens):
+            raise _Invalid()
+        t = self.tokens[self.i]
+        self.i += 1
+        if t.text == '(':
+            node = self.binary(0)
+            if self.peek() != ')':
+                raise _Invalid()
+            self.i += 1
+            return node
+        if t.kind == NUMBER:
+            return t.value
+        if t.kind == SYMBOL:
+            if t.value not in self.names:
+                self.names.append(t.value)
+            return t.value
+        raise _Invalid()
+
+
+def _compile(node):
+    """Turn a parse tree into a function of a symbol lookup function."""
+    if isinstance(node, int):
+        return lambda lookup: node
+
+    if isinstance(node, string_types):
+        def symbol(lookup):
+            n = lookup(node)
+            if n is None:
+                raise _Undefined()
+            return n
+        return symbol
+
+    if len(node) == 2:
+        f, a = UNARY[node[0]], _compile(node[1])
+        return lambda lookup: f(a(lookup))
+
+    f, a, b = BINARY[node[0]], _compile(node[1]), _compile(node[2])
+    return lambda lookup: f(a(lookup), b(lookup))
+
+
+def compileExpression(tokens):
+    """Compile the expression in tokens.  Returns its value if it is
+    constant, the name if it is a single symbol, an Expression otherwise,
+    or None if tokens aren't a valid expression."""
+    parser = _Parser(tokens)
+    try:
+        node = parser.parse()
+    except _Invalid:
+        return None
+    if isinstance(node, int) or isinstance(node, string_types):
+        return node
+    return Expression(''.join([t.text for t in tokens]),
+                      tuple(parser.names), _compile(node))
@@ -0,0 +1,191 @@
+"""
+Output file formats.
+
+Each writer takes a file object, or a file descriptor, and the output as
+(address, data) chunks: a SegmentMap, or the chunks assemble_iter()
+yields.  Intel HEX and S-records are written a record at a time and leave
+out the gaps between segments; the binary and C64 PRG images fill them.
+Small pieces of output are gathered in a small buffer, and large ones, such
+as an .INCBIN memory map, written straight from where they are, so the
+output is never held whole in memory or copied.
+
+    bin   the flat image
+    prg   the flat image after its two byte load address
+    hex   Intel HEX, 16 byte data records and an end of file record
+    srec  Motorola S-records: S0 header, S1 data records, S9 end
+"""
+
+import binascii
+import os
+
+
+# Bytes buffered before each write to the file; data at least this long
+# is written without going through the buffer
+BUFFER_SIZE = 0x4000
+
+
+class Output(object):
+    """Buffered writes to a file object or descriptor.  written counts the
+    bytes written."""
+
+    def __init__(self, f):
+        if hasattr(f, 'write'):
+            self.write = f.write
+        else:
+            self.write = lambda data: _writeAll(f, data)
+        self.buffer = bytearray()
+        self.written = 0
+
+    def add(self, data):
+        if len(data) >= BUFFER_SIZE:
+            self.flush()
+            self.write(data)
+            self.written += len(data)
+            return
+        self.buffer.extend(data)
+        if len(self.buffer) >= BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.write(self.buffer)
+            self.written += len(self.buffer)
+            self.buffer = bytearray()
+
+
+def _writeAll(fd, data):
+    view = memoryview(data)
+    while len(view):
+        view = view[os.write(fd, view):]
+
+
+def _records(chunks, size):
+    """Split chunks into (address, data) records of size bytes, running on
+    from one chunk to the next where they are contiguous, so the small
+    chunks of a streamed assembly give the same records as a whole one."""
+    address = None
+    record = bytearray()
+    for start, data in chunks:
+        if record and start != address + len(record):
+            yield address, record
+            record = bytearray()
+        if not record:
+            address = start
+        i = 0
+        while i < len(data):
+            n = size - len(record)
+            record.extend(data[i:i + n])
+            i += n
+            if len(record) == size:
+                yield address, record
+                address += size
+                record = bytearray()
+    if record:
+        yield address, record
+
+
+def _image(chunks, fill):
+    """Yield the data of chunks, which must be in ascending address order,
+    with the gaps between them filled with fill.  The first item is the
+    address of the image, or None if it is empty."""
+    address = None
+    for start, data in chunks:
+        if not len(data):
+            continue
+        if address is None:
+            yield start
+        elif start < address:
+            raise Exception("Output at $%04X after $%04X: the image needs "
+                            "ascending addresses" % (start, address))
+        elif start > address:
+            gap = start - address
+            chunk = bytearray([fill]) * min(gap, BUFFER_SIZE)
+            while gap > len(chunk):
+                yield chunk
+                gap -= len(chunk)
+            yield chunk[:gap]
+        yield data
+        address = start + len(data)
+    if address is None:
+        yield None
+
+
+def writeBinary(f, chunks, fill=0):
+    """Write the flat image.  Returns the number of bytes written."""
+    out = Output(f)
+    image = _image(chunks, fill)
+    next(image)
+    for data in image:
+        out.add(data)
+    out.flush()
+    return out.written
+
+
+def writePrg(f, chunks, fill=0):
+    """Write a C64 PRG file: the load address, then the flat image."""
+    out = Output(f)
+    image = _image(chunks, fill)
+    start = next(image)
+    if start is None:
+        raise Exception("Nothing to write to a PRG file")
+    out.add(bytearray([start & 0xff, start >> 8]))
+    for data in image:
+        out.add(data)
+    out.flush()
+    return out.written
+
+
+def _hex(data):
+    return binascii.hexlify(bytes(data)).upper()
+
+
+def writeIntelHex(f, chunks, fill=0, record_size=16):
+    """Write Intel HEX records of up to record_size bytes.  fill is unused,
+    as gaps aren't written."""
+    out = Output(f)
+    for address, data in _records(chunks, record_size):
+        record = bytearray([len(data), address >> 8, address & 0xff, 0])
+        record.extend(data)
+        record.append(-sum(record) & 0xff)
+        out.add(b':' + _hex(record) + b'\n')
+    out.add(b':00000001FF\n')
+    out.flush()
+    return out.written
+
+
+def _srecord(kind, address, data):
+    record = bytearray([len(data) + 3, address >> 8, address & 0xff])
+    record.extend(data)
+    record.append(~sum(record) & 0xff)
+    return kind + _hex(record) + b'\n'
+
+
+def writeSRecords(f, chunks, fill=0, record_size=16, entry=0):
+    """Write Motorola S-records of up to record_size bytes, ending with the
+    entry address.  fill is unused, as gaps aren't written."""
+    out = Output(f)
+    out.add(_srecord(b'S0', 0, b''))
+    for address, data in _records(chunks, record_size):
+        out.add(_srecord(b'S1', address, data))
+    out.add(_srecord(b'S9', entry, b''))
+    out.flush()
+    return out.written
+
+
+WRITERS = {
+    'bin': writeBinary,
+    'prg': writePrg,
+    'hex': writeIntelHex,
+    'srec': writeSRecords,
+}
+
+# The usual file extension for each format
+EXTENSIONS = {'bin': '.bin', 'prg': '.prg', 'hex': '.hex', 'srec': '.s19'}
+
+
+def writeOutput(f, chunks, fmt='bin', fill=0):
+    """Write chunks to f in the format fmt, one of WRITERS.  Returns the
+    number of bytes written."""
+    if fmt not in WRITERS:
+        raise Exception("Unknown output format: %s" % fmt)
+    return WRITERS[fmt](f, chunks, fill=fill)
@@ -0,0 +1,119 @@
+"""
+Loading of .INCLUDE and .INCBIN files.
+
+An included file is tokenized once and every instruction that doesn't
+refer to a symbol is encoded up front.  The result is kept in memory, and
+optionally on disk, under a hash of the file's contents and UNIT_FORMAT,
+so a library included by every build is only parsed once.
+
+.INCBIN files are memory mapped, and the view is passed through to the
+output without copying.
+"""
+
+import hashlib
+import mmap
+import os
+import pickle
+import sys
+import threading
+
+from .cache import LRUCache
+
+
+# The version of what a Unit holds.  Bump it whenever how statements are
+# tokenized or encoded changes, so Units stored on disk by an older
+# assembler aren't used.
+UNIT_FORMAT = 2
+
+
+class Unit(object):
+    """The parsed form of a source file: a list of (tokens, data)
+    statements.  data is the encoded bytes of a statement that doesn't
+    depend on any symbol, or None if tokens must be assembled in place."""
+    __slots__ = ('statements',)
+
+    def __init__(self, statements=None):
+        self.statements = statements if statements is not None else []
+
+
+class UnitCache(object):
+    """Parsed Units keyed by content hash, held in an LRU and also stored
+    as pickles under directory if one is given."""
+
+    def __init__(self, maxsize=256, directory=None):
+        self.memory = LRUCache(maxsize)
+        self.directory = directory
+
+    def key(self, content):
+        """Return the cache key for the bytes content."""
+        h = hashlib.sha1(str(UNIT_FORMAT).encode('ascii'))
+        h.update(b'\0')
+        h.update(content)
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.unit')
+
+    def get(self, key):
+        unit = self.memory.get(key)
+        if unit is None and self.directory is not None:
+            try:
+                with open(self.path(key), 'rb') as f:
+                    unit = pickle.load(f)
+            except Exception:
+                # Missing or unreadable, either way it is parsed again
+                return None
+            self.memory.put(key, unit)
+        return unit
+
+    def put(self, key, unit):
+        self.memory.put(key, unit)
+        if self.directory is not None:
+            if not os.path.isdir(self.directory):
+                try:
+                    os.makedirs(self.directory)
+                except OSError:
+                    # Made by another thread or process since
+                    if not os.path.isdir(self.directory):
+                        raise
+            # Write then rename so another process, or thread, never reads
+            # half a file
+            path = self.path(key)
+            tmp = '%s.%d.%d.tmp' % (path, os.getpid(),
+                                    threading.current_thread().ident)
+            with open(tmp, 'wb') as f:
+                pickle.dump(unit, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, path)
+
+    def clear(self):
+        self.memory.clear()
+
+
+def mapFile(path, offset=0, length=None):
+    """Return a read-only memoryview of length bytes of the file at path,
+    starting at offset, backed by a memory map rather than read in.  On
+    Python 2 it is a bytearray of them."""
+    size = os.path.getsize(path)
+    if length is None:
+        length = size - offset
+    if offset < 0 or length < 0 or offset + length > size:
+        raise Exception(
+            "Range $%X+$%X is outside %s ($%X bytes)" %
+            (offset, length, path, size)
+        )
+    if length == 0:
+        return memoryview(b'')
+
+    with open(path, 'rb') as f:
+        if sys.version_info[0] < 3:
+            # Python 2 can't make a memoryview of a memory map, so the
+            # range is read in instead
+            f.seek(offset)
+            return bytearray(f.read(length))
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    # The view keeps the map open for as long as the output needs it
+    return memoryview(m)[offset:offset + length]
+
+
+# Shared by every Assembler that isn't given a UnitCache of its own
+unit_cache = UnitCache()
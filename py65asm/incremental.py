@@ -0,0 +1,373 @@
+"""
+Incremental re-assembly for editors and watch workflows.
+
+A Session keeps the parsed form and address of every line of a program.
+update() re-tokenizes only the lines that changed, moves the addresses of
+the lines that follow them until the layout is back in step, and re-patches
+only the references to labels that moved.  The output always matches a full
+Assembler.assemble of the same text.
+"""
+
+from .assembler import Assembler
+from .expressions import Expression
+from .segments import Segment, SegmentMap
+from .lexer import tokenize
+
+
+class Line(object):
+    """One source line: its encoded bytes with operands left zeroed, the
+    (offset, kind, symbol) fixups into them, and its place in the layout.
+
+    pc and empty are the assembly state before the line: the address of the
+    next byte and whether the current segment is still empty.  address is
+    where the line's own bytes start (after any .ORG on it).
+    """
+    __slots__ = ('text', 'label', 'org', 'variable', 'data', 'fixups',
+                 'pc', 'empty', 'address')
+
+    def __init__(self, text):
+        self.text = text
+        self.label = None
+        self.org = None
+        self.variable = None
+        self.data = None
+        self.fixups = []
+        self.pc = None
+        self.empty = None
+        self.address = None
+
+
+class LineEncoder(Assembler):
+    """An Assembler that encodes a single line into a Line, recording its
+    labels, variables, .ORG and fixups rather than acting on them."""
+
+    def encode(self, text, symbols):
+        line = Line(text)
+        self.line = line
+        self.symbols = symbols
+        self.setSegment(Segment(0))
+        tokens = tokenize(text)
+        if tokens:
+            self.assembleTokens(tokens)
+        line.data = self.out
+        return line
+
+    def defineLabel(self, name):
+        self.line.label = name
+
+    def defineVariable(self, name, n):
+        self.line.variable = (name, n)
+        self.symbols[name] = n
+
+    def setOrigin(self, n):
+        self.line.org = n
+
+    def include(self, name):
+        raise Exception(".INCLUDE is not supported in incremental sessions")
+
+    def incbin(self, name, offset=0, length=None):
+        raise Exception(".INCBIN is not supported in incremental sessions")
+
+    def setBudget(self, n):
+        raise Exception(".CYCLES is not supported in incremental sessions")
+
+    def defineMacro(self, tokens):
+        raise Exception(".MACRO is not supported in incremental sessions")
+
+    def addFixup(self, kind, symbol, branch=None):
+        self.line.fixups.append((len(self.out), kind, symbol))
+        if kind in ['abs16', 'word']:
+            self.out.extend(b'\0\0')
+        else:
+            self.out.append(0)
+
+
+class _Visible(object):
+    """The variables defined before line index, as seen when encoding a
+    line there."""
+
+    def __init__(self, session, index):
+        self.session = session
+        self.index = index
+
+    def get(self, name, default=None):
+        i = self.session.variableLines.get(name)
+        if i is None or i >= self.index:
+            return default
+        return self.session.variables[name]
+
+    def __setitem__(self, name, value):
+        pass
+
+
+def _names(symbol):
+    """Return the names a fixup's symbol, a name or an Expression, refers
+    to."""
+    if isinstance(symbol, Expression):
+        return symbol.symbols
+    return (symbol,)
+
+
+def _splitLines(text):
+    if isinstance(text, str):
+        return text.splitlines()
+    return list(text)
+
+
+class Session(object):
+    """An incrementally re-assembled program.
+
+    >>> s = Session("start: LDA #1\\nJMP start")
+    >>> s.update((0, 1), "start: LDA $1234")
+    >>> s.output()
+    bytearray(b'\\xad4\\x12L\\x00\\x00')
+    """
+
+    def __init__(self, text='', org=None, fill=0, cache=None):
+        self.encoder = LineEncoder(org, fill, cache)
+        self.start = self.encoder.start
+        self.fill = fill
+        self.load(text)
+
+    def load(self, text):
+        """Assemble text from scratch."""
+        self.lines = []
+        # Label and variable values, used to patch fixups
+        self.symbols = {}
+        # Lines defining each label, and the labels defined more than once
+        self.definers = {}
+        self.duplicates = set()
+        # Variable values (the first defined one, which is what fixups see)
+        # and the index of the line defining them
+        self.variables = {}
+        self.variableLines = {}
+        # Set if any variable is defined twice, which makes the value seen
+        # by a line depend on more than its position
+        self.redefined = False
+        # Lines with fixups referring to each symbol
+        self.refs = {}
+        # Lines whose fixups couldn't be patched, and why
+        self.problems = {}
+
+        known = {}
+        for i, text in enumerate(_splitLines(text)):
+            line = self.encoder.encode(text, known)
+            self.lines.append(line)
+            self.register(line, i)
+
+        self.layout(0, len(self.lines))
+        for line in self.lines:
+            if line.fixups:
+                self.patch(line)
+
+    def text(self):
+        return '\n'.join([line.text for line in self.lines])
+
+    def update(self, line_range, new_text):
+        """Replace lines [start, end) of the source with new_text, which may
+        be a string or a list of lines, and re-assemble what it affects."""
+        start, end = line_range
+        texts = _splitLines(new_text)
+        old = self.lines[start:end]
+
+        visible = _Visible(self, start)
+        new = [self.encoder.encode(text, visible) for text in texts]
+
+        # Variables change how every later line is encoded, and removing a
+        # duplicate label leaves the other definition's value unknown
+        if self.redefined or [line for line in old + new if line.variable] \
+                or [line for line in old if line.label in self.duplicates]:
+            self.load(
+                [line.text for line in self.lines[:start]] + texts +
+                [line.text for line in self.lines[end:]]
+            )
+            return
+
+        moved = set()
+        for line in old:
+            self.unregister(line, moved)
+
+        self.lines[start:end] = new
+        delta = len(new) - len(old)
+        if delta:
+            for name, i in self.variableLines.items():
+                if i >= end:
+                    self.variableLines[name] = i + delta
+
+        for i, line in enumerate(new):
+            self.register(line, start + i)
+
+        moved_labels, shifted = self.layout(start, start + len(new))
+        moved.update(moved_labels)
+
+        repatch = set([line for line in new if line.fixups])
+        repatch.update(shifted)
+        for name in moved:
+            repatch.update(self.refs.get(name, ()))
+        for line in repatch:
+            self.patch(line)
+
+    def register(self, line, index):
+        if line.label is not None:
+            definers = self.definers.setdefault(line.label, [])
+            definers.append(line)
+            if len(definers) > 1:
+                self.duplicates.add(line.label)
+
+        if line.variable is not None:
+            name, n = line.variable
+            if name in self.variableLines:
+                self.redefined = True
+            else:
+                self.variableLines[name] = index
+            if n is not None and name not in self.variables:
+                self.variables[name] = n
+                self.symbols[name] = n
+
+        for offset, kind, symbol in line.fixups:
+            for name in _names(symbol):
+                self.refs.setdefault(name, set()).add(line)
+
+    def unregister(self, line, moved):
+        """Forget a line that is being removed; labels that it defined are
+        added to moved."""
+        if line.label is not None:
+            definers = self.definers[line.label]
+            definers.remove(line)
+            if len(definers) < 2:
+                self.duplicates.discard(line.label)
+            if not definers:
+                del self.definers[line.label]
+                self.symbols.pop(line.label, None)
+                moved.add(line.label)
+
+        for offset, kind, symbol in line.fixups:
+            for name in _names(symbol):
+                self.refs[name].discard(line)
+
+        self.problems.pop(line, None)
+
+    def layout(self, first, last):
+        """Recompute addresses from line first onwards, stopping once past
+        line last when the layout is back in step with what it was.
+
+        Returns the labels whose value changed and the lines with branches
+        that moved.
+        """
+        lines = self.lines
+
+        # Start after the last line with code so no label is left waiting
+        # for its segment's address
+        while first > 0 and not lines[first - 1].data:
+            first -= 1
+        if first == 0:
+            pc, empty = self.start, True
+        else:
+            previous = lines[first - 1]
+            pc, empty = previous.address + len(previous.data), False
+
+        moved = set()
+        shifted = []
+        floating = []
+        symbols = self.symbols
+
+        for i in range(first, len(lines)):
+            line = lines[i]
+            if i >= last and not empty and line.pc == pc and not line.empty:
+                break
+
+            line.pc = pc
+            line.empty = empty
+
+            if line.label is not None:
+                if empty:
+                    floating.append(line.label)
+                elif symbols.get(line.label) != pc:
+                    symbols[line.label] = pc
+                    moved.add(line.label)
+
+            if line.org is not None:
+                if empty:
+                    for label in floating:
+                        if symbols.get(label) != line.org:
+                            symbols[label] = line.org
+                            moved.add(label)
+                pc = line.org
+                empty = True
+
+            if line.address != pc and line.fixups:
+                shifted.append(line)
+            line.address = pc
+
+            if line.data:
+                for label in floating:
+                    if symbols.get(label) != pc:
+                        symbols[label] = pc
+                        moved.add(label)
+                floating = []
+                empty = False
+                pc += len(line.data)
+
+        for label in floating:
+            if symbols.get(label) != pc:
+                symbols[label] = pc
+                moved.add(label)
+
+        return moved, shifted
+
+    def patch(self, line):
+        """Write the current values of line's fixups into its bytes."""
+        self.problems.pop(line, None)
+        out = line.data
+        for offset, kind, symbol in line.fixups:
+            if isinstance(symbol, Expression):
+                n = symbol.evaluate(self.symbols.get)
+            else:
+                n = self.symbols.get(symbol)
+            if n is None:
+                continue
+
+            if kind == 'rel8':
+                d = n - (line.address + offset + 1)
+                if d > 127 or d < -128:
+                    self.problems[line] = "Branch target too far"
+                    continue
+                out[offset] = d & 0xff
+            elif kind in ['abs16', 'word']:
+                out[offset] = n & 0xff
+                out[offset + 1] = n >> 8
+            else:
+                if not -0x80 <= n <= 0xff:
+                    name = symbol.text if isinstance(symbol, Expression) \
+                        else symbol
+                    self.problems[line] = \
+                        "Value out of range for a byte: %s = %d" % (name, n)
+                    continue
+                out[offset] = n & 0xff
+
+    def check(self):
+        """Raise an exception for anything a full assembly would reject."""
+        for label in self.duplicates:
+            raise Exception("Label defined twice: %s" % label)
+        for symbol, lines in self.refs.items():
+            if lines and symbol not in self.symbols:
+                raise Exception("Undefined symbol: %s" % symbol)
+        for line, problem in self.problems.items():
+            raise Exception("%s: %s" % (problem, line.text.strip()))
+
+    def segments(self):
+        """Return the program as a SegmentMap."""
+        self.check()
+        segments = SegmentMap()
+        current = None
+        for line in self.lines:
+            if line.data:
+                if current is None or line.address != current.end:
+                    current = segments.add(line.address)
+                current.data.extend(line.data)
+        segments.check()
+        return segments
+
+    def output(self):
+        """Return the flat binary image, as Assembler.assemble would."""
+        return self.segments().flatten(self.fill)
@@ -0,0 +1,277 @@
+"""
+A hand-written lexer for 6502 assembly source.
+
+tokenize() makes a single left-to-right pass over a line and returns a list
+of Tokens, classifying each one as it goes.  parseOperand() turns the tokens
+following a mnemonic into an Operand (addressing mode plus literal value,
+symbol name or expression).
+"""
+
+from .ops import ops
+
+
+LABEL = 'label'
+OP = 'op'
+DIRECTIVE = 'directive'
+SYMBOL = 'symbol'
+NUMBER = 'number'
+STRING = 'string'
+REGISTER = 'register'
+PUNCT = 'punct'
+
+# The types of names and text: on Python 2 they may be str or unicode, as
+# read from a JSON object file for instance
+string_types = (str, type(u''))
+
+WHITESPACE = frozenset(' \t\r\n\f\v')
+DIGITS = frozenset('0123456789')
+HEX_DIGITS = frozenset('0123456789abcdefABCDEF')
+OCT_DIGITS = frozenset('01234567')
+BIN_DIGITS = frozenset('01')
+IDENT_START = frozenset(
+    'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_'
+)
+IDENT_CHARS = IDENT_START | DIGITS
+# Operands can also use the name@<number> of a label local to a macro
+# expansion, as an object file's relocations do, which source can't
+OPERAND_CHARS = IDENT_CHARS | frozenset('@')
+PUNCTUATION = frozenset('#(),=*:<>+-/&|^')
+
+
+class Token(object):
+    """A lexical token.  col is the offset of its first character in the
+    line; value is the integer for numbers, the upper-cased name for
+    mnemonics, directives and registers, and the contents for strings."""
+    __slots__ = ('kind', 'text', 'value', 'col')
+
+    def __init__(self, kind, text, value, col):
+        self.kind = kind
+        self.text = text
+        self.value = value
+        self.col = col
+
+    def __eq__(self, other):
+        return isinstance(other, Token) and \
+            (self.kind, self.text, self.value, self.col) == \
+            (other.kind, other.text, other.value, other.col)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "Token(%r, %r, %r, %d)" % (
+            self.kind, self.text, self.value, self.col
+        )
+
+
+class Operand(object):
+    """The parsed form of an operand.
+
+    Exactly one of value (a literal, or a constant expression), symbol (a
+    name to be looked up) and expr (an Expression referring to symbols) is
+    set.  wide is True for literals written with four digits, which are
+    always assembled as absolute addresses.
+    """
+    __slots__ = ('mode', 'value', 'symbol', 'wide', 'expr')
+
+    def __init__(self, mode, value=None, symbol=None, wide=False, expr=None):
+        self.mode = mode
+        self.value = value
+        self.symbol = symbol
+        self.wide = wide
+        self.expr = expr
+
+
+def tokenize(line, operand=False):
+    """Split line into Tokens, stopping at a comment.
+
+    The first identifier on the line is a LABEL unless it is a mnemonic, and
+    the identifier after a label is an OP.  If operand is True the whole line
+    is treated as an operand, with no label or mnemonic, and names may
+    contain @.  << and >> are single tokens.
+    """
+    tokens = []
+    append = tokens.append
+    n = len(line)
+    i = 0
+    # Whether we are still looking for a label / mnemonic
+    head = not operand
+
+    # Local names for the sets used in the inner loops
+    whitespace = WHITESPACE
+    ident_chars = OPERAND_CHARS if operand else IDENT_CHARS
+
+    while i < n:
+        c = line[i]
+
+        if c in whitespace:
+            i += 1
+            continue
+
+        if c == ';':
+            break
+
+        start = i
+
+        if c in IDENT_START or (c == '.' and head):
+            i += 1
+            while i < n and line[i] in ident_chars:
+                i += 1
+            text = line[start:i]
+            upper = text.upper()
+
+            if c == '.':
+                append(Token(DIRECTIVE, text, upper, start))
+                head = False
+            elif head and upper in ops:
+                append(Token(OP, text, upper, start))
+                head = False
+            elif head and not tokens:
+                append(Token(LABEL, text, text, start))
+            elif head:
+                # The name following a label
+                append(Token(OP, text, upper, start))
+                head = False
+            elif upper in ('X', 'Y') and tokens and tokens[-1].text == ',' \
+                    and _endsOperand(line, i, tokens, operand):
+                append(Token(REGISTER, text, upper, start))
+            elif upper == 'A' and _onlyOperand(line, i, tokens, operand):
+                # The accumulator, for the instructions that have that
+                # mode; the assembler reads it as a symbol for the rest
+                append(Token(REGISTER, text, upper, start))
+            else:
+                append(Token(SYMBOL, text, text, start))
+
+        elif c in DIGITS or c == '$' or c == '%':
+            if c == '$':
+                i += 1
+                digits = HEX_DIGITS
+                base = 16
+            elif c == '%':
+                i += 1
+                digits = BIN_DIGITS
+                base = 2
+            elif c == '0' and i + 1 < n and line[i + 1] in OCT_DIGITS:
+                i += 1
+                digits = OCT_DIGITS
+                base = 8
+            else:
+                digits = DIGITS
+                base = 10
+
+            d = i
+            while i < n and line[i] in digits:
+                i += 1
+            if i == d or (i < n and line[i] in ident_chars):
+                raise Exception(
+                    "Invalid number at column %d: %s" % (start, line[start:])
+                )
+            append(Token(NUMBER, line[start:i], int(line[d:i], base), start))
+
+        elif c == '"':
+            i = line.find('"', i + 1)
+            if i < 0:
+                raise Exception("Unterminated string at column %d" % start)
+            i += 1
+            append(Token(STRING, line[start:i], line[start + 1:i - 1], start))
+
+        elif c in PUNCTUATION:
+            i += 1
+            if c == ':' and tokens and tokens[-1].kind == LABEL:
+                continue
+            if c in '<>' and i < n and line[i] == c:
+                i += 1
+                append(Token(PUNCT, c + c, c + c, start))
+                continue
+            if c == '=' and head:
+                head = False
+            append(Token(PUNCT, c, c, start))
+
+        else:
+            raise Exception(
+                "Unexpected character %r at column %d" % (c, start)
+            )
+
+    return tokens
+
+
+def _onlyOperand(line, i, tokens, operand):
+    """Is the identifier ending at i the entire operand?"""
+    if tokens and tokens[-1].kind != OP:
+        return False
+    if not tokens and not operand:
+        return False
+    rest = line[i:].lstrip()
+    return not rest or rest[0] == ';'
+
+
+def _endsOperand(line, i, tokens, operand):
+    """Is the identifier ending at i the end of an instruction's operand,
+    or of the (zp,X) in one, where it can be an index register?  Anywhere
+    else, such as in a directive's list, it is a symbol."""
+    if not operand and not any([t.kind == OP for t in tokens[:2]]):
+        return False
+    rest = line[i:].lstrip()
+    if rest[:1] == ')':
+        rest = rest[1:].lstrip()
+    return not rest or rest[0] == ';'
+
+
+def parseOperand(tokens):
+    """Return the Operand described by the tokens following a mnemonic, or
+    None if they don't form a valid operand."""
+    n = len(tokens)
+    if n == 0:
+        return None
+
+    first = tokens[0]
+    if n == 1 and first.kind == REGISTER and first.value == 'A':
+        return Operand('im', 'A')
+
+    if first.text == '#':
+        return _operand('im', tokens, 1, n)
+
+    if first.text == '(':
+        if tokens[-1].text == ')':
+            if n > 3 and tokens[-2].value == 'X' and tokens[-3].text == ',':
+                return _operand('ix', tokens, 1, n - 3)
+            return _operand('i', tokens, 1, n - 1)
+        if n > 3 and tokens[-1].value == 'Y' and tokens[-2].text == ',' \
+                and tokens[-3].text == ')':
+            return _operand('iy', tokens, 1, n - 3)
+        return None
+
+    if n > 2 and tokens[-1].kind == REGISTER and tokens[-2].text == ',':
+        mode = 'zx' if tokens[-1].value == 'X' else 'zy'
+        return _operand(mode, tokens, 0, n - 2)
+
+    return _operand('z', tokens, 0, n)
+
+
+def _operand(mode, tokens, start, end):
+    """Build an Operand from the literal, symbol or expression in
+    tokens[start:end]."""
+    if end - start != 1:
+        # Only parsed on a cache miss, so imported here, which also keeps
+        # the import of lexer from expressions one way
+        from .expressions import compileExpression
+        e = compileExpression(tokens[start:end])
+        if e is None:
+            return None
+        if isinstance(e, int):
+            return Operand(mode, e)
+        if isinstance(e, string_types):
+            return Operand(mode, symbol=e)
+        return Operand(mode, expr=e)
+
+    t = tokens[start]
+    if t.kind == NUMBER:
+        digits = t.text
+        if digits[0] in '$%0' and len(digits) > 1:
+            digits = digits[1:]
+        return Operand(mode, t.value, wide=len(digits) == 4)
+
+    if t.kind == SYMBOL:
+        return Operand(mode, symbol=t.value)
+
+    return None
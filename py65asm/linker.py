@@ -0,0 +1,93 @@
+"""
+Links ObjectModules (see objects.py) into a program.
+
+The relocatable code of each module is placed straight after the previous
+module's, in the order given, and the sections fixed by an .ORG stay where
+they are.  Each relocation is then evaluated once against the module's own
+symbols and the ones exported by every module, so linking takes time in
+proportion to the size of the objects.
+"""
+
+from .expressions import compileExpression
+from .lexer import tokenize, string_types
+from .segments import SegmentMap
+
+
+def link(modules, org=0):
+    """Link modules, placing the first module's relocatable code at org.
+    Returns the SegmentMap of the program and the exported symbols with
+    their final values."""
+    bases = []
+    exports = {}
+    owners = {}
+    base = org
+    for m in modules:
+        bases.append(base)
+        for name in m.exports:
+            if name in exports:
+                raise Exception("Symbol %s exported by both %s and %s" % (
+                    name, owners[name], m.name
+                ))
+            v, relocatable = m.symbols[name]
+            exports[name] = v + base if relocatable else v
+            owners[name] = m.name
+        base += m.size
+    if base > 0x10000:
+        raise Exception("Linked code ends past $FFFF: $%X" % base)
+
+    segments = SegmentMap()
+    # Relocation texts compiled so far, shared between modules
+    compiled = {}
+    for m, base in zip(modules, bases):
+        placed = [
+            segments.add(s.start + base if s.relocatable else s.start,
+                         bytearray(s.data))
+            for s in m.sections
+        ]
+
+        values = {}
+        for name, (v, relocatable) in m.symbols.items():
+            values[name] = v + base if relocatable else v
+
+        def lookup(name):
+            n = values.get(name)
+            return n if n is not None else exports.get(name)
+
+        for section, offset, kind, text in m.relocations:
+            e = compiled.get(text)
+            if e is None:
+                e = compileExpression(tokenize(text, operand=True))
+                if e is None:
+                    raise Exception("Invalid relocation in %s: %s" %
+                                    (m.name, text))
+                compiled[text] = e
+
+            if isinstance(e, int):
+                names, n = (), e
+            elif isinstance(e, string_types):
+                names, n = (e,), lookup(e)
+            else:
+                names, n = e.symbols, e.evaluate(lookup)
+            if n is None:
+                missing = [name for name in names if lookup(name) is None]
+                raise Exception("Undefined symbol in %s: %s" %
+                                (m.name, missing[0]))
+
+            s = placed[section]
+            if kind == 'rel8':
+                d = n - (s.start + offset + 1)
+                if d > 127 or d < -128:
+                    raise Exception("Branch target too far in %s: %s" %
+                                    (m.name, text))
+                s.data[offset] = d & 0xff
+            elif kind in ['abs16', 'word']:
+                s.data[offset] = n & 0xff
+                s.data[offset + 1] = (n >> 8) & 0xff
+            else:
+                if not -0x80 <= n <= 0xff:
+                    raise Exception("Value out of range for a byte in %s: "
+                                    "%s = %d" % (m.name, text, n))
+                s.data[offset] = n & 0xff
+
+    segments.check()
+    return segments, exports
@@ -0,0 +1,139 @@
+"""
+Listing and symbol map output.
+
+A Listing is written while the program is assembled: each source line is
+held only until its bytes can't change any more (nothing before its end
+is waiting on a fixup), then written out and forgotten.  The bytes are
+read from the output segments at that point, so no copy of the program is
+kept.
+"""
+
+from collections import deque
+
+from .lexer import LABEL
+
+
+# Bytes shown on each listing line; longer lines end with '..'
+LISTING_BYTES = 4
+
+
+class Listing(object):
+    """Writes an "address  bytes  source" listing to the file object f."""
+
+    def __init__(self, f):
+        self.f = f
+        self.pending = deque()
+        # Index of each segment in the SegmentMap, by id
+        self.indexes = {}
+
+    def index(self, segments, segment):
+        if id(segment) not in self.indexes:
+            for i, s in enumerate(segments.segments):
+                self.indexes[id(s)] = i
+        return self.indexes[id(segment)]
+
+    def mark(self, a):
+        """Return the current position of the Assembler a, to pass to add()
+        after the line is assembled."""
+        return a.segment, a.pc() - a.segment.origin
+
+    def position(self, a, segment, address):
+        """Return (segment number, offset from the segment's origin) for
+        address, which neither an .ORG nor discarded output can change."""
+        return self.index(a.segments, segment), address - segment.origin
+
+    def add(self, a, text, tokens, before):
+        """Record the source line text, which the Assembler a has just
+        assembled from tokens.  before is what mark() returned before it."""
+        segment, offset = before
+        label = tokens[0].value if tokens and tokens[0].kind == LABEL \
+            else None
+        self.pending.append((
+            text, label, (self.index(a.segments, segment), offset),
+            self.position(a, a.segment, a.pc())
+        ))
+        self.flush(a)
+
+    def flush(self, a):
+        """Write out every line whose bytes are final: those ending before
+        the earliest unresolved fixup, and before any floating label, whose
+        address an .ORG could still change."""
+        while a.unresolved and a.unresolved[0].done:
+            a.unresolved.popleft()
+        limit = None
+        if a.unresolved:
+            f = a.unresolved[0]
+            limit = self.position(a, f.segment, f.address)
+        if a.floating:
+            floor = (self.index(a.segments, a.segment), -1)
+            if limit is None or floor < limit:
+                limit = floor
+
+        while self.pending:
+            if limit is not None and self.pending[0][3] > limit:
+                break
+            self.write(a, self.pending.popleft())
+
+    def finish(self, a):
+        """Write out the rest once the assembly is complete."""
+        while self.pending:
+            self.write(a, self.pending.popleft())
+
+    def write(self, a, entry):
+        text, label, first, last = entry
+        address, data = self.read(a.segments.segments, first, last)
+
+        shown = ' '.join(["%02X" % b for b in data[:LISTING_BYTES]])
+        if len(data) > LISTING_BYTES:
+            shown += ' ..'
+        if data:
+            address = "%04X" % address
+        elif label in a.labels:
+            address = "%04X" % a.labels[label]
+        elif label in a.symbols and a.symbols[label] is not None:
+            address = "%04X" % a.symbols[label]
+        else:
+            address = ''
+
+        # Written as unicode, which text streams on Python 2 need
+        if not isinstance(text, type(u'')):
+            text = text.decode('utf-8')
+        self.f.write(u"%-4s  %-14s %s\n" % (address, shown, text.rstrip()))
+
+    def read(self, segments, first, last):
+        """Return the address of the first byte between the positions first
+        and last, and up to LISTING_BYTES + 1 of those bytes."""
+        data = bytearray()
+        address = None
+        for i in range(first[0], last[0] + 1):
+            s = segments[i]
+            # Offsets are from the origin; bytes before start are gone
+            lo = first[1] if i == first[0] else 0
+            hi = last[1] if i == last[0] else s.end - s.origin
+            hi = min(hi, lo + LISTING_BYTES + 1 - len(data))
+            skipped = s.start - s.origin
+            chunk = s.data[lo - skipped:hi - skipped]
+            if len(chunk) and address is None:
+                address = s.origin + lo
+            data.extend(chunk)
+            if len(data) > LISTING_BYTES:
+                break
+        return address, data
+
+
+def writeSymbols(f, symbols):
+    """Write symbols as "name = $value" lines sorted by value, then name.
+    Like the listing, they are written as unicode."""
+    for value, name in sorted([(v, k) for k, v in symbols.items()
+                               if v is not None]):
+        if value < 0x100:
+            f.write(u"%s = $%02X\n" % (name, value))
+        else:
+            f.write(u"%s = $%04X\n" % (name, value))
+
+
+def writeViceLabels(f, symbols):
+    """Write symbols as a VICE monitor label file, loadable with 'll'."""
+    for value, name in sorted([(v, k) for k, v in symbols.items()
+                               if v is not None]):
+        f.write(u"al C:%04X .%s\n" % (value & 0xffff, name))
@@ -0,0 +1,109 @@
+"""
+Macros defined with .MACRO name param, ... and .ENDM.
+
+The body of a macro is kept as the token lists of its statements.  An
+expansion substitutes the argument text for each parameter and tokenizes
+the result, which is cached by argument tuple and the names of the macros
+defined at the time, so a macro invoked many times with the same
+arguments is only tokenized once.  Labels defined in
+the body are local to each expansion: they are renamed to name@<number>
+as the cached statements are replayed, a name that can't be written in
+source but is read back from an object file's relocations.
+"""
+
+from .cache import LRUCache
+from .lexer import tokenize, Token, LABEL, OP, SYMBOL
+
+
+# Token kinds that a parameter name can appear as
+NAMES = frozenset([LABEL, OP, SYMBOL])
+
+
+class Macro(object):
+    """A macro definition.  body is a list of token lists; expansions maps
+    argument tuples, with the macro names they were expanded among, to
+    their expanded statements, see expand()."""
+    __slots__ = ('name', 'params', 'body', 'expansions')
+
+    def __init__(self, name, params, body, maxsize=256):
+        self.name = name
+        self.params = params
+        self.body = body
+        self.expansions = LRUCache(maxsize)
+
+    def expand(self, args, macros):
+        """Return the statements for the argument texts args as a list of
+        (tokens, local) pairs, where local holds the positions in tokens of
+        the labels to rename.  macros is the frozenset of the names of the
+        macros defined, which aren't labels when they start a statement."""
+        key = (args, macros)
+        statements = self.expansions.get(key)
+        if statements is not None:
+            return statements
+
+        if len(args) != len(self.params):
+            raise Exception("Macro %s takes %d arguments, got %d" % (
+                self.name, len(self.params), len(args)
+            ))
+
+        values = dict(zip(self.params, args))
+        lines = []
+        for tokens in self.body:
+            text = ' '.join([
+                values.get(t.text, t.text) if t.kind in NAMES else t.text
+                for t in tokens
+            ])
+            lines.append(tokenize(text))
+
+        labels = set()
+        for tokens in lines:
+            if tokens and tokens[0].kind == LABEL and \
+                    tokens[0].value.upper() not in macros and \
+                    (len(tokens) == 1 or tokens[1].text != '=' or
+                     tokens[-1].text == '*'):
+                labels.add(tokens[0].value)
+
+        statements = []
+        for tokens in lines:
+            if tokens:
+                statements.append((tokens, [
+                    i for i, t in enumerate(tokens)
+                    if t.kind in (LABEL, SYMBOL) and t.value in labels
+                ]))
+        self.expansions.put(key, statements)
+        return statements
+
+
+def localize(tokens, local, n):
+    """Return a copy of tokens with the labels at the positions in local
+    renamed for expansion number n."""
+    tokens = list(tokens)
+    for i in local:
+        t = tokens[i]
+        name = "%s@%d" % (t.value, n)
+        tokens[i] = Token(t.kind, name, name, t.col)
+    return tokens
+
+
+class MacroCache(object):
+    """Macro definitions keyed by their name, parameters and body text, so
+    a macro defined again in a later assembly, or pass, keeps the
+    expansions it has already made."""
+
+    def __init__(self, maxsize=256):
+        self.memory = LRUCache(maxsize)
+
+    def define(self, name, params, body):
+        key = (name, tuple(params),
+               tuple([tuple([t.text for t in tokens]) for tokens in body]))
+        macro = self.memory.get(key)
+        if macro is None:
+            macro = Macro(name, params, body)
+            self.memory.put(key, macro)
+        return macro
+
+    def clear(self):
+        self.memory.clear()
+
+
+macro_cache = MacroCache()
@@ -0,0 +1,235 @@
+"""
+Relocatable object files, for assembling the modules of a program
+separately and linking them afterwards (see linker.py).
+
+Code before the first .ORG of a module is relocatable: it is assembled
+from address 0 and moved wherever the linker places it.  Sections started
+by an .ORG keep their address.  A module makes symbols visible to the
+others with .EXPORT name, ...; any symbol it uses but doesn't define is
+imported.
+
+Every reference that depends on where code ends up, to a relocatable
+label or to an import, is kept as a relocation record: the section and
+offset of the operand, the fixup kind ('abs16', 'zp8', 'rel8', 'word' or
+'byte') and the text of the symbol or expression, which the linker
+evaluates once every module has been placed.
+
+Object files are JSON, in the spirit of the o65 format: the sections with
+their data base64 encoded, the symbols, exports and imports, and the
+relocations.
+"""
+
+import base64
+import json
+
+from .assembler import Assembler
+from .expressions import Expression
+
+
+FORMAT = 'py65asm-object'
+VERSION = 1
+
+
+class Section(object):
+    """Assembled code starting at start.  A relocatable section's start is
+    an offset from wherever the linker places the module."""
+    __slots__ = ('start', 'data', 'relocatable')
+
+    def __init__(self, start, data, relocatable):
+        self.start = start
+        self.data = data
+        self.relocatable = relocatable
+
+    @property
+    def end(self):
+        return self.start + len(self.data)
+
+
+class ObjectModule(object):
+    """An assembled module.  symbols maps every symbol it defines to a
+    (value, relocatable) pair; relocations is a list of (section, offset,
+    kind, text) records."""
+
+    def __init__(self, name='', sections=None, symbols=None, exports=None,
+                 imports=None, relocations=None):
+        self.name = name
+        self.sections = sections or []
+        self.symbols = symbols or {}
+        self.exports = exports or []
+        self.imports = imports or []
+        self.relocations = relocations or []
+
+    @property
+    def size(self):
+        """The number of bytes of relocatable code."""
+        return max([s.end for s in self.sections if s.relocatable] or [0])
+
+    def write(self, f):
+        """Write the module to the text file object f."""
+        text = json.dumps({
+            'format': FORMAT, 'version': VERSION,
+            'sections': [
+                [s.start, s.relocatable,
+                 base64.b64encode(bytes(s.data)).decode('ascii')]
+                for s in self.sections
+            ],
+            'symbols': dict([(k, list(v)) for k, v in self.symbols.items()]),
+            'exports': self.exports,
+            'imports': self.imports,
+            'relocations': [list(r) for r in self.relocations],
+        }, sort_keys=True)
+        # Text streams on Python 2 need unicode, which json.dumps() doesn't
+        # give there; its output is ASCII
+        if not isinstance(text, type(u'')):
+            text = text.decode('ascii')
+        f.write(text)
+
+    @classmethod
+    def read(cls, f, name=None):
+        """Read a module written by write() from the text file object f."""
+        name = name if name is not None else getattr(f, 'name', '')
+        try:
+            o = json.load(f)
+        except ValueError:
+            o = None
+        if not isinstance(o, dict) or o.get('format') != FORMAT:
+            raise Exception("Not an object file: %s" % name)
+        if o.get('version') != VERSION:
+            raise Exception("Unsupported object file version %s: %s" %
+                            (o.get('version'), name))
+
+        return cls(
+            name,
+            [Section(start, bytearray(base64.b64decode(data)), relocatable)
+             for start, relocatable, data in o['sections']],
+            dict([(k, tuple(v)) for k, v in o['symbols'].items()]),
+            o['exports'], o['imports'],
+            [tuple(r) for r in o['relocations']],
+        )
+
+
+class ObjectAssembler(Assembler):
+    """An Assembler whose output is an ObjectModule: undefined symbols are
+    imports rather than errors, and references to relocatable labels are
+    recorded as relocations.  Takes the Assembler's keyword arguments,
+    except org."""
+
+    def __init__(self, **kwargs):
+        Assembler.__init__(self, None, **kwargs)
+
+    def begin(self):
+        Assembler.begin(self)
+        # Labels in the relocatable code, the index of the first segment
+        # that isn't relocatable, once there is one, and the fixups to
+        # record as relocations
+        self.relocatable = set()
+        self.fixed = None
+        self.relocations = []
+        self.imports = []
+
+    def defineLabel(self, name):
+        # Added first, as defining it patches the references waiting on it
+        if self.fixed is None:
+            self.relocatable.add(name)
+        Assembler.defineLabel(self, name)
+
+    def setOrigin(self, n):
+        if self.fixed is None:
+            segments = self.segments.segments
+            if len(self.out) == 0:
+                # The .ORG moves this segment, and the labels floating in it
+                self.relocatable.difference_update(self.floating)
+                self.fixed = len(segments) - 1
+            else:
+                self.fixed = len(segments)
+        Assembler.setOrigin(self, n)
+
+    def getValue(self, tokens):
+        # A value that uses a relocatable label is only known once linked,
+        # so is left to a fixup, which is recorded as a relocation
+        e = self.getExpression(tokens)
+        names = e.symbols if isinstance(e, Expression) else (e,)
+        if any([name in self.relocatable for name in names]):
+            return None
+        return Assembler.getValue(self, tokens)
+
+    def isRelocatable(self, segment):
+        if self.fixed is None:
+            return True
+        return any([s is segment
+                    for s in self.segments.segments[:self.fixed]])
+
+    def relocates(self, f):
+        """Does the fixup f depend on where the code is placed?"""
+        names = f.expr.symbols if f.expr is not None else (f.symbol,)
+        moves = any([name in self.relocatable for name in names])
+        if f.kind == 'rel8':
+            # A branch depends on where it is placed unless it moves with
+            # its target
+            return moves != self.isRelocatable(f.segment)
+        return moves
+
+    def patch(self, f, n):
+        if f.kind == 'rel8' and (f.expr is None or
+                                 self.missingSymbol(f.expr) is None) and \
+                self.relocates(f):
+            # How far it goes is only known, and checked, once linked
+            self.relocations.append(f)
+            f.done = True
+            return
+        Assembler.patch(self, f, n)
+        if f.done and self.relocates(f):
+            self.relocations.append(f)
+
+    def evaluate(self, v):
+        # Only symbols with a value that can't move can be zero page
+        names = v.symbols if isinstance(v, Expression) else (v,)
+        for name in names:
+            if name in self.relocatable or name not in self.symbols:
+                return None
+        return Assembler.evaluate(self, v)
+
+    def resolveLabels(self):
+        self.fixFloating()
+        # Whatever is still waiting is imported from another module
+        imports = set()
+        for fixups in self.pending.values():
+            for f in fixups:
+                self.relocations.append(f)
+                names = f.expr.symbols if f.expr is not None \
+                    else (f.symbol,)
+                imports.update([name for name in names
+                                if self.valueOf(name) is None])
+        self.imports = sorted(imports)
+        self.pending = {}
+        Assembler.resolveLabels(self)
+
+    def module(self, name=''):
+        """Return the last assembly as an ObjectModule called name."""
+        segments = self.segments.segments
+        fixed = len(segments) if self.fixed is None else self.fixed
+
+        sections = []
+        indexes = {}
+        for i, s in enumerate(segments):
+            if len(s):
+                indexes[id(s)] = len(sections)
+                sections.append(Section(s.start, s.data, i < fixed))
+
+        symbols = {}
+        for k, v in self.symbols.items():
+            if v is not None:
+                symbols[k] = (v, k in self.relocatable)
+        for k in self.exports:
+            if k not in symbols:
+                raise Exception("Exported symbol not defined: %s" % k)
+
+        relocations = []
+        for f in self.relocations:
+            relocations.append((
+                indexes[id(f.segment)], f.address - f.segment.start, f.kind,
+                f.expr.text if f.expr is not None else f.symbol
+            ))
+
+        return ObjectModule(name, sections, symbols, list(self.exports),
+                            list(self.imports), relocations)
@@ -15,7 +15,8 @@ ops = {
     'BMI': {'z': 48},
     'BNE': {'z': 208},
     'BPL': {'z': 16},
-    'BVC': {'z': 112},
+    'BVC': {'z': 80},
+    'BVS': {'z': 112},
     'BIT': {'a': 44, 'z': 36},
     'BRK': {'im': 0},
     'CLC': {'im': 24},
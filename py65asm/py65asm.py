@@ -1,2 +1,266 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+
+"""
+Command line interface: assemble one or more files, optionally spread over
+a pool of worker processes.  With --compile each file is assembled to a
+relocatable object file instead, and --link links object files into one
+program (see objects.py and linker.py).
+
+The assembler itself is only imported once there is something to
+assemble, so the client (see client.py) can share the option parsing and
+reporting here without paying for it.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from .formats import WRITERS, EXTENSIONS
+from .lexer import tokenize, parseOperand
+
+
+def number(text):
+    """Parse a number in assembler syntax ($hex, %binary or decimal)."""
+    try:
+        o = parseOperand(tokenize(text, operand=True))
+    except Exception:
+        o = None
+    if o is None or o.mode != 'z' or o.value is None:
+        raise argparse.ArgumentTypeError("invalid number: %s" % text)
+    return o.value
+
+
+def outputName(source, extension='.bin'):
+    return os.path.splitext(source)[0] + extension
+
+
+def assembleFile(job):
+    """Assemble one (source, dest, org, fill, include_path, zero_page,
+    relax, listing, symbols, vice, relocatable, output_format) job.
+    listing and symbols are the paths to write a listing and symbol file
+    to, or None; vice selects a VICE label file for the symbols.  If
+    relocatable is True dest is an object file, otherwise it is written in
+    output_format.  Returns the source, dest, size, number of branches
+    relaxed, time taken and error message, if any."""
+    from .assembler import Assembler
+    from .listing import writeSymbols, writeViceLabels
+    from .objects import ObjectAssembler
+
+    (source, dest, org, fill, include_path, zero_page, relax, listing,
+     symbols, vice, relocatable, output_format) = job
+    start = time.time()
+    relaxed = 0
+    lst = None
+    try:
+        if listing:
+            lst = open(listing, 'w')
+        options = dict(include_path=include_path, zero_page=zero_page,
+                       relax=relax, listing=lst)
+        if relocatable:
+            a = ObjectAssembler(fill=fill, **options)
+            with open(source) as f:
+                segments = a.assemble(f, flat=False)
+            if dest:
+                with open(dest, 'w') as f:
+                    a.module(source).write(f)
+        else:
+            a = Assembler(org, fill, output_format=output_format,
+                          **options)
+            with open(source) as f:
+                segments = a.assemble(f, dest, flat=False)
+        if symbols:
+            with open(symbols, 'w') as f:
+                (writeViceLabels if vice else writeSymbols)(f, a.symbols)
+        size = segments.end - segments.start if len(segments) else 0
+        relaxed = a.relaxed
+        error = None
+    except Exception as e:
+        size = None
+        error = str(e) or e.__class__.__name__
+    finally:
+        if lst is not None:
+            lst.close()
+    return source, dest, size, relaxed, time.time() - start, error
+
+
+def linkFiles(objects, dest, org, fill, symbols, vice, output_format):
+    """Link the object files objects into dest, or just check they link
+    if dest is None.  The other arguments are as for assembleFile().
+    Returns a result like assembleFile()'s."""
+    from .formats import writeOutput
+    from .linker import link
+    from .listing import writeSymbols, writeViceLabels
+    from .objects import ObjectModule
+
+    start = time.time()
+    try:
+        modules = []
+        for path in objects:
+            with open(path) as f:
+                modules.append(ObjectModule.read(f, path))
+        segments, exports = link(modules, org or 0)
+        if dest:
+            with open(dest, 'wb') as f:
+                writeOutput(f, segments, output_format, fill)
+        if symbols:
+            with open(symbols, 'w') as f:
+                (writeViceLabels if vice else writeSymbols)(f, exports)
+        size = segments.end - segments.start if len(segments) else 0
+        error = None
+    except Exception as e:
+        size = None
+        error = str(e) or e.__class__.__name__
+    return ("%d objects" % len(objects), dest, size, 0,
+            time.time() - start, error)
+
+
+def parser():
+    p = argparse.ArgumentParser(
+        prog='py65asm', description='Assemble 6502 source files.'
+    )
+    p.add_argument('sources', nargs='+', metavar='FILE')
+    p.add_argument(
+        '-o', '--output', action='append', default=[], metavar='OUT',
+        help='output file, once per source (default: the source with a '
+             '.bin extension)'
+    )
+    p.add_argument('--org', type=number, help='start address')
+    p.add_argument('--fill', type=number, default=0,
+                   help='value for the gaps between segments')
+    p.add_argument('-f', '--format', choices=sorted(WRITERS), default='bin',
+                   help='output file format (default: bin); hex and srec '
+                        'leave out the gaps between segments')
+    p.add_argument('-I', '--include', action='append', default=[],
+                   metavar='DIR', help='search DIR for .INCLUDE files')
+    p.add_argument('-Z', '--zero-page', action='store_true',
+                   help='use zero page addressing for forward references '
+                        'that turn out to be in zero page')
+    p.add_argument('-R', '--relax', action='store_true',
+                   help='turn branches that are out of range into a branch '
+                        'over a JMP')
+    p.add_argument('-l', '--listing', action='store_true',
+                   help='write a listing of each source to a .lst file')
+    p.add_argument('-s', '--symbols', action='store_true',
+                   help='write the symbols of each source to a .sym file')
+    p.add_argument('--vice', action='store_true',
+                   help='write the symbols as a VICE label file (.lbl)')
+    p.add_argument('-c', '--compile', action='store_true',
+                   help='write a relocatable object file (.o) for each '
+                        'source rather than a binary')
+    p.add_argument('--link', action='store_true',
+                   help='link the object files given into one program '
+                        '(default: the first with the --format extension)')
+    p.add_argument('-j', '--jobs', type=int, default=1,
+                   help='assemble up to N files at once')
+    p.add_argument('-k', '--keep-going', action='store_true',
+                   help="don't stop at the first file that fails")
+    p.add_argument('-n', '--dry-run', action='store_true',
+                   help="assemble without writing any output")
+    p.add_argument('-q', '--quiet', action='store_true',
+                   help="only report errors")
+    return p
+
+
+def makeJobs(p, args):
+    """Check the parsed arguments and return the assembleFile() jobs for
+    them."""
+    if args.output and len(args.output) != len(args.sources):
+        p.error("give one -o for each source file")
+    if args.jobs < 1:
+        p.error("--jobs must be at least 1")
+    if args.compile and args.org is not None:
+        p.error("--org is given when linking, not to --compile")
+
+    if args.dry_run:
+        outputs = [None] * len(args.sources)
+    else:
+        extension = '.o' if args.compile else EXTENSIONS[args.format]
+        outputs = args.output or [outputName(s, extension)
+                                  for s in args.sources]
+
+    write = not args.dry_run
+    return [
+        (source, dest, args.org, args.fill, args.include, args.zero_page,
+         args.relax,
+         write and args.listing and outputName(source, '.lst') or None,
+         write and (args.symbols or args.vice) and
+         outputName(source, '.lbl' if args.vice else '.sym') or None,
+         args.vice, args.compile, args.format)
+        for source, dest in zip(args.sources, outputs)
+    ]
+
+
+def linkArguments(p, args):
+    """Check the parsed arguments for --link and return the linkFiles()
+    arguments for them."""
+    if len(args.output) > 1:
+        p.error("give one -o when linking")
+    if args.compile or args.listing:
+        p.error("--link can't be used with --compile or --listing")
+
+    dest = None
+    if not args.dry_run:
+        dest = args.output[0] if args.output else \
+            outputName(args.sources[0], EXTENSIONS[args.format])
+    symbols = None
+    if dest and (args.symbols or args.vice):
+        symbols = outputName(dest, '.lbl' if args.vice else '.sym')
+    return (args.sources, dest, args.org, args.fill, symbols, args.vice,
+            args.format)
+
+
+def report(args, results, count, start):
+    """Print the (source, dest, size, relaxed, seconds, error) results of
+    count jobs started at time start, stopping at the first error unless
+    --keep-going was given.  Returns the exit status."""
+    failed = 0
+    for source, dest, size, relaxed, seconds, error in results:
+        if error is not None:
+            failed += 1
+            sys.stderr.write("%s: error: %s\n" % (source, error))
+            if not args.keep_going:
+                break
+        elif not args.quiet:
+            sys.stdout.write("%s -> %s: %d bytes%s in %.3fs\n" % (
+                source, dest or '(none)', size,
+                ", %d branches relaxed" % relaxed if relaxed else "",
+                seconds
+            ))
+
+    if not args.quiet and count > 1:
+        sys.stdout.write("%d files, %d failed, %.3fs\n" % (
+            count, failed, time.time() - start
+        ))
+
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    p = parser()
+    args = p.parse_args(argv)
+    if args.link:
+        start = time.time()
+        return report(args, [linkFiles(*linkArguments(p, args))], 1, start)
+    jobs = makeJobs(p, args)
+
+    start = time.time()
+    pool = None
+    if args.jobs > 1 and len(jobs) > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(min(args.jobs, len(jobs)))
+        results = pool.imap_unordered(assembleFile, jobs)
+    else:
+        results = (assembleFile(job) for job in jobs)
+
+    try:
+        return report(args, results, len(jobs), start)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
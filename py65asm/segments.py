@@ -0,0 +1,103 @@
+class Segment(object):
+    """A contiguous run of assembled code starting at address start.
+
+    origin is where the segment began; it differs from start once bytes
+    have been discarded from the front of it by a streaming assembly.
+
+    data is normally a bytearray, but is a read-only memoryview for the
+    contents of an .INCBIN file.
+    """
+    __slots__ = ('start', 'data', 'origin')
+
+    def __init__(self, start, data=None):
+        self.start = start
+        self.origin = start
+        self.data = data if data is not None else bytearray()
+
+    @property
+    def end(self):
+        return self.start + len(self.data)
+
+    def rebase(self, start):
+        """Move an empty segment to start."""
+        self.start = self.origin = start
+
+    def discard(self, n):
+        """Drop the first n bytes, which have already been written out."""
+        if isinstance(self.data, bytearray):
+            del self.data[:n]
+        else:
+            self.data = self.data[n:]
+        self.start += n
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        # Allows ``for start, data in segments``
+        return iter((self.start, self.data))
+
+    def __repr__(self):
+        return "Segment($%04X-$%04X)" % (self.start, self.end)
+
+
+class SegmentMap(object):
+    """The sparse output of an assembly: one Segment per .ORG.
+
+    Gaps between segments are never stored; they are only filled in when
+    a flat image is requested with flatten(), or written out (see
+    formats.py).
+    """
+
+    def __init__(self):
+        self.segments = []
+
+    def add(self, start, data=None):
+        """Begin a new segment at start, empty unless data is given, and
+        return it."""
+        segment = Segment(start, data)
+        self.segments.append(segment)
+        return segment
+
+    def __iter__(self):
+        return iter(sorted(
+            [s for s in self.segments if len(s)], key=lambda s: s.start
+        ))
+
+    def __len__(self):
+        return len([s for s in self.segments if len(s)])
+
+    @property
+    def start(self):
+        segments = list(self)
+        return segments[0].start if segments else None
+
+    @property
+    def end(self):
+        segments = list(self)
+        return max(s.end for s in segments) if segments else None
+
+    def check(self):
+        """Raise an exception if any two segments overlap."""
+        previous = None
+        for s in sorted(self.segments, key=lambda s: s.origin):
+            if s.end == s.origin:
+                continue
+            if previous is not None and s.origin < previous.end:
+                raise Exception(
+                    "Segment overlap at $%04X: $%04X-$%04X and $%04X-$%04X" %
+                    (s.origin, previous.origin, previous.end, s.origin, s.end)
+                )
+            previous = s
+
+    def flatten(self, fill=0):
+        """Return the segments as a single image, with the gaps between them
+        set to fill."""
+        out = bytearray()
+        address = None
+        for s in self:
+            if address is not None and s.start > address:
+                out.extend(bytearray([fill]) * (s.start - address))
+            out.extend(s.data)
+            address = s.end
+        return out
@@ -0,0 +1,226 @@
+"""
+A long-running assembler, so that many small builds share one interpreter
+and its warm operand, include and macro caches.
+
+Requests and responses are JSON objects, one per line, read from stdin and
+written to stdout, or exchanged over a Unix socket with --socket.  A
+request assembles either "source", the program text, or "path", a file:
+
+    {"id": 1, "path": "/src/game.asm", "org": 49152, "format": "bin"}
+
+and may also give "org", "fill", "include_path", "zero_page", "relax",
+"stats", and paths for "output", "listing" and "symbols" (with "vice" for
+a VICE label file) to write.  With "object" true the output is a
+relocatable object file, see objects.py, and otherwise is written in
+"output_format" (see formats.py, default "bin").  "format" is how the code is
+returned: "bin" for the flat image in "data", "segments" for a list of
+[start, data] pairs, or "none".  Data is base64 encoded.
+
+The response echoes "id" and has "ok", "size", "relaxed", "symbols",
+"diagnostics" (a list of {"severity", "message", "line"} objects) and
+"seconds".  {"command": "shutdown"} stops the server.
+"""
+
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from .assembler import Assembler
+from .listing import writeSymbols, writeViceLabels
+from .objects import ObjectAssembler
+
+
+FORMATS = ['bin', 'segments', 'none']
+
+
+def encode(data):
+    return base64.b64encode(bytes(data)).decode('ascii')
+
+
+def value(n):
+    """Return n, a number or a number in assembler syntax, as an int."""
+    if n is None or isinstance(n, int):
+        return n
+    v = Assembler().getNumber(n)
+    if v is None:
+        raise Exception("Invalid number: %s" % n)
+    return v
+
+
+def assemble(request):
+    """Carry out an assemble request and return the response."""
+    start = time.time()
+    response = {'id': request.get('id'), 'ok': False, 'diagnostics': []}
+    a = None
+    listing = None
+    try:
+        fmt = request.get('format', 'bin')
+        if fmt not in FORMATS:
+            raise Exception("Unknown format: %s" % fmt)
+
+        if request.get('listing'):
+            listing = open(request['listing'], 'w')
+        options = dict(include_path=request.get('include_path'),
+                       zero_page=request.get('zero_page', False),
+                       relax=request.get('relax', False),
+                       stats=request.get('stats', False),
+                       listing=listing)
+        fill = value(request.get('fill', 0))
+        output = request.get('output')
+        if request.get('object'):
+            a = ObjectAssembler(fill=fill, **options)
+            binary = None
+        else:
+            a = Assembler(value(request.get('org')), fill,
+                          output_format=request.get('output_format', 'bin'),
+                          **options)
+            binary = output
+
+        if 'source' in request:
+            segments = a.assemble(request['source'], binary, flat=False)
+        else:
+            with open(request['path']) as f:
+                segments = a.assemble(f, binary, flat=False)
+
+        if output and binary is None:
+            with open(output, 'w') as f:
+                a.module(request.get('path', '')).write(f)
+
+        if request.get('symbols'):
+            with open(request['symbols'], 'w') as f:
+                if request.get('vice'):
+                    writeViceLabels(f, a.symbols)
+                else:
+                    writeSymbols(f, a.symbols)
+
+        if fmt == 'bin':
+            response['data'] = encode(segments.flatten(a.fill))
+        elif fmt == 'segments':
+            response['segments'] = [[s.start, encode(s.data)]
+                                    for s in segments]
+
+        response.update({
+            'ok': True,
+            'size': segments.end - segments.start if len(segments) else 0,
+            'relaxed': a.relaxed,
+            'symbols': dict([(k, v) for k, v in a.symbols.items()
+                             if v is not None]),
+        })
+        if a.stats is not None:
+            response['stats'] = a.stats
+    except Exception as e:
+        response['diagnostics'].append({
+            'severity': 'error',
+            'message': str(e) or e.__class__.__name__,
+            # The line the assembly stopped at, kept through the sizing
+            # passes of zero_page and relax
+            'line': a.lineNumber if a is not None else None,
+        })
+    finally:
+        if listing is not None:
+            listing.close()
+
+    response['seconds'] = time.time() - start
+    return response
+
+
+def respond(line):
+    """Return the response to the request line, and whether to carry on
+    serving."""
+    try:
+        request = json.loads(line)
+        if not isinstance(request, dict):
+            raise ValueError("not an object")
+    except ValueError as e:
+        return {'ok': False, 'diagnostics': [{
+            'severity': 'error', 'message': "Invalid request: %s" % e,
+            'line': None,
+        }]}, True
+
+    command = request.get('command', 'assemble')
+    if command == 'shutdown':
+        return {'id': request.get('id'), 'ok': True}, False
+    if command != 'assemble':
+        return {'id': request.get('id'), 'ok': False, 'diagnostics': [{
+            'severity': 'error', 'line': None,
+            'message': "Unknown command: %s" % command,
+        }]}, True
+    return assemble(request), True
+
+
+def serveStream(infile, outfile, binary=False):
+    """Answer the requests read from infile on outfile, which are binary
+    files if binary is True, until the end of infile or a shutdown.
+    Returns False after a shutdown."""
+    while True:
+        line = infile.readline()
+        if not line:
+            return True
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if not line.strip():
+            continue
+
+        response, carryOn = respond(line)
+        text = json.dumps(response) + '\n'
+        # Text streams on Python 2 need unicode, which json.dumps() doesn't
+        # give there; its output is ASCII
+        if not isinstance(text, type(u'')):
+            text = text.decode('ascii')
+        if binary:
+            text = text.encode('utf-8')
+        outfile.write(text)
+        outfile.flush()
+        if not carryOn:
+            return False
+
+
+class Handler(socketserver.StreamRequestHandler):
+    """One client connection, which can send any number of requests."""
+
+    def handle(self):
+        if not serveStream(self.rfile, self.wfile, binary=True):
+            self.server.stopping = True
+
+
+def serveSocket(path):
+    """Serve requests on the Unix socket at path until a shutdown."""
+    if os.path.exists(path):
+        os.remove(path)
+    server = socketserver.UnixStreamServer(path, Handler)
+    server.stopping = False
+    try:
+        while not server.stopping:
+            server.handle_request()
+    finally:
+        server.server_close()
+        os.remove(path)
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(
+        prog='py65asm-server',
+        description='Assemble requests read as JSON lines from stdin, or '
+                    'from a Unix socket.'
+    )
+    p.add_argument('--socket', metavar='PATH',
+                   help='listen on the Unix socket PATH')
+    args = p.parse_args(argv)
+
+    if args.socket:
+        serveSocket(args.socket)
+    else:
+        serveStream(sys.stdin, sys.stdout)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
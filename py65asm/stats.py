@@ -0,0 +1,68 @@
+"""
+Instrumented assembly, used by Assembler.assemble when stats are enabled.
+
+The assembly goes through the same steps as the normal path, with the
+lines read through a generator that times them.  The sizing passes made for
+zero_page and relax are timed as a phase of their own.  The counters kept
+while assembling are only updated when stats are enabled, and only count
+the final pass, so instrumentation costs nothing unless it's asked for.
+"""
+
+import time
+
+
+timer = getattr(time, 'perf_counter', time.time)
+
+PHASES = ['read', 'size', 'assemble', 'resolve', 'write']
+
+
+def timeLines(lines, stats, times):
+    """Yield lines, counting them in stats and adding the time spent
+    reading each one, and assembling it, to times."""
+    t = timer()
+    for line in lines:
+        t1 = timer()
+        times['read'] += t1 - t
+        stats['lines'] += 1
+        yield line
+        t = timer()
+        times['assemble'] += t - t1
+
+
+def measure(a, lines, output_dest):
+    """Assemble lines with the Assembler a, as assemble() does, adding the
+    time spent in each phase and more counters to a.stats."""
+    times = dict((phase, 0.0) for phase in PHASES)
+    misses, hits = a.cache.misses, a.cache.hits
+    start = timer()
+
+    if a.zero_page or a.relax:
+        lines = a.size(lines)
+    a.begin()
+    times['size'] = timer() - start
+
+    a.assembleLines(timeLines(lines, a.stats, times))
+    t = timer()
+    a.resolveLabels()
+    t1 = timer()
+    written = a.writeFile(output_dest)
+    t2 = timer()
+
+    times['resolve'] = t1 - t
+    times['write'] = t2 - t1
+    times['total'] = t2 - start
+
+    a.stats.update({
+        'time': times,
+        'labels': len(a.labels),
+        'operands_parsed': a.cache.misses - misses,
+        'operand_cache_hits': a.cache.hits - hits,
+        'segments': len(a.segments),
+        'bytes': sum([len(s.data) for s in a.segments]),
+        'bytes_written': written,
+        'branches_relaxed': a.relaxed,
+        'size_passes': a.sizePasses,
+    })
+
+    if a.hook is not None:
+        a.hook(a.stats)
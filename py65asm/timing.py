@@ -0,0 +1,111 @@
+"""
+Static cycle counts for assembled code.
+
+Each segment is decoded from its start and from every label in it, so a
+label always starts a fresh instruction.  The code between one label and
+the next is a block, with a best and worst case cycle total.
+"""
+
+from .cycles import cycles, page_penalty
+from .disassembler import opcodes, lengths, branchOpcodes
+
+
+class Instruction(object):
+    """A decoded instruction.  cycles is its best case; max_cycles adds a
+    taken branch and any page crossing that may happen.  flags holds
+    'page' for a branch whose target is in another page and 'index' for an
+    indexed read that may cross into the next page."""
+    __slots__ = ('address', 'opcode', 'mnemonic', 'mode', 'length',
+                 'cycles', 'max_cycles', 'flags')
+
+    def __init__(self, address, opcode, operand):
+        entry = opcodes[opcode]
+        self.address = address
+        self.opcode = opcode
+        self.mnemonic, self.mode, self.length = entry or (None, None, 1)
+        self.cycles = cycles[opcode]
+        self.max_cycles = self.cycles
+        self.flags = []
+
+        if opcode in branchOpcodes:
+            target = address + 2 + (operand - 0x100 if operand > 0x7f
+                                    else operand)
+            self.max_cycles += 1
+            if (address + 2) >> 8 != target >> 8:
+                self.max_cycles += 1
+                self.flags.append('page')
+        elif page_penalty[opcode]:
+            # A page aligned base can't carry with an 8-bit index; where
+            # an (indirect),Y pointer points isn't known
+            if self.mode == 'iy' or operand & 0xff:
+                self.max_cycles += 1
+                self.flags.append('index')
+
+    def __repr__(self):
+        return "Instruction($%04X %s %s)" % (
+            self.address, self.mnemonic, self.mode
+        )
+
+
+class Block(object):
+    """The instructions from a label up to the next label or the end of its
+    segment.  label is None for code before the first label."""
+    __slots__ = ('label', 'address', 'instructions')
+
+    def __init__(self, label, address):
+        self.label = label
+        self.address = address
+        self.instructions = []
+
+    @property
+    def cycles(self):
+        return sum([i.cycles for i in self.instructions])
+
+    @property
+    def max_cycles(self):
+        return sum([i.max_cycles for i in self.instructions])
+
+    def __repr__(self):
+        return "Block(%s $%04X, %d-%d cycles)" % (
+            self.label, self.address, self.cycles, self.max_cycles
+        )
+
+
+def decode(data, start, first, last):
+    """Yield the Instructions in data, which is at address start, from
+    address first up to address last."""
+    i = first - start
+    end = last - start
+    while i < end:
+        opcode = data[i]
+        length = lengths[opcode]
+        if i + length > end:
+            return
+        operand = 0
+        if length > 1:
+            operand = data[i + 1]
+        if length > 2:
+            operand |= data[i + 2] << 8
+        yield Instruction(start + i, opcode, operand)
+        i += length
+
+
+def analyze(segments, labels):
+    """Return the Blocks of the code in segments, split at the addresses in
+    labels, a name to address mapping."""
+    names = {}
+    for name in sorted(labels):
+        names.setdefault(labels[name], name)
+
+    blocks = []
+    for segment in segments:
+        start, data = segment.start, segment.data
+        end = start + len(data)
+        cuts = sorted(set(
+            [start] + [a for a in names if start < a < end]
+        ))
+        for first, last in zip(cuts, cuts[1:] + [end]):
+            block = Block(names.get(first), first)
+            block.instructions.extend(decode(data, start, first, last))
+            blocks.append(block)
+    return blocks
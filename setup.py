@@ -30,6 +30,13 @@ setup(
     ],
     package_dir={'py65asm': 'py65asm'},
     include_package_data=True,
+    entry_points={
+        'console_scripts': [
+            'py65asm = py65asm.py65asm:main',
+            'py65asm-server = py65asm.server:main',
+            'py65asm-client = py65asm.client:main',
+        ],
+    },
     install_requires=[
     ],
     license="BSD",
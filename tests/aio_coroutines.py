@@ -0,0 +1,22 @@
+"""
+Coroutines used by test_aio, kept apart so that it can be collected by a
+Python that can't parse them.
+"""
+
+import asyncio
+
+
+async def cancel(assembler, source):
+    """Start assembling source, then cancel it."""
+    task = asyncio.ensure_future(assembler.assemble(source))
+    await asyncio.sleep(0.01)
+    task.cancel()
+    await task
+
+
+async def gather(assembler, sources, progress):
+    """Assemble all of sources at once, the nth with progress(n)."""
+    return await asyncio.gather(*[
+        assembler.assemble(source, progress=progress(n))
+        for n, source in enumerate(sources)
+    ])
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_aio
+----------------------------------
+
+Tests for `py65asm.aio` module.
+"""
+
+import sys
+import time
+import unittest
+
+if sys.version_info >= (3, 7):
+    import asyncio
+    import concurrent.futures
+
+    from py65asm import aio
+    from tests import aio_coroutines
+
+
+BIG = "start: NOP\n" + "NOP\n" * 200000 + "JMP start"
+
+
+@unittest.skipIf(sys.version_info < (3, 7), "needs Python 3.7 or later")
+class TestAsync(unittest.TestCase):
+
+    def setUp(self):
+        self.assembler = aio.AsyncAssembler(limit=2)
+
+    def tearDown(self):
+        self.assembler.close()
+
+    def _run(self, coroutine):
+        return asyncio.run(coroutine)
+
+    def test_assemble(self):
+        result = self._run(aio.assemble_async("start: LDA #1\nJMP start",
+                                              org=0xc000))
+        self.assertEqual(result.data, bytearray([169, 1, 0x4c, 0, 0xc0]))
+        self.assertEqual(result.symbols, {'start': 0xc000})
+
+        result = self._run(self.assembler.assemble(
+            ".ORG $10\nNOP\n.ORG $20\nRTS", flat=False
+        ))
+        self.assertEqual(result.data, None)
+        self.assertEqual([(s.start, s.data) for s in result.segments],
+                         [(0x10, bytearray([0x1a])),
+                          (0x20, bytearray([0x60]))])
+
+    def test_error(self):
+        self.assertRaises(Exception, self._run,
+                          self.assembler.assemble("JMP nowhere"))
+
+    def test_progress(self):
+        reports = []
+        source = "NOP\n" * 2500
+        result = self._run(self.assembler.assemble(source,
+                                                   progress=reports.append))
+        self.assertEqual(len(result.data), 2500)
+        self.assertEqual([(p.phase, p.lines) for p in reports], [
+            ('queued', 0), ('assembling', 0), ('assembling', 1000),
+            ('assembling', 2000), ('resolving', 2501), ('done', 2501),
+        ])
+
+        reports = []
+        self._run(self.assembler.assemble("BNE far\nfar: RTS", relax=True,
+                                          progress=reports.append))
+        self.assertEqual([p.phase for p in reports], [
+            'queued', 'reading', 'sizing', 'assembling', 'resolving', 'done'
+        ])
+
+    def test_timeout(self):
+        assembler = aio.AsyncAssembler(limit=1)
+        try:
+            start = time.time()
+            self.assertRaises(asyncio.TimeoutError, self._run,
+                              assembler.assemble(BIG, timeout=0.01))
+
+            # The slot is given back once the worker has stopped, soon
+            # after the timeout
+            result = self._run(assembler.assemble("RTS", timeout=5))
+            self.assertEqual(result.data, bytearray([0x60]))
+            self.assertTrue(time.time() - start < 5)
+        finally:
+            assembler.close()
+
+    def test_cancel(self):
+        self.assertRaises(asyncio.CancelledError, self._run,
+                          aio_coroutines.cancel(self.assembler, BIG))
+
+    def test_limit(self):
+        running = set()
+        most = []
+
+        def progress(n):
+            def report(p):
+                if p.phase == 'assembling':
+                    running.add(n)
+                elif p.phase == 'done':
+                    running.discard(n)
+                most.append(len(running))
+            return report
+
+        results = self._run(aio_coroutines.gather(
+            self.assembler, ["NOP\n" * 5000] * 6, progress
+        ))
+        self.assertEqual([len(r.data) for r in results], [5000] * 6)
+        self.assertTrue(0 < max(most) <= 2)
+
+    def test_processes(self):
+        executor = concurrent.futures.ProcessPoolExecutor(1)
+        assembler = aio.AsyncAssembler(executor, limit=1)
+        try:
+            reports = []
+            result = self._run(assembler.assemble(
+                "start: LDA #1\nJMP start", org=0x0800,
+                progress=reports.append
+            ))
+            self.assertEqual(result.data, bytearray([169, 1, 0x4c, 0, 0x08]))
+            self.assertEqual(reports[-1].phase, 'done')
+        finally:
+            assembler.close()
+            executor.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,9 +8,12 @@ test_assembler
 Tests for `py65asm` module.
 """
 
-import unittest, os
+import os
+import threading
+import unittest
 
 from py65asm.assembler import Assembler
+from py65asm.cache import LRUCache
 
 
 class TestAssembler(unittest.TestCase):
@@ -64,7 +67,8 @@ class TestAssembler(unittest.TestCase):
         a.symbols['var'] = 0x555
         self.assertEqual(a.getArgument("$FFFF"), ('a', 0xffff))
         self.assertEqual(a.getArgument("$00FF"), ('a', 0x00ff))
-        self.assertEqual(a.getArgument("%1010101110101011"), ('a', 0b1010101110101011))
+        self.assertEqual(a.getArgument("%1010101110101011"),
+                         ('a', 0b1010101110101011))
         self.assertEqual(a.getArgument("01110"), ('a', 0o1110))
         self.assertEqual(a.getArgument("1234"), ('a', 1234))
         self.assertEqual(a.getArgument("var"), ('a', a.symbols['var']))
@@ -73,7 +77,8 @@ class TestAssembler(unittest.TestCase):
         a = self._asm()
         a.symbols['var'] = 0x555
         self.assertEqual(a.getArgument("$FFFF,X"), ('ax', 0xffff))
-        self.assertEqual(a.getArgument("%1010101110101011,X"), ('ax', 0b1010101110101011))
+        self.assertEqual(a.getArgument("%1010101110101011,X"),
+                         ('ax', 0b1010101110101011))
         self.assertEqual(a.getArgument("01110,X"), ('ax', 0o1110))
         self.assertEqual(a.getArgument("1234,X"), ('ax', 1234))
         self.assertEqual(a.getArgument("var,X"), ('ax', a.symbols['var']))
@@ -83,7 +88,8 @@ class TestAssembler(unittest.TestCase):
         a = self._asm()
         a.symbols['var'] = 0x555
         self.assertEqual(a.getArgument("$FFFF,Y"), ('ay', 0xffff))
-        self.assertEqual(a.getArgument("%1010101110101011,Y"), ('ay', 0b1010101110101011))
+        self.assertEqual(a.getArgument("%1010101110101011,Y"),
+                         ('ay', 0b1010101110101011))
         self.assertEqual(a.getArgument("01110,Y"), ('ay', 0o1110))
         self.assertEqual(a.getArgument("1234,Y"), ('ay', 1234))
         self.assertEqual(a.getArgument("var,Y"), ('ay', a.symbols['var']))
@@ -111,90 +117,414 @@ class TestAssembler(unittest.TestCase):
         a = self._asm()
         a.symbols['var'] = 0x555
         self.assertEqual(a.getArgument("($FFFF)"), ('i', 0xffff))
-        self.assertEqual(a.getArgument("(%1010101110101011)"), ('i', 0b1010101110101011))
+        self.assertEqual(a.getArgument("(%1010101110101011)"),
+                         ('i', 0b1010101110101011))
         self.assertEqual(a.getArgument("(01110)"), ('i', 0o1110))
         self.assertEqual(a.getArgument("(1234)"), ('i', 1234))
         self.assertEqual(a.getArgument("(var)"), ('i', a.symbols['var']))
 
-
+    def test_operand_cache(self):
+        cache = LRUCache(2)
+        a = Assembler(cache=cache)
+        b = Assembler(cache=cache)
+        a.symbols['var'] = 0x55
+        b.symbols['var'] = 0x555
+        self.assertEqual(a.getArgument("var,X"), ('zx', 0x55))
+        self.assertEqual(b.getArgument("var,X"), ('ax', 0x555))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(b.getArgument("$10"), ('z', 0x10))
+        self.assertEqual(b.getArgument("$20"), ('z', 0x20))
+        self.assertEqual(len(cache), 2)
+        self.assertFalse("var,X" in cache)
+
+    def test_operand_cache_threads(self):
+        cache = LRUCache(8)
+
+        def work(n):
+            for i in range(2000):
+                key = (n * i) % 13
+                if cache.get(key) is None:
+                    cache.put(key, i)
+
+        threads = [threading.Thread(target=work, args=(n,))
+                   for n in range(1, 9)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertTrue(len(cache) <= 8)
+        self.assertEqual(len(list(cache.data.items())), len(cache))
 
     def test_A_argument(self):
         a = self._asm()
         self.assertEqual(a.getArgument("A"), ('im', 'A'))
 
+    def test_accumulator(self):
+        a = self._asm()
+        self.assertEqual(a.assemble("ASL A\nlsr a"), bytearray([10, 74]))
+        a = self._asm()
+        a.symbols['ABC'] = 0x10
+        self.assertEqual(a.assemble("LDA ABC"), bytearray([165, 0x10]))
+
+    def test_symbol_named_a(self):
+        a = self._asm()
+        self.assertEqual(a.assemble("a = 5\nLDA a\nASL a"),
+                         bytearray([165, 5, 10]))
+        self.assertEqual(a.assemble("JMP A\nA: RTS"),
+                         bytearray([76, 3, 0, 96]))
+        self.assertRaises(Exception, a.assemble, "LDA A")
+
+    def test_unknown_instruction(self):
+        a = self._asm()
+        self.assertRaises(Exception, a.assemble, "label: FOO #1")
+
     def test_assemble_line(self):
         a = self._asm()
-        self.assertEqual(a.assemble("LDA #55"), [169, 55])
-        self.assertEqual(a.assemble("LDA #$55"), [169, 0x55])
-        self.assertEqual(a.assemble("LDA $55"), [165, 0x55])
-        self.assertEqual(a.assemble("LDA $555"), [173, 0x55, 0x5])
+        self.assertEqual(a.assemble("LDA #55"), bytearray([169, 55]))
+        self.assertEqual(a.assemble("LDA #$55"), bytearray([169, 0x55]))
+        self.assertEqual(a.assemble("LDA $55"), bytearray([165, 0x55]))
+        self.assertEqual(a.assemble("LDA $555"), bytearray([173, 0x55, 0x5]))
 
     def test_assemble_lines(self):
         a = self._asm()
-        self.assertEqual(a.assemble("LDA #55\nSBC $33,X"), [169, 55, 245, 0x33])
+        self.assertEqual(a.assemble("LDA #55\nSBC $33,X"),
+                         bytearray([169, 55, 245, 0x33]))
 
     def test_labels(self):
         a = self._asm()
-        self.assertEqual(a.assemble("loop: DEX\nJMP loop"), [202, 76, 0, 0])
+        self.assertEqual(a.assemble("loop: DEX\nJMP loop"),
+                         bytearray([202, 76, 0, 0]))
         a = self._asm()
         self.assertEqual(
             a.assemble("JMP loop\nDEX\nDEX\nDEX\nloop"),
-            [76, 06, 00, 202, 202, 202]
+            bytearray([76, 6, 0, 202, 202, 202])
         )
         a = self._asm()
         self.assertEqual(
-            a.assemble("label1: JMP label1\nJMP label2\nlabel2: JMP label1\nJMP label2"),
-            [76, 00, 00, 76, 06, 00, 76, 00, 00, 76, 06, 00]
+            a.assemble("label1: JMP label1\nJMP label2\n"
+                       "label2: JMP label1\nJMP label2"),
+            bytearray([76, 0, 0, 76, 6, 0, 76, 0, 0, 76, 6, 0])
         )
 
+    def test_forward_references(self):
+        a = self._asm()
+        self.assertEqual(
+            a.assemble("LDA (ptr),Y\nSTA (ptr,X)\n.WORD ptr\nptr = *"),
+            bytearray([177, 6, 129, 6, 6, 0])
+        )
+        a = self._asm()
+        self.assertEqual(a.assemble(".BYTE end\nend"), bytearray([1]))
+
+    def test_byte_out_of_range(self):
+        a = self._asm()
+        self.assertRaises(Exception, a.assemble, ".BYTE x\nx = 300")
+        self.assertRaises(Exception, a.assemble, ".BYTE x+1\nx = $FF")
+        self.assertRaises(Exception, a.assemble,
+                          "LDA (ptr),Y\n.ORG $200\nptr: NOP")
+        self.assertEqual(a.assemble(".BYTE x\nx = -1"), bytearray([0xff]))
+
+    def test_operand_out_of_range(self):
+        a = self._asm()
+        for source in ["LDA #$1FF", "LDA #256", "LDA #-200", "LDA ($200,X)",
+                       "x = 300\nLDA #x", "LDA #1+$FF"]:
+            self.assertRaises(Exception, a.assemble, source)
+        self.assertEqual(a.assemble("LDA #-128\nLDA #$FF"),
+                         bytearray([169, 0x80, 169, 0xff]))
+
+    def test_many_labels(self):
+        a = self._asm()
+        n = 5000
+        out = a.assemble("\n".join(
+            "l%d: JMP l%d" % (i, (i + 1) % n) for i in range(n)
+        ))
+        self.assertEqual(len(out), 3 * n)
+        self.assertEqual(out[-3:], bytearray([76, 0, 0]))
+        self.assertEqual(out[3 * 1234:3 * 1235], bytearray([76, 0x79, 0x0e]))
+        self.assertEqual(a.symbols['l4999'], 3 * 4999)
+
+    def test_undefined_symbol(self):
+        a = self._asm()
+        self.assertRaises(Exception, a.assemble, "JMP nowhere")
+
     def test_branch(self):
         a = self._asm()
         self.assertEqual(a.assemble("label: DEX\nDEX\nBNE label"),
-            [202, 202, 208, 252]
-        )
+                         bytearray([202, 202, 208, 252]))
         a = self._asm()
         self.assertEqual(a.assemble("BNE label\nDEX\nDEX\nlabel"),
-            [208, 2, 202, 202]
-        )
+                         bytearray([208, 2, 202, 202]))
+
+    def test_branch_to_address(self):
+        a = self._asm()
+        self.assertEqual(a.assemble(".ORG $1000\nBNE $1005\nx = $0FF0\n"
+                                    "BEQ x"),
+                         bytearray([208, 3, 240, 236]))
+        self.assertRaises(Exception, a.assemble, "BNE $1000")
+        self.assertRaises(Exception, a.assemble, "x = $1000\nBNE x")
+        self.assertRaises(Exception, a.assemble, "BNE #1")
+
+        a = Assembler(relax=True)
+        self.assertEqual(a.assemble("BNE $1000\nx = $2000\nBCC x"),
+                         bytearray([240, 3, 76, 0, 0x10,
+                                    176, 3, 76, 0, 0x20]))
+        self.assertEqual(a.relaxed, 2)
 
     def test_variables(self):
         a = self._asm()
-        self.assertEqual(a.assemble("var = $ff\nlda #var"),[169, 255])
-        self.assertEqual(a.assemble("var = $ff\nlda var"),[165, 255])
-        self.assertEqual(a.assemble("var = $ffff\nlda var"),[173, 255, 255])
+        self.assertEqual(a.assemble("var = $ff\nlda #var"),
+                         bytearray([169, 255]))
+        self.assertEqual(a.assemble("var = $ff\nlda var"),
+                         bytearray([165, 255]))
+        self.assertEqual(a.assemble("var = $ffff\nlda var"),
+                         bytearray([173, 255, 255]))
         self.assertEqual(
             a.assemble("var1 = *\nlda #var1\nvar2 = *\nlda #var2"),
-            [169, 0, 0, 169, 3, 0]
+            bytearray([169, 0, 0, 169, 3, 0])
         )
 
     def test_byte(self):
         a = self._asm()
-        self.assertEqual(a.assemble(".BYTE $0A"), [0xa])
+        self.assertEqual(a.assemble(".BYTE $0A"), bytearray([0xa]))
+        self.assertEqual(a.assemble(".BYTE 0"), bytearray([0]))
 
     def test_word(self):
         a = self._asm()
-        self.assertEqual(a.assemble(".WORD $0A"), [0xa, 0x00])
-        self.assertEqual(a.assemble(".WORD $AAA"), [0xaa, 0xa])
+        self.assertEqual(a.assemble(".WORD $0A"), bytearray([0xa, 0x00]))
+        self.assertEqual(a.assemble(".WORD $AAA"), bytearray([0xaa, 0xa]))
+        self.assertEqual(a.assemble(".WORD $0000"), bytearray([0, 0]))
+
+    def test_byte_list(self):
+        a = self._asm()
+        self.assertEqual(a.assemble(".BYTE 1, $02, %11, 0"),
+                         bytearray([1, 2, 3, 0]))
+        self.assertEqual(a.assemble('.BYTE "HI", 0, -1, end\nend'),
+                         bytearray([0x48, 0x49, 0, 0xff, 5]))
+        self.assertRaises(Exception, a.assemble, ".BYTE 1,")
+        self.assertRaises(Exception, a.assemble, ".BYTE")
+        self.assertRaises(Exception, a.assemble, ".BYTE 1, 300")
+        self.assertRaises(Exception, a.assemble, ".BYTE 256")
+        self.assertRaises(Exception, a.assemble, "x = 300\n.BYTE x")
+        self.assertRaises(Exception, a.assemble, ".BYTE -129")
+
+    def test_word_list(self):
+        a = self._asm()
+        self.assertEqual(a.assemble(".WORD $1234, 0, -2"),
+                         bytearray([0x34, 0x12, 0, 0, 0xfe, 0xff]))
+        self.assertEqual(a.assemble(".ORG $C000\n.WORD 1, end, end+1\nend"),
+                         bytearray([1, 0, 6, 0xc0, 7, 0xc0]))
+
+    def test_text(self):
+        a = self._asm()
+        self.assertEqual(a.assemble('.TEXT "AB", "C"'),
+                         bytearray([0x41, 0x42, 0x43]))
+        self.assertRaises(Exception, a.assemble, '.TEXT 1')
+
+    def test_fill(self):
+        a = self._asm()
+        self.assertEqual(a.assemble(".FILL 3, $EA\n.FILL 2"),
+                         bytearray([0xea, 0xea, 0xea, 0, 0]))
+        self.assertEqual(a.assemble("n = 4\n.FILL n, n\n.FILL 0"),
+                         bytearray([4] * 4))
+        self.assertRaises(Exception, a.assemble, ".FILL later\nlater = 1")
+        self.assertRaises(Exception, a.assemble, ".FILL -1")
+        self.assertRaises(Exception, a.assemble, ".FILL 2, 300")
+
+    def test_table(self):
+        a = self._asm()
+        self.assertEqual(a.assemble(".TABLE i, 0, 4, i*i"),
+                         bytearray([0, 1, 4, 9, 16]))
+        self.assertEqual(a.assemble(".TABLE i, 1, 3, i"),
+                         bytearray([1, 2, 3]))
+        self.assertEqual(a.assemble("base = $C000\n"
+                                    ".TABLE i, 0, 2, base+i*$100, 2"),
+                         bytearray([0, 0xc0, 0, 0xc1, 0, 0xc2]))
+        self.assertEqual(a.assemble(".TABLE i, 0, 2, >(i*$100)"),
+                         bytearray([0, 1, 2]))
+        self.assertEqual(a.assemble(".TABLE i, 0, 2, (i+1)*2"),
+                         bytearray([2, 4, 6]))
+        self.assertEqual(a.assemble(".TABLE i, 0, 1, 7\n.TABLE i, 1, 0, i"),
+                         bytearray([7, 7]))
+        # i is only defined inside the table
+        self.assertRaises(Exception, a.assemble, ".TABLE i, 0, 1, i\nLDA i")
+        self.assertRaises(Exception, a.assemble,
+                          ".TABLE i, 0, 1, later\nlater:")
+        self.assertRaises(Exception, a.assemble, ".TABLE i, 0, 1, i, 3")
+        self.assertRaises(Exception, a.assemble, ".TABLE 1, 0, 1, 1")
+        self.assertRaises(Exception, a.assemble, ".TABLE i, 0, 20, i*i")
+        # X and Y are only registers at the end of an instruction
+        self.assertEqual(a.assemble("x = 1\ny = 2\n.FILL 2, x\n.BYTE 1, y\n"
+                                    ".TABLE x, 0, 3, x\nLDA $10,x"),
+                         bytearray([1, 1, 1, 2, 0, 1, 2, 3, 0xb5, 0x10]))
+
+    def test_label_values(self):
+        # Directives and variables can use the labels defined before them
+        a = self._asm()
+        self.assertEqual(
+            a.assemble("start: NOP\nx: NOP\nend:\n.FILL end-start, 1\n"
+                       "y = x+1\n.BYTE y\n.ORG x+10\nz: .BYTE z"),
+            bytearray([0x1a, 0x1a, 1, 1, 2] + [0] * 6 + [11])
+        )
+        self.assertEqual(a.symbols['y'], 2)
+        self.assertRaises(Exception, a.assemble, ".ORG later\nlater: NOP")
 
     def test_org(self):
         a = self._asm()
         self.assertEqual(
             a.assemble(".BYTE 01\n.ORG 10\n.BYTE 02"),
-            [1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2]
+            bytearray([1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2])
         )
         self.assertEqual(
             a.assemble(".ORG $8000\n.BYTE 1\nlabel: .BYTE 2\nJMP label"),
-            [1, 2, 76, 01, 0x80]
+            bytearray([1, 2, 76, 1, 0x80])
         )
         self.assertEqual(
-            a.assemble("a = 5\n.ORG $8000\n.BYTE 1\nlabel: .BYTE 2\nJMP label"),
-            [1, 2, 76, 01, 0x80]
+            a.assemble("a = 5\n.ORG $8000\n.BYTE 1\nlabel: .BYTE 2\n"
+                       "JMP label"),
+            bytearray([1, 2, 76, 1, 0x80])
         )
         self.assertEqual(
-            a.assemble(".ORG $8000\n.BYTE 1\n.ORG $8005\nlabel: .BYTE 2\nJMP label"),
-            [1, 0, 0, 0, 0, 2, 76, 01, 0x80]
+            a.assemble(".ORG $8000\n.BYTE 1\n.ORG $8005\nlabel: .BYTE 2\n"
+                       "JMP label"),
+            bytearray([1, 0, 0, 0, 0, 2, 76, 5, 0x80])
         )
 
+    def test_nothing_kept_between_calls(self):
+        a = self._asm()
+        a.assemble(".ORG $8000\nx: NOP\ny = 5")
+        self.assertEqual(a.symbols, {'x': 0x8000, 'y': 5})
+        self.assertRaises(Exception, a.assemble, "JMP x")
+        self.assertRaises(Exception, a.assemble, "LDA y")
+        a.assemble("x: NOP")
+        self.assertEqual(a.symbols['x'], 0)
+
+        # Symbols given to the Assembler are kept, but not ones set after
+        # a call
+        a = Assembler(symbols={'z': 2})
+        self.assertEqual(a.assemble("LDA z"), bytearray([165, 2]))
+        self.assertEqual(a.assemble("LDA z"), bytearray([165, 2]))
+        a.symbols['w'] = 3
+        self.assertRaises(Exception, a.assemble, "LDA w")
+
+    def test_threads(self):
+        a = self._asm()
+        failures = []
+
+        def work(n):
+            source = "v = %d\nstart: LDA #v\nJMP later\nlater: .WORD start" % n
+            expected = bytearray([169, n, 76, 5, 0, 0, 0])
+            try:
+                for i in range(50):
+                    if a.assemble(source) != expected:
+                        failures.append(n)
+                    c = a.context()
+                    c.assemble(source)
+                    if c.symbols != {'v': n, 'start': 0, 'later': 5}:
+                        failures.append(n)
+            except Exception as e:
+                failures.append(e)
+
+        threads = [threading.Thread(target=work, args=(n,))
+                   for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(failures, [])
+
+    def test_threads_given(self):
+        # Symbols one call defines are never given to another running at
+        # the same time
+        a = Assembler(symbols={'z': 2})
+        failures = []
+
+        def define():
+            for i in range(200):
+                a.assemble("shared = 1\nLDA z")
+
+        def use():
+            for i in range(200):
+                try:
+                    a.assemble("LDA shared")
+                    failures.append(i)
+                except Exception:
+                    pass
+
+        threads = [threading.Thread(target=f)
+                   for f in [define, use, define, use]]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(failures, [])
+
+    def test_segments(self):
+        a = self._asm()
+        segments = a.assemble(
+            ".ORG $8000\nstart: JMP start\n.ORG $FFFC\n.WORD start",
+            flat=False
+        )
+        self.assertEqual(
+            [(s.start, s.data) for s in segments],
+            [(0x8000, bytearray([76, 0, 0x80])),
+             (0xfffc, bytearray([0, 0x80]))]
+        )
+        self.assertEqual(segments.end, 0xfffe)
+        self.assertEqual(len(segments.flatten()), 0x7ffe)
+
+    def test_segment_fill(self):
+        a = Assembler(fill=0xff)
+        self.assertEqual(
+            a.assemble(".BYTE 1\n.ORG 4\n.BYTE 2"),
+            bytearray([1, 0xff, 0xff, 0xff, 2])
+        )
+
+    def test_many_segments(self):
+        a = Assembler(fill=0xff)
+        out = a.assemble("\n".join(
+            ".ORG %d\n.BYTE %d" % (i * 3, i & 0xff) for i in range(5000)
+        ))
+        self.assertEqual(len(out), 3 * 4999 + 1)
+        self.assertEqual(out[3 * 77:3 * 78], bytearray([77, 0xff, 0xff]))
+
+    def test_segment_overlap(self):
+        a = self._asm()
+        self.assertRaises(
+            Exception, a.assemble,
+            ".ORG 10\n.WORD 1\n.ORG 5\n.WORD 1\n.WORD 2\n.WORD 3"
+        )
+        a = self._asm()
+        self.assertEqual(
+            a.assemble(".ORG 10\n.BYTE 2\n.ORG 8\n.BYTE 1"),
+            bytearray([1, 0, 2])
+        )
+
+    def test_assemble_generator(self):
+        def lines():
+            yield "loop: DEX"
+            yield "BNE loop"
+
+        a = self._asm()
+        self.assertEqual(a.assemble(lines()), bytearray([202, 208, 253]))
+
+    def test_assemble_iter(self):
+        a = self._asm()
+        chunks = list(a.assemble_iter(
+            ".ORG $8000\nstart: LDA #1\nBNE fwd\nNOP\nfwd: JMP start\n"
+            ".ORG $9000\n.WORD later\nlater = $1234\nNOP"
+        ))
+        self.assertEqual(chunks, [
+            (0x8000, bytearray([169, 1])),
+            (0x8002, bytearray([208])),
+            (0x8003, bytearray([1, 26, 76, 0, 0x80])),
+            (0x9000, bytearray([0x34, 0x12])),
+            (0x9002, bytearray([26])),
+        ])
+        self.assertEqual(a.symbols['fwd'], 0x8005)
+
+    def test_duplicate_label(self):
+        a = self._asm()
+        self.assertRaises(Exception, a.assemble, "x: NOP\nx: NOP")
+
     def test_assemble_file(self):
         a = self._asm()
 
@@ -206,8 +536,8 @@ class TestAssembler(unittest.TestCase):
         out = a.assemble(open(f))
 
         self.assertEqual(len(out), 0x4000)
-        self.assertEqual(out[:5], [0xa9, 0xff, 0x4c, 0x00, 0xc0])
-        self.assertEqual(out[-3:], [0x99, 0x00, 0xc0])
+        self.assertEqual(out[:5], bytearray([0xa9, 0xff, 0x4c, 0x00, 0xc0]))
+        self.assertEqual(out[-3:], bytearray([0x99, 0x00, 0xc0]))
 
     def test_write_file(self):
         a = self._asm()
@@ -217,12 +547,79 @@ class TestAssembler(unittest.TestCase):
         with open(out) as f:
             self.assertEqual(f.read(), "HELLO")
 
+        a.assemble(".byte 72\n.org 4\n.byte 79", out)
+
+        with open(out, 'rb') as f:
+            self.assertEqual(f.read(), bytearray([72, 0, 0, 0, 79]))
+
     def test_lda_0(self):
         a = self._asm()
-        self.assertEqual(a.assemble("lda #0"), [169, 0])
+        self.assertEqual(a.assemble("lda #0"), bytearray([169, 0]))
+        self.assertEqual(a.assemble("lda $0000"), bytearray([173, 0, 0]))
+
+    def test_zero_page_forward(self):
+        source = ".ORG $1000\nLDA tmp\nSTA tmp,X\nLDX tmp,Y\nJMP tmp\n" \
+            "LDA #tmp\n.ORG $10\ntmp: .BYTE 1"
+        a = Assembler(zero_page=True)
+        self.assertEqual(
+            [(start, list(data)) for start, data in
+             a.assemble(source, flat=False)],
+            [(0x10, [1]), (0x1000, [165, 16, 149, 16, 182, 16, 76, 16, 0,
+                                    169, 16, 0])]
+        )
+        self.assertEqual(a.zeroPage, set(['tmp']))
+        self.assertEqual(self._asm().assemble(source)[-15:-12],
+                         bytearray([173, 16, 0]))
+
+    def test_zero_page_converges(self):
+        # Each pass shrinks the code enough for one more label to fit
+        source = ".ORG $F6\nLDA a1\nLDA a2\nLDA a3\na1: NOP\na2: NOP\n" \
+            "a3: NOP"
+        a = Assembler(zero_page=True)
+        self.assertEqual(a.assemble(source), bytearray([
+            165, 0xfc, 165, 0xfd, 165, 0xfe, 26, 26, 26
+        ]))
+        self.assertEqual(a.sizePasses, 4)
+
+        # Out of passes, so everything stays absolute
+        a = Assembler(zero_page=True, max_passes=3)
+        self.assertEqual(a.assemble(source), self._asm().assemble(source))
+
+    def test_bvs(self):
+        a = self._asm()
+        self.assertEqual(a.assemble("l: BVS l\nBVC l"),
+                         bytearray([0x70, 0xfe, 0x50, 0xfc]))
+
+    def test_relax(self):
+        source = "BNE far\nnear: BEQ near\n" + "NOP\n" * 200 + \
+            "far: BCC near"
+        self.assertRaises(Exception, self._asm().assemble, source)
+
+        a = Assembler(relax=True)
+        out = a.assemble(source)
+        self.assertEqual(a.relaxed, 2)
+        self.assertEqual(out[:7], bytearray([0xf0, 3, 0x4c, 207, 0, 0xf0,
+                                             0xfe]))
+        self.assertEqual(out[-5:], bytearray([0xb0, 3, 0x4c, 5, 0]))
+
+    def test_relax_cascade(self):
+        # Relaxing the second branch pushes the first out of range
+        source = "BNE c\nBNE b\n" + "NOP\n" * 124 + "c: NOP\nNOP\nNOP\n" \
+            "NOP\nb: NOP"
+        a = Assembler(relax=True)
+        out = a.assemble(source)
+        self.assertEqual(a.relaxed, 2)
+        self.assertEqual(a.sizePasses, 3)
+        self.assertEqual(out[:10], bytearray([0xf0, 3, 0x4c, 134, 0,
+                                              0xf0, 3, 0x4c, 138, 0]))
+
+        # In range branches keep the short form
+        a.assemble("BNE b\n" + "NOP\n" * 100 + "b: NOP")
+        self.assertEqual(a.relaxed, 0)
 
     def tearDown(self):
         pass
 
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_benchmarks
+----------------------------------
+
+Tests for the benchmark program generator.
+"""
+
+import unittest
+
+from benchmarks.generate import Program
+from benchmarks.run import compare
+from py65asm.assembler import Assembler
+
+
+class TestGenerate(unittest.TestCase):
+
+    def test_deterministic(self):
+        self.assertEqual(Program(300).source(), Program(300).source())
+        self.assertNotEqual(Program(300).source(),
+                            Program(300, seed=1).source())
+
+    def test_assembles(self):
+        for program in [Program(2000), Program(500, org_every=0),
+                        Program(500, labels=0.5, forward=0.9, branches=0.4),
+                        Program(500, labels=0.01, forward=0, data=0.8)]:
+            out = Assembler().assemble(program.source())
+            self.assertTrue(len(out) > program.lines)
+
+    def test_compare(self):
+        baseline = {'1000': {'lines_per_sec': 1000, 'peak_kb': 100}}
+        self.assertEqual(compare(
+            {'1000': {'lines_per_sec': 800, 'peak_kb': 120}}, baseline, 0.25
+        ), [])
+        self.assertEqual(len(compare(
+            {'1000': {'lines_per_sec': 700, 'peak_kb': 130}}, baseline, 0.25
+        )), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_disassembler
+----------------------------------
+
+Tests for `py65asm.disassembler` module.
+"""
+
+import random
+import unittest
+
+from py65asm.assembler import Assembler
+from py65asm.disassembler import Disassembler, opcodes, boundaries
+
+
+class TestDisassembler(unittest.TestCase):
+
+    def _roundTrip(self, data, org=0, symbols=None):
+        source = Disassembler(symbols).disassemble(data, org)
+        self.assertEqual(Assembler().assemble(source), data)
+        return source
+
+    def test_opcode_table(self):
+        self.assertEqual(opcodes[0xa9], ('LDA', 'im', 2))
+        self.assertEqual(opcodes[0x0a], ('ASL', 'im', 1))
+        self.assertEqual(opcodes[0xa2], ('LDX', 'im', 2))
+        self.assertEqual(opcodes[0x6c], ('JMP', 'i', 3))
+        self.assertEqual(opcodes[0xb1], ('LDA', 'iy', 2))
+        self.assertEqual(opcodes[0x04], None)
+
+    def test_every_opcode(self):
+        for opcode in range(256):
+            self._roundTrip(bytearray([opcode, 0x34, 0x12]), 0x1000)
+
+    def test_listing(self):
+        data = bytearray([0xa9, 0x00, 0x8d, 0x00, 0x00, 0xb1, 0xfb,
+                          0xd0, 0xf7, 0x4c, 0x02, 0xc0, 0x04])
+        self.assertEqual(self._roundTrip(data, 0xc000).split('\n'), [
+            ".ORG $C000",
+            "LC000: LDA #$00",
+            "LC002: STA $0000",
+            "    LDA ($FB),Y",
+            "    BNE LC000",
+            "    JMP LC002",
+            "    .BYTE $04",
+        ])
+
+    def test_symbols(self):
+        a = Assembler()
+        source = "ptr = $FB\nscreen = $0400\n.ORG $8000\n" \
+            "start: LDA (ptr),Y\nSTA screen\nSTA $02\nBNE start\n" \
+            "JMP far\nend:"
+        data = a.assemble(source.replace("far", "$9000"))
+        a.symbols['far'] = 0x9000
+        listing = self._roundTrip(data, 0x8000, a.symbols)
+        self.assertEqual(listing.split('\n'), [
+            "ptr = $FB",
+            "screen = $0400",
+            "far = $9000",
+            ".ORG $8000",
+            "start: LDA (ptr),Y",
+            "    STA screen",
+            "    STA $02",
+            "    BNE start",
+            "    JMP far",
+            "end:",
+        ])
+
+    def test_branch_out_of_image(self):
+        self.assertEqual(
+            self._roundTrip(bytearray([0xd0, 0x10])).split('\n')[1:],
+            ["    .BYTE $D0", "    .BYTE $10"]
+        )
+
+    def test_random_round_trip(self):
+        r = random.Random(65)
+        for trial in range(100):
+            data = bytearray([r.randrange(256)
+                              for i in range(r.randrange(1, 200))])
+            self._roundTrip(data, r.randrange(0x100, 0x8000))
+
+    def test_boundaries(self):
+        self.assertEqual(boundaries(bytearray([0xa9, 1, 0x04, 0x4c, 0, 0,
+                                               0x0a, 0xad])), [0, 2, 3, 6, 7])
+        self.assertEqual(boundaries(bytearray()), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_expressions
+----------------------------------
+
+Tests for `py65asm.expressions` module.
+"""
+
+import unittest
+
+from py65asm.assembler import Assembler
+from py65asm.expressions import compileExpression, Expression
+from py65asm.lexer import tokenize
+
+
+class TestExpressions(unittest.TestCase):
+
+    def _compile(self, text):
+        return compileExpression(tokenize(text, operand=True))
+
+    def test_constants(self):
+        for text, value in [
+            ("1+2*3", 7), ("(1+2)*3", 9), ("7/2", 3), ("-1", -1),
+            ("$1234&$FF", 0x34), ("1|2^3", 1), ("1<<4+1", 32),
+            ("$8000>>8", 0x80), ("<$1234", 0x34), (">$1234", 0x12),
+            ("<-1", 0xff), ("2*-3", -6), ("10-4-3", 3), ("64/4/2", 8),
+        ]:
+            self.assertEqual(self._compile(text), value, text)
+
+    def test_symbols(self):
+        self.assertEqual(self._compile("(label)"), 'label')
+
+        e = self._compile("base+n*2-base")
+        self.assertTrue(isinstance(e, Expression))
+        self.assertEqual(e.symbols, ('base', 'n'))
+        self.assertEqual(e.evaluate({'base': 0x1000, 'n': 3}.get), 6)
+        self.assertEqual(e.evaluate({'base': 0x1000}.get), None)
+        self.assertEqual(e, self._compile("base + n * 2 - base"))
+
+    def test_folding(self):
+        e = self._compile("x+(2*8)")
+        self.assertEqual(e.evaluate({'x': 1}.get), 17)
+        # The constant part is a single node: x plus one folded number
+        self.assertEqual(len(e.function.__closure__), 3)
+
+    def test_invalid(self):
+        for text in ["1+", "(1", "1)", "*2", "1 2", "x,y"]:
+            self.assertEqual(self._compile(text), None, text)
+        self.assertRaises(Exception, self._compile, "1/0")
+        self.assertRaises(Exception, self._compile, "1<<-1")
+
+
+class TestAssemblerExpressions(unittest.TestCase):
+
+    def test_arguments(self):
+        a = Assembler()
+        a.symbols = {'table': 0x1234, 'zp': 0x10}
+        self.assertEqual(a.getArgument("#<table"), ('im', 0x34))
+        self.assertEqual(a.getArgument("#>table"), ('im', 0x12))
+        self.assertEqual(a.getArgument("table+1,X"), ('ax', 0x1235))
+        self.assertEqual(a.getArgument("zp+1,X"), ('zx', 0x11))
+        self.assertEqual(a.getArgument("(zp*2),Y"), ('iy', 0x20))
+        self.assertEqual(a.getArgument("(table-4)"), ('i', 0x1230))
+        self.assertEqual(a.getArgument("$FF+1"), ('a', 0x100))
+
+    def test_forward(self):
+        a = Assembler()
+        out = a.assemble(
+            ".ORG $8000\nLDA table+1,X\nLDA #<table\nLDX #>table\n"
+            ".WORD table-start\n.BYTE <(table>>1)\nstart: BNE start+2\n"
+            "STA base+n*2\ntable: .BYTE 1\nbase = $2000\nn = 3"
+        )
+        self.assertEqual(out, bytearray([
+            0xbd, 0x10, 0x80, 0xa9, 0x0f, 0xa2, 0x80, 0x05, 0x00, 0x07,
+            0xd0, 0x00, 0x8d, 0x06, 0x20, 0x01,
+        ]))
+
+    def test_values(self):
+        # A leading ( is grouping in a value, not indirect addressing
+        a = Assembler()
+        self.assertEqual(a.assemble(".BYTE (1+2)*3"), bytearray([9]))
+        self.assertEqual(a.assemble("x = (2+3)*4\n.BYTE x"), bytearray([20]))
+        segments = a.assemble("base = 3\n.ORG (base+1)*2\n.BYTE 1",
+                              flat=False)
+        self.assertEqual([(s.start, s.data) for s in segments],
+                         [(8, bytearray([1]))])
+        self.assertEqual(a.assemble(".WORD (y+1)*2\ny = $100"),
+                         bytearray([2, 2]))
+        self.assertRaises(Exception, a.assemble, ".BYTE #1")
+
+    def test_floating_label(self):
+        a = Assembler()
+        self.assertEqual(
+            a.assemble("JMP end+1\n.ORG $20\nend:\n.ORG $10\nRTS"),
+            bytearray([76, 0x11, 0] + [0] * 13 + [96])
+        )
+
+    def test_zero_page(self):
+        a = Assembler(zero_page=True)
+        self.assertEqual(a.assemble("LDA tmp+1\nSTA tmp+$100\ntmp = $10"),
+                         bytearray([0xa5, 0x11, 0x8d, 0x10, 0x01]))
+
+    def test_undefined(self):
+        a = Assembler()
+        self.assertRaises(Exception, a.assemble, "JMP here+there\nhere: RTS")
+
+
+if __name__ == '__main__':
+    unittest.main()
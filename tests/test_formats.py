@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_formats
+----------------------------------
+
+Tests for `py65asm.formats` module.
+"""
+
+import io
+import os
+import tempfile
+import unittest
+
+from py65asm.assembler import Assembler
+from py65asm.formats import BUFFER_SIZE, writeOutput, writeIntelHex, \
+    writeSRecords
+
+
+class TestFormats(unittest.TestCase):
+
+    def _write(self, chunks, fmt, **kwargs):
+        f = io.BytesIO()
+        n = writeOutput(f, chunks, fmt, **kwargs)
+        self.assertEqual(n, len(f.getvalue()))
+        return f.getvalue()
+
+    def test_intel_hex(self):
+        data = bytearray.fromhex("214601360121470136007EFE09D21901")
+        self.assertEqual(self._write([(0x100, data)], 'hex'),
+                         b":10010000214601360121470136007EFE09D2190140\n"
+                         b":00000001FF\n")
+
+    def test_s_records(self):
+        data = bytearray.fromhex("285F245F2212226A000424290008237C")
+        self.assertEqual(self._write([(0, data)], 'srec'),
+                         b"S0030000FC\n"
+                         b"S1130000285F245F2212226A000424290008237C2A\n"
+                         b"S9030000FC\n")
+
+    def test_records_skip_gaps(self):
+        segments = Assembler().assemble(
+            ".ORG $1000\n.WORD 1\n.ORG $F000\nRTS", flat=False
+        )
+        self.assertEqual(self._write(segments, 'hex'),
+                         b":021000000100ED\n"
+                         b":01F0000060AF\n"
+                         b":00000001FF\n")
+        f = io.BytesIO()
+        writeIntelHex(f, [(0, bytearray(5))], record_size=2)
+        self.assertEqual(f.getvalue().count(b'\n'), 4)
+
+    def test_images(self):
+        segments = Assembler().assemble(
+            ".ORG $0801\nNOP\n.ORG $0804\nRTS", flat=False
+        )
+        self.assertEqual(self._write(segments, 'bin', fill=0xff),
+                         b"\x1a\xff\xff\x60")
+        self.assertEqual(self._write(segments, 'prg'),
+                         b"\x01\x08\x1a\x00\x00\x60")
+        self.assertEqual(self._write([], 'bin'), b"")
+        self.assertRaises(Exception, self._write, [], 'prg')
+        self.assertRaises(Exception, self._write,
+                          [(0x10, b"\x01"), (0x08, b"\x02")], 'bin')
+
+    def test_streamed(self):
+        source = "LDA later\n" + "NOP\n" * 100 + "later: RTS"
+        a = Assembler(0xc000)
+        whole = self._write(a.assemble(source, flat=False), 'srec')
+        self.assertEqual(self._write(a.assemble_iter(source), 'srec'), whole)
+
+    def test_large_data_not_copied(self):
+        written = []
+
+        class Recorder(object):
+            write = written.append
+
+        blob = memoryview(bytearray(range(256)) * 256)
+        gap = 0x1000 + BUFFER_SIZE * 2
+        writeOutput(Recorder(), [(0, bytearray(1)), (1, blob),
+                                 (0x10001 + gap, bytearray(1))])
+        self.assertTrue(written[1] is blob)
+        self.assertEqual(sum([len(data) for data in written]),
+                         0x10002 + gap)
+        self.assertTrue(max([len(data) for data in written]) <= 0x10000)
+
+    def test_file_descriptor(self):
+        fd, path = tempfile.mkstemp()
+        try:
+            writeSRecords(fd, [(0x1234, b"\x01\x02")], entry=0x1234)
+            os.close(fd)
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), b"S0030000FC\nS10512340102B1\n"
+                                           b"S9031234B6\n")
+        finally:
+            os.remove(path)
+
+    def test_assembler_output_format(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            Assembler(0x0801, output_format='prg').assemble("RTS", path)
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), b"\x01\x08\x60")
+        finally:
+            os.remove(path)
+        self.assertRaises(Exception, Assembler, output_format='elf')
+        self.assertRaises(Exception, self._write, [], 'elf')
+
+
+if __name__ == '__main__':
+    unittest.main()
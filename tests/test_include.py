@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_include
+----------------------------------
+
+Tests for .INCLUDE and the `py65asm.include` module.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from py65asm.assembler import Assembler
+from py65asm import include
+from py65asm.include import UnitCache
+
+
+class FileTest(object):
+    """Creates files for a test in a temporary directory."""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.units = UnitCache()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _write(self, name, text, mode='w'):
+        path = os.path.join(self.dir, name)
+        with open(path, mode) as f:
+            f.write(text)
+        return path
+
+    def _asm(self, **kwargs):
+        kwargs.setdefault('units', self.units)
+        return Assembler(**kwargs)
+
+
+class TestInclude(FileTest, unittest.TestCase):
+
+    def test_include(self):
+        self._write("lib.asm", "sub: LDA #1\nRTS")
+        main = self._write("main.asm", 'JSR sub\n.INCLUDE "lib.asm"\nBNE sub')
+        with open(main) as f:
+            out = self._asm().assemble(f)
+        self.assertEqual(out, bytearray([32, 3, 0, 169, 1, 96, 208, 251]))
+
+    def test_include_path(self):
+        os.mkdir(os.path.join(self.dir, "lib"))
+        self._write(os.path.join("lib", "a.asm"), '.INCLUDE "b.asm"')
+        self._write(os.path.join("lib", "b.asm"), "RTS")
+        a = self._asm(include_path=[os.path.join(self.dir, "lib")])
+        self.assertEqual(a.assemble('.include "a.asm"'), bytearray([96]))
+        self.assertRaises(Exception, a.assemble, '.include "c.asm"')
+        self.assertRaises(Exception, a.assemble, '.include a.asm')
+
+    def test_recursive(self):
+        self._write("a.asm", '.INCLUDE "b.asm"')
+        self._write("b.asm", '.INCLUDE "a.asm"')
+        a = self._asm(include_path=[self.dir])
+        self.assertRaises(Exception, a.assemble, '.INCLUDE "a.asm"')
+
+    def test_parsed_once(self):
+        # Files with the same contents share one parsed unit
+        for name in ["lib.asm", "x.asm", "y.asm"]:
+            self._write(name, "LDA #1\nSTA $10\n.WORD $1234")
+
+        a = self._asm(include_path=[self.dir])
+        first = a.assemble('.INCLUDE "lib.asm"')
+        both = a.assemble('.INCLUDE "x.asm"\n.INCLUDE "y.asm"')
+        self.assertEqual(both, first + first)
+        self.assertEqual(len(self.units.memory), 1)
+        self.assertEqual(self.units.memory.hits, 2)
+
+    def test_partially_encoded(self):
+        path = self._write("lib.asm", "LDA #1\nJMP lib\nlib: RTS")
+        a = self._asm()
+        unit = a.loadUnit(path)
+        self.assertEqual(
+            [data for tokens, data in unit.statements],
+            [bytearray([169, 1]), None, None]
+        )
+
+    def test_encoded_data(self):
+        path = self._write("lib.asm",
+                           ".BYTE 1, 2\n.WORD $1234\n.BYTE lib\nlib:")
+        unit = self._asm().loadUnit(path)
+        self.assertEqual(
+            [data for tokens, data in unit.statements],
+            [bytearray([1, 2]), bytearray([0x34, 0x12]), None, None]
+        )
+
+    def test_literal_branch(self):
+        # A branch to an address is assembled where it is included
+        self._write("lib.asm", "BNE $1005\nRTS")
+        a = self._asm(include_path=[self.dir], org=0x1000)
+        out = a.assemble('NOP\nNOP\n.INCLUDE "lib.asm"\nNOP')
+        self.assertEqual(out, bytearray([0x1a, 0x1a, 0xd0, 1, 0x60, 0x1a]))
+
+        a = self._asm(include_path=[self.dir], org=0x1000, relax=True)
+        out = a.assemble('NOP\nNOP\n.INCLUDE "lib.asm"\nNOP')
+        self.assertEqual(out, bytearray([0x1a, 0x1a, 0xd0, 1, 0x60, 0x1a]))
+        self.assertEqual(a.relaxed, 0)
+
+    def test_disk_cache(self):
+        cache_dir = os.path.join(self.dir, "cache")
+        self._write("lib.asm", "LDA #1\nRTS")
+        source = '.INCLUDE "lib.asm"'
+
+        units = UnitCache(directory=cache_dir)
+        a = self._asm(include_path=[self.dir], units=units)
+        out = a.assemble(source)
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+        # A fresh cache, as in a new process, reads the stored unit back
+        units = UnitCache(directory=cache_dir)
+        a = self._asm(include_path=[self.dir], units=units)
+        self.assertEqual(a.assemble(source), out)
+        self.assertEqual(units.memory.misses, 1)
+        self.assertEqual(len(units.memory), 1)
+
+        # Changing the file changes the key
+        self._write("lib.asm", "LDA #2\nRTS")
+        self.assertEqual(a.assemble(source), bytearray([169, 2, 96]))
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+    def test_unit_format(self):
+        # Units stored by an assembler that encoded them differently are
+        # never read
+        key = self.units.key(b"RTS")
+        saved = include.UNIT_FORMAT
+        include.UNIT_FORMAT += 1
+        try:
+            self.assertNotEqual(self.units.key(b"RTS"), key)
+        finally:
+            include.UNIT_FORMAT = saved
+        self.assertEqual(self.units.key(b"RTS"), key)
+
+
+class TestIncbin(FileTest, unittest.TestCase):
+
+    def setUp(self):
+        FileTest.setUp(self)
+        self._write("blob.bin", bytearray(range(16)), 'wb')
+
+    def _asm(self, **kwargs):
+        kwargs.setdefault('include_path', [self.dir])
+        return FileTest._asm(self, **kwargs)
+
+    def test_incbin(self):
+        a = self._asm()
+        out = a.assemble('LDA data\ndata: .INCBIN "blob.bin"\nend: RTS')
+        self.assertEqual(out, bytearray([173, 3, 0]) + bytearray(range(16)) +
+                         bytearray([96]))
+        self.assertEqual(a.symbols['end'], 19)
+
+    def test_range(self):
+        a = self._asm()
+        self.assertEqual(
+            a.assemble('len = 3\n.INCBIN "blob.bin", $A, len'),
+            bytearray([10, 11, 12])
+        )
+        self.assertEqual(
+            a.assemble('.INCBIN "blob.bin", 14'), bytearray([14, 15])
+        )
+        self.assertRaises(Exception, a.assemble, '.INCBIN "blob.bin", 10, 7')
+        self.assertRaises(Exception, a.assemble, '.INCBIN "blob.bin", x')
+        self.assertRaises(Exception, a.assemble, '.INCBIN blob')
+
+    def test_labels(self):
+        # Labels either side of the blob keep their place across an .ORG
+        a = self._asm()
+        out = a.assemble(
+            '.ORG $1000\nstart: .INCBIN "blob.bin", 0, 2\nafter:\n'
+            '.ORG $1004\nnext: .WORD start\n.WORD after'
+        )
+        self.assertEqual(out, bytearray([0, 1, 0, 0, 0, 16, 2, 16]))
+        self.assertEqual(a.symbols['next'], 0x1004)
+
+    @unittest.skipIf(sys.version_info[0] < 3, "read in on Python 2")
+    def test_zero_copy(self):
+        segments = self._asm().assemble(
+            'NOP\n.INCBIN "blob.bin"\nNOP', flat=False
+        )
+        self.assertEqual(
+            [type(s.data) for s in segments],
+            [bytearray, memoryview, bytearray]
+        )
+
+    def test_streaming(self):
+        a = self._asm()
+        source = 'JMP end\n.INCBIN "blob.bin"\nend: .INCBIN "blob.bin", 1, 1'
+        chunks = list(a.assemble_iter(source))
+        self.assertEqual(
+            b''.join([bytes(data) for address, data in chunks]),
+            bytes(self._asm().assemble(source))
+        )
+
+        out = os.path.join(self.dir, "out.bin")
+        self._asm().assemble(source, out)
+        with open(out, 'rb') as f:
+            self.assertEqual(f.read(), bytes(self._asm().assemble(source)))
+
+
+if __name__ == '__main__':
+    unittest.main()
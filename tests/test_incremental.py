@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_incremental
+----------------------------------
+
+Tests for `py65asm.incremental` module.
+"""
+
+import random
+import unittest
+
+from py65asm.assembler import Assembler
+from py65asm.incremental import Session
+
+
+class TestSession(unittest.TestCase):
+
+    def _full(self, text):
+        try:
+            return Assembler().assemble(text)
+        except Exception:
+            return None
+
+    def _output(self, session):
+        try:
+            return session.output()
+        except Exception:
+            return None
+
+    def test_load(self):
+        text = ".ORG $8000\nstart: LDA #1\nBNE start\nJMP end\nend: RTS"
+        s = Session(text)
+        self.assertEqual(s.output(), Assembler().assemble(text))
+        self.assertEqual(s.symbols['end'], 0x8007)
+
+    def test_update_shifts_labels(self):
+        s = Session("JMP end\nLDA $10\nend: RTS")
+        s.update((1, 2), "LDA $1000")
+        self.assertEqual(s.output(), bytearray([76, 6, 0, 173, 0, 0x10, 96]))
+        self.assertEqual(s.text(), "JMP end\nLDA $1000\nend: RTS")
+
+    def test_insert_and_delete(self):
+        s = Session("loop: DEX\nBNE loop")
+        s.update((1, 1), ["NOP", "NOP"])
+        self.assertEqual(s.output(), bytearray([202, 26, 26, 208, 251]))
+        s.update((1, 3), [])
+        self.assertEqual(s.output(), bytearray([202, 208, 253]))
+
+    def test_errors(self):
+        s = Session("JMP end\nend: RTS")
+        s.update((1, 2), "RTS")
+        self.assertRaises(Exception, s.output)
+        s.update((1, 2), "end: RTS")
+        self.assertEqual(s.output(), bytearray([76, 3, 0, 96]))
+
+    def test_byte_out_of_range(self):
+        s = Session(".BYTE x\nx = 300")
+        self.assertRaises(Exception, s.output)
+        s.update((1, 2), "x = $FF")
+        self.assertEqual(s.output(), bytearray([0xff]))
+        s = Session("LDA (ptr),Y\n.ORG $200\nptr: NOP")
+        self.assertRaises(Exception, s.output)
+
+    def test_variables(self):
+        s = Session("LDA var\nvar = $10\nLDA var")
+        s.update((1, 2), "var = $1000")
+        self.assertEqual(s.output(), Assembler().assemble(s.text()))
+
+    def test_expressions(self):
+        s = Session("LDA #<end\nLDX #>end\nJMP end+1\nend: RTS")
+        self.assertEqual(s.output(), bytearray([169, 7, 162, 0, 76, 8, 0, 96]))
+        s.update((0, 0), ".ORG $80F0")
+        self.assertEqual(s.output(), Assembler().assemble(s.text()))
+        self.assertEqual(s.output()[:4], bytearray([169, 0xf7, 162, 0x80]))
+
+    def test_matches_full_assembly(self):
+        r = random.Random(7)
+        lines = [
+            "l%d: NOP", "l%d", "  BNE l%d", "  JMP l%d", "  LDA l%d,X",
+            "  .WORD l%d", "  .BYTE l%d", "  LDA #1", "  STA $10",
+            "  LDA $1234",
+            ".ORG $%d000",
+        ]
+
+        def line():
+            return r.choice(lines).replace('%d', str(r.randrange(1, 8)))
+
+        for trial in range(50):
+            s = Session([line() for i in range(r.randrange(1, 30))])
+            for edit in range(10):
+                start = r.randrange(len(s.lines) + 1)
+                end = min(len(s.lines), start + r.randrange(3))
+                s.update(
+                    (start, end), [line() for i in range(r.randrange(3))]
+                )
+                self.assertEqual(self._output(s), self._full(s.text()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_lexer
+----------------------------------
+
+Tests for `py65asm.lexer` module.
+"""
+
+import unittest
+
+from py65asm.lexer import tokenize, parseOperand, Token, \
+    LABEL, OP, DIRECTIVE, SYMBOL, NUMBER, STRING, REGISTER, PUNCT
+
+
+class TestLexer(unittest.TestCase):
+
+    def _operand(self, text):
+        o = parseOperand(tokenize(text, operand=True))
+        return o and (o.mode, o.value, o.symbol)
+
+    def test_tokenize_line(self):
+        self.assertEqual(tokenize("loop:\tlda ($FB),y ; comment"), [
+            Token(LABEL, 'loop', 'loop', 0),
+            Token(OP, 'lda', 'LDA', 6),
+            Token(PUNCT, '(', '(', 10),
+            Token(NUMBER, '$FB', 0xfb, 11),
+            Token(PUNCT, ')', ')', 14),
+            Token(PUNCT, ',', ',', 15),
+            Token(REGISTER, 'y', 'Y', 16),
+        ])
+
+    def test_tokenize_directives(self):
+        self.assertEqual(tokenize("  .org $C000"), [
+            Token(DIRECTIVE, '.org', '.ORG', 2),
+            Token(NUMBER, '$C000', 0xc000, 7),
+        ])
+        self.assertEqual(tokenize('.include "lib.asm"'), [
+            Token(DIRECTIVE, '.include', '.INCLUDE', 0),
+            Token(STRING, '"lib.asm"', 'lib.asm', 9),
+        ])
+
+    def test_tokenize_variable(self):
+        self.assertEqual(
+            [t.kind for t in tokenize("var = %0101")],
+            [LABEL, PUNCT, NUMBER]
+        )
+        self.assertEqual(tokenize("var = *")[2].text, '*')
+
+    def test_tokenize_comment(self):
+        self.assertEqual(tokenize("; just a comment"), [])
+        self.assertEqual(tokenize("   "), [])
+
+    def test_numbers(self):
+        values = [t.value for t in tokenize("$ff %101 017 17 0", operand=True)]
+        self.assertEqual(values, [0xff, 5, 0o17, 17, 0])
+        self.assertRaises(Exception, tokenize, "lda $fg")
+        self.assertRaises(Exception, tokenize, "lda 12ab")
+
+    def test_invalid_character(self):
+        self.assertRaises(Exception, tokenize, "lda [$10]")
+
+    def test_operand_modes(self):
+        self.assertEqual(self._operand("#$10"), ('im', 0x10, None))
+        self.assertEqual(self._operand("#-1"), ('im', -1, None))
+        self.assertEqual(self._operand("tmp"), ('z', None, 'tmp'))
+        self.assertEqual(self._operand("tmp , x"), ('zx', None, 'tmp'))
+        self.assertEqual(self._operand("$10,Y"), ('zy', 0x10, None))
+        self.assertEqual(self._operand("(ptr,X)"), ('ix', None, 'ptr'))
+        self.assertEqual(self._operand("(ptr),Y"), ('iy', None, 'ptr'))
+        self.assertEqual(self._operand("($FFFC)"), ('i', 0xfffc, None))
+        self.assertEqual(self._operand("(ptr),X"), None)
+
+    def test_accumulator(self):
+        self.assertEqual(self._operand("A"), ('im', 'A', None))
+        self.assertEqual(self._operand("a"), ('im', 'A', None))
+        self.assertEqual(self._operand("ABC"), ('z', None, 'ABC'))
+        self.assertEqual(self._operand("A,X"), ('zx', None, 'A'))
+        self.assertEqual(tokenize("asl a")[1].kind, REGISTER)
+
+    def test_index_registers(self):
+        self.assertEqual(tokenize("lda ($10,x) ; c")[-2].kind, REGISTER)
+        self.assertEqual(tokenize("l: sta $10, y")[-1].kind, REGISTER)
+        self.assertEqual(tokenize(".BYTE 1, y")[-1].kind, SYMBOL)
+        self.assertEqual(tokenize(".TABLE x, 0, 3, x")[-1].kind, SYMBOL)
+        self.assertEqual(tokenize("lda x, y+1")[3].kind, SYMBOL)
+
+    def test_shifts(self):
+        self.assertEqual([t.text for t in tokenize("1<<2>>x<y", True)],
+                         ['1', '<<', '2', '>>', 'x', '<', 'y'])
+
+    def test_wide(self):
+        self.assertTrue(parseOperand(tokenize("$00FF", operand=True)).wide)
+        self.assertFalse(parseOperand(tokenize("$FF", operand=True)).wide)
+
+
+if __name__ == '__main__':
+    unittest.main()
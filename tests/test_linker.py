@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_linker
+----------------------------------
+
+Tests for `py65asm.objects` and `py65asm.linker` modules.
+"""
+
+import io
+import unittest
+
+from py65asm.linker import link
+from py65asm.objects import ObjectAssembler, ObjectModule
+
+
+MAIN = """
+.EXPORT main
+main: JSR print
+loop: BNE loop
+ LDA #<msg
+ LDX #>msg
+ JMP loop
+msg: .BYTE 1
+.ORG $FFFC
+.WORD main
+"""
+
+PRINT = """
+.EXPORT print
+print: LDA #1
+ RTS
+"""
+
+
+class TestLinker(unittest.TestCase):
+
+    def _module(self, source, name='', **kwargs):
+        a = ObjectAssembler(**kwargs)
+        a.assemble(source)
+        return a.module(name)
+
+    def _error(self, f, *args):
+        try:
+            f(*args)
+        except Exception as e:
+            return str(e)
+        self.fail("no error")
+
+    def test_module(self):
+        m = self._module(MAIN)
+        self.assertEqual([(s.start, s.relocatable) for s in m.sections],
+                         [(0, True), (0xfffc, False)])
+        self.assertEqual(m.size, 13)
+        self.assertEqual(m.exports, ['main'])
+        self.assertEqual(m.imports, ['print'])
+        self.assertEqual(m.symbols['msg'], (12, True))
+        # The branch moves with its target, so needs no relocation
+        self.assertEqual(sorted(m.relocations), [
+            (0, 1, 'abs16', 'print'), (0, 6, 'byte', '<msg'),
+            (0, 8, 'byte', '>msg'), (0, 10, 'abs16', 'loop'),
+            (1, 0, 'word', 'main'),
+        ])
+
+    def test_link(self):
+        segments, exports = link(
+            [self._module(MAIN, 'main.o'), self._module(PRINT, 'print.o')],
+            0xc000
+        )
+        self.assertEqual(exports, {'main': 0xc000, 'print': 0xc00d})
+        self.assertEqual([(s.start, list(s.data)) for s in segments], [
+            (0xc000, [0x20, 0x0d, 0xc0, 0xd0, 0xfe, 0xa9, 0x0c, 0xa2, 0xc0,
+                      0x4c, 0x03, 0xc0, 0x01]),
+            (0xc00d, [0xa9, 0x01, 0x60]),
+            (0xfffc, [0x00, 0xc0]),
+        ])
+
+    def test_matches_assembler(self):
+        # Linking one module at its origin gives what assembling gives
+        source = PRINT + "\n" + MAIN.replace(".EXPORT main", "")
+        from py65asm.assembler import Assembler
+        segments, exports = link([self._module(source)], 0x0800)
+        self.assertEqual(segments.flatten(0),
+                         Assembler(0x0800).assemble(source))
+
+    def test_fixed_module(self):
+        m = self._module(".ORG $1000\nstart: JMP start\n.EXPORT start")
+        self.assertEqual(m.size, 0)
+        self.assertEqual(m.symbols['start'], (0x1000, False))
+        self.assertEqual(m.relocations, [])
+
+    def test_branch_to_import(self):
+        m = self._module("BEQ far\nRTS")
+        segments, exports = link(
+            [m, self._module(".EXPORT far\nfar: RTS")], 0x0200
+        )
+        self.assertEqual(segments.flatten(0), bytearray([0xf0, 0x01, 0x60,
+                                                         0x60]))
+
+    def test_branch_to_fixed_address(self):
+        # Only the linker knows how far these branches go
+        m = self._module("NOP\nBNE $0205\nx = $0210\nBEQ x\n.ORG $0210\n"
+                         "RTS")
+        self.assertEqual(m.relocations, [(0, 2, 'rel8', '$0205'),
+                                         (0, 4, 'rel8', 'x')])
+        segments, exports = link([m], 0x0200)
+        self.assertEqual(segments.flatten(0)[:5],
+                         bytearray([0x1a, 0xd0, 0x02, 0xf0, 0x0b]))
+        self.assertEqual(self._error(link, [m], 0x0100),
+                         "Branch target too far in : $0205")
+
+    def test_expressions_and_variables(self):
+        m = self._module("base = $0400\nLDA table+1,X\nSTA base+2\n"
+                         "table: .WORD 0")
+        self.assertEqual(m.relocations, [(0, 1, 'abs16', 'table+1')])
+        segments, exports = link([m], 0x0300)
+        self.assertEqual(segments.flatten(0), bytearray([
+            0xbd, 0x07, 0x03, 0x8d, 0x02, 0x04, 0x00, 0x00
+        ]))
+
+    def test_read_write(self):
+        m = self._module(MAIN, 'main.o')
+        f = io.StringIO()
+        m.write(f)
+        f.seek(0)
+        read = ObjectModule.read(f)
+        self.assertEqual(read.name, '')
+        self.assertEqual([(s.start, s.data, s.relocatable)
+                          for s in read.sections],
+                         [(s.start, s.data, s.relocatable)
+                          for s in m.sections])
+        for k in ['symbols', 'exports', 'imports', 'relocations']:
+            self.assertEqual(getattr(read, k), getattr(m, k))
+
+        self.assertEqual(
+            self._error(ObjectModule.read, io.StringIO(u"RTS"), 'x.o'),
+            "Not an object file: x.o"
+        )
+
+    def test_errors(self):
+        main = self._module(MAIN, 'main.o')
+        self.assertEqual(self._error(link, [main]),
+                         "Undefined symbol in main.o: print")
+        self.assertEqual(
+            self._error(link, [main, self._module(PRINT, 'a.o'),
+                               self._module(PRINT, 'b.o')]),
+            "Symbol print exported by both a.o and b.o"
+        )
+        self.assertEqual(self._error(self._module, ".EXPORT nothing"),
+                         "Exported symbol not defined: nothing")
+        self.assertEqual(self._error(self._module, ".EXPORT 1"),
+                         "Expected a symbol name at column 0")
+        self.assertEqual(
+            self._error(link, [self._module("far: BNE far\n.EXPORT far"),
+                               self._module(".ORG $4000\nBNE far", 'b.o')]),
+            "Branch target too far in b.o: far"
+        )
+
+    def test_byte_out_of_range(self):
+        m = self._module(".BYTE far\n.EXPORT near\nnear: RTS", 'a.o')
+        segments, exports = link([m, self._module(".EXPORT far\nfar = $80")])
+        self.assertEqual(segments.flatten(0), bytearray([0x80, 0x60]))
+        self.assertEqual(
+            self._error(link, [m, self._module(".EXPORT far\nfar = $100")]),
+            "Value out of range for a byte in a.o: far = 256"
+        )
+
+    def test_macro_local_labels(self):
+        m = self._module(".MACRO spin\nloop: DEX\nJMP loop\n.ENDM\n"
+                         "start: spin\nspin")
+        self.assertEqual(sorted([r[3] for r in m.relocations]),
+                         ['loop@0', 'loop@1'])
+        segments, exports = link([m], org=0x1000)
+        self.assertEqual(segments.flatten(0),
+                         bytearray([0xca, 0x4c, 0, 0x10, 0xca, 0x4c, 4, 0x10]))
+        self.assertRaises(Exception, self._module, "loop@0: RTS")
+
+    def test_export_ignored_by_assembler(self):
+        from py65asm.assembler import Assembler
+        self.assertEqual(Assembler().assemble(PRINT), bytearray([0xa9, 1,
+                                                                 0x60]))
+
+
+if __name__ == '__main__':
+    unittest.main()
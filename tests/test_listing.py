@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_listing
+----------------------------------
+
+Tests for `py65asm.listing` module.
+"""
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from py65asm.assembler import Assembler
+from py65asm.listing import writeSymbols, writeViceLabels
+
+
+class TestListing(unittest.TestCase):
+
+    source = "; start\nptr = $10\n.ORG $9000\nfirst:\n.ORG $8000\n" \
+        "start: LDA #1\nJMP done\nloop: BNE loop\n.WORD done\n.BYTE ptr\n" \
+        ".ORG $8100\ndone: RTS"
+
+    expected = [
+        "                     ; start",
+        "0010                 ptr = $10",
+        "                     .ORG $9000",
+        "8000                 first:",
+        "                     .ORG $8000",
+        "8000  A9 01          start: LDA #1",
+        "8002  4C 00 81       JMP done",
+        "8005  D0 FE          loop: BNE loop",
+        "8007  00 81          .WORD done",
+        "8009  10             .BYTE ptr",
+        "                     .ORG $8100",
+        "8100  60             done: RTS",
+    ]
+
+    def _listing(self, source, stream=False, **kwargs):
+        f = io.StringIO()
+        a = Assembler(listing=f, **kwargs)
+        if stream:
+            out = list(a.assemble_iter(source))
+        else:
+            out = a.assemble(source)
+        return f.getvalue().splitlines(), out
+
+    def test_listing(self):
+        lines, out = self._listing(self.source)
+        self.assertEqual(lines, self.expected)
+
+    def test_streaming(self):
+        lines, chunks = self._listing(self.source, stream=True)
+        self.assertEqual(lines, self.expected)
+        self.assertEqual(b''.join([bytes(c) for a, c in chunks]),
+                         b'\xa9\x01\x4c\x00\x81\xd0\xfe\x00\x81\x10\x60')
+
+    def test_written_when_final(self):
+        f = io.StringIO()
+        a = Assembler(listing=f)
+        for line in ["LDA #1", "JMP later", "NOP"]:
+            a.assembleLine(line)
+        self.assertEqual(f.getvalue(), "0000  A9 01          LDA #1\n")
+        a.assembleLine("later: RTS")
+        self.assertEqual(len(f.getvalue().splitlines()), 4)
+
+    def test_relax(self):
+        lines, out = self._listing("BNE far\n" + "NOP\n" * 200 + "far: RTS",
+                                   relax=True)
+        self.assertEqual(lines[0], "0000  F0 03 4C CD .. BNE far")
+        self.assertEqual(lines[-1], "00CD  60             far: RTS")
+
+    def test_incbin(self):
+        d = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(d, "data.bin"), 'wb') as f:
+                f.write(b'\x01\x02\x03\x04\x05')
+            with open(os.path.join(d, "a.asm"), 'w') as f:
+                f.write('.ORG $1000\n.INCBIN "data.bin"\nRTS\n')
+            f = io.StringIO()
+            with open(os.path.join(d, "a.asm")) as source:
+                Assembler(listing=f).assemble(source)
+        finally:
+            shutil.rmtree(d)
+        self.assertEqual(f.getvalue().splitlines()[1:], [
+            '1000  01 02 03 04 .. .INCBIN "data.bin"',
+            '1005  60             RTS',
+        ])
+
+
+class TestSymbols(unittest.TestCase):
+
+    symbols = {'start': 0x8000, 'ptr': 0x10, 'later': None, 'end': 0x8000}
+
+    def test_symbols(self):
+        f = io.StringIO()
+        writeSymbols(f, self.symbols)
+        self.assertEqual(f.getvalue(),
+                         "ptr = $10\nend = $8000\nstart = $8000\n")
+
+    def test_vice(self):
+        f = io.StringIO()
+        writeViceLabels(f, self.symbols)
+        self.assertEqual(f.getvalue(), "al C:0010 .ptr\nal C:8000 .end\n"
+                         "al C:8000 .start\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
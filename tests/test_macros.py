@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_macros
+----------------------------------
+
+Tests for `py65asm.macros` module and the .MACRO directive.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from py65asm.assembler import Assembler
+from py65asm.macros import MacroCache
+
+
+INC16 = ".MACRO inc16 lo, hi\nINC lo\nBNE done\nINC hi\ndone:\n.ENDM\n"
+
+
+class TestMacros(unittest.TestCase):
+
+    def _assemble(self, source, **kwargs):
+        a = Assembler(macros=MacroCache(), **kwargs)
+        return a, a.assemble(source)
+
+    def _error(self, source, **kwargs):
+        try:
+            self._assemble(source, **kwargs)
+        except Exception as e:
+            return str(e)
+        self.fail("no error assembling %r" % source)
+
+    def test_expand(self):
+        a, out = self._assemble(
+            INC16 + "ptr = $10\nstart: inc16 ptr, $11\nRTS"
+        )
+        self.assertEqual(out, bytearray([0xe6, 0x10, 0xd0, 0x02, 0xe6, 0x11,
+                                         0x60]))
+        self.assertEqual(a.symbols['start'], 0)
+
+    def test_invoked_after_label(self):
+        a, out = self._assemble(".MACRO ld v\nLDA #v\n.ENDM\nfirst: ld 1\n"
+                                "ld 2")
+        self.assertEqual(out, bytearray([0xa9, 1, 0xa9, 2]))
+        self.assertEqual(a.symbols['first'], 0)
+
+    def test_no_arguments(self):
+        a, out = self._assemble(".macro pha2\nPHA\nPHA\n.endm\npha2\nPHA2")
+        self.assertEqual(out, bytearray([0x48] * 4))
+
+    def test_local_labels(self):
+        a, out = self._assemble(
+            INC16 + "inc16 $10, $11\ninc16 $20, $21\nJMP done"
+            "\ndone: RTS"
+        )
+        self.assertEqual(out[:12], bytearray([0xe6, 0x10, 0xd0, 0x02,
+                                              0xe6, 0x11] * 1 +
+                                             [0xe6, 0x20, 0xd0, 0x02,
+                                              0xe6, 0x21]))
+        self.assertEqual(a.symbols['done@0'], 6)
+        self.assertEqual(a.symbols['done@1'], 12)
+        self.assertEqual(a.symbols['done'], 15)
+
+    def test_nested(self):
+        a, out = self._assemble(
+            INC16 + ".MACRO twice\ninc16 $10, $11\ninc16 $10, $11\n.ENDM\n"
+            "twice"
+        )
+        self.assertEqual(out, bytearray([0xe6, 0x10, 0xd0, 0x02, 0xe6,
+                                         0x11] * 2))
+        self.assertEqual(a.symbols['done@1'], 6)
+        self.assertEqual(a.symbols['done@2'], 12)
+
+    def test_cached(self):
+        cache = MacroCache()
+        a = Assembler(macros=cache)
+        a.assemble(INC16 + "inc16 $10, $11\n" * 1000 + "inc16 $20, $21")
+        macro = a.macros['INC16']
+        self.assertEqual(macro.expansions.misses, 2)
+        self.assertEqual(macro.expansions.hits, 999)
+
+        # Defined again, the macro keeps its expansions
+        a.assemble(INC16 + "inc16 $10, $11")
+        self.assertTrue(a.macros['INC16'] is macro)
+        self.assertEqual(macro.expansions.misses, 2)
+
+    def test_cached_with_other_macros(self):
+        # Whether foo is a label in m depends on the macros around it
+        cache = MacroCache()
+        call = ".MACRO foo\nNOP\n.ENDM\n.MACRO m\nfoo\n.ENDM\nm"
+        label = ".MACRO m\nfoo\n.ENDM\nm\nfoo: .BYTE 2"
+        for source, out in [(label, [2]), (call, [0x1a]), (label, [2])]:
+            a = Assembler(macros=cache)
+            self.assertEqual(a.assemble(source), bytearray(out))
+
+    def test_zero_page(self):
+        # Expansions are replayed on every sizing pass
+        a, out = self._assemble(".MACRO ld v\nLDA v\n.ENDM\nld tmp\n"
+                                "tmp = $10", zero_page=True)
+        self.assertEqual(out, bytearray([0xa5, 0x10]))
+
+    def test_arguments(self):
+        self.assertIn("takes 2 arguments, got 1",
+                      self._error(INC16 + "inc16 $10"))
+
+    def test_errors(self):
+        for source, message in [
+            (".MACRO\n.ENDM", "Expected a macro name"),
+            (".MACRO LDA\n.ENDM", "Macro name is an instruction"),
+            (".MACRO m 1\n.ENDM", "Expected a parameter name"),
+            (".MACRO m\n.MACRO n\n.ENDM\n.ENDM", ".MACRO inside macro m"),
+            (".ENDM", ".ENDM without .MACRO"),
+            (".MACRO m\nNOP", "Missing .ENDM for macro m"),
+        ]:
+            self.assertIn(message, self._error(source))
+
+    def test_depth_limit(self):
+        self.assertIn("too deep: forever", self._error(
+            ".MACRO forever\nNOP\nforever\n.ENDM\nforever"
+        ))
+        a, out = self._assemble(
+            ".MACRO a1\nNOP\n.ENDM\n.MACRO a2\na1\n.ENDM\na2",
+            max_macro_depth=2
+        )
+        self.assertEqual(out, bytearray([0x1a]))
+        self.assertIn("too deep: a1", self._error(
+            ".MACRO a1\nNOP\n.ENDM\n.MACRO a2\na1\n.ENDM\na2",
+            max_macro_depth=1
+        ))
+
+    def test_size_limit(self):
+        source = ".MACRO m\nNOP\nNOP\n.ENDM\n" + "m\n" * 5
+        a, out = self._assemble(source, max_macro_lines=10)
+        self.assertEqual(len(out), 10)
+        self.assertIn("too large: m",
+                      self._error(source + "m", max_macro_lines=10))
+
+    def test_include(self):
+        d = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(d, "lib.asm"), 'w') as f:
+                f.write(".MACRO clear\nLDA #0\nSTA $10\n.ENDM\n")
+            with open(os.path.join(d, "a.asm"), 'w') as f:
+                f.write('.INCLUDE "lib.asm"\nclear\n')
+            with open(os.path.join(d, "a.asm")) as f:
+                a, out = self._assemble(f)
+        finally:
+            shutil.rmtree(d)
+        self.assertEqual(out, bytearray([0xa9, 0, 0x85, 0x10]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_py65asm
+----------------------------------
+
+Tests for the `py65asm` command line.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from py65asm.py65asm import main
+
+
+class TestMain(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.stderr = sys.stderr
+        sys.stderr = open(os.devnull, 'w')
+
+    def tearDown(self):
+        sys.stderr.close()
+        sys.stderr = self.stderr
+        shutil.rmtree(self.dir)
+
+    def _source(self, name, text):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def _read(self, name):
+        with open(os.path.join(self.dir, name), 'rb') as f:
+            return bytearray(f.read())
+
+    def test_output(self):
+        source = self._source("a.asm", "LDA #1\n.ORG $10\nRTS")
+        out = os.path.join(self.dir, "rom")
+        self.assertEqual(main(['-q', '--fill', '$EA', source, '-o', out]), 0)
+        self.assertEqual(self._read("rom"), bytearray([169, 1, 0xea, 0xea] +
+                         [0xea] * 12 + [96]))
+
+    def test_default_output(self):
+        source = self._source("a.asm", "RTS")
+        self.assertEqual(main(['-q', '--org', '$C000', source]), 0)
+        self.assertEqual(self._read("a.bin"), bytearray([96]))
+
+    def test_zero_page(self):
+        source = self._source("a.asm", "LDA tmp\ntmp = $10")
+        self.assertEqual(main(['-q', '-Z', source]), 0)
+        self.assertEqual(self._read("a.bin"), bytearray([165, 16]))
+
+    def test_relax(self):
+        source = self._source("a.asm", "BNE far\n" + "NOP\n" * 200 +
+                              "far: RTS")
+        self.assertEqual(main(['-q', source]), 1)
+        self.assertEqual(main(['-q', '-R', source]), 0)
+        self.assertEqual(self._read("a.bin")[:3], bytearray([0xf0, 3, 0x4c]))
+
+    def test_jobs(self):
+        sources = [self._source("%d.asm" % i, ".BYTE %d" % (i + 1))
+                   for i in range(6)]
+        self.assertEqual(main(['-q', '-j', '3'] + sources), 0)
+        for i in range(6):
+            self.assertEqual(self._read("%d.bin" % i), bytearray([i + 1]))
+
+    def test_failure(self):
+        sources = [self._source("bad.asm", "JMP nowhere"),
+                   self._source("good.asm", "RTS")]
+        self.assertEqual(main(['-q'] + sources), 1)
+        self.assertFalse(os.path.exists(os.path.join(self.dir, "good.bin")))
+
+        self.assertEqual(main(['-q', '-k', '-j', '2'] + sources), 1)
+        self.assertEqual(self._read("good.bin"), bytearray([96]))
+
+    def test_listing_and_symbols(self):
+        source = self._source("a.asm", ".ORG $C000\nstart: JMP start")
+        self.assertEqual(main(['-q', '-l', '-s', source]), 0)
+        self.assertEqual(self._read("a.lst").decode(),
+                         "                     .ORG $C000\n"
+                         "C000  4C 00 C0       start: JMP start\n")
+        self.assertEqual(self._read("a.sym").decode(), "start = $C000\n")
+
+        self.assertEqual(main(['-q', '--vice', source]), 0)
+        self.assertEqual(self._read("a.lbl").decode(), "al C:C000 .start\n")
+
+    def test_format(self):
+        source = self._source("a.asm", "RTS")
+        self.assertEqual(main(['-q', '-f', 'prg', '--org', '$0801', source]),
+                         0)
+        self.assertEqual(self._read("a.prg"), bytearray([1, 8, 0x60]))
+        self.assertEqual(main(['-q', '-f', 'hex', source]), 0)
+        self.assertEqual(self._read("a.hex").decode(),
+                         ":01000000609F\n:00000001FF\n")
+
+    def test_compile_and_link(self):
+        main_ = self._source("main.asm", "JSR print\nRTS")
+        lib = self._source("lib.asm", ".EXPORT print\nprint: RTS")
+        self.assertEqual(main(['-q', '-c', '-j', '2', main_, lib]), 0)
+        out = os.path.join(self.dir, "game.bin")
+        self.assertEqual(main(['-q', '--link', '--org', '$C000', '-s',
+                               os.path.join(self.dir, "main.o"),
+                               os.path.join(self.dir, "lib.o"), '-o', out]),
+                         0)
+        self.assertEqual(self._read("game.bin"),
+                         bytearray([0x20, 0x04, 0xc0, 0x60, 0x60]))
+        self.assertEqual(self._read("game.sym").decode(), "print = $C004\n")
+
+        self.assertEqual(main(['-q', '--link',
+                               os.path.join(self.dir, "main.o")]), 1)
+
+    def test_outputs_must_match(self):
+        source = self._source("a.asm", "RTS")
+        self.assertRaises(SystemExit, main, [source, source, '-o', 'x'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_server
+----------------------------------
+
+Tests for `py65asm.server` and `py65asm.client` modules.
+"""
+
+import base64
+import io
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from py65asm import client
+from py65asm.objects import ObjectModule
+from py65asm.server import assemble, serveStream, serveSocket
+
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _path(self, name, text=None):
+        path = os.path.join(self.dir, name)
+        if text is not None:
+            with open(path, 'w') as f:
+                f.write(text)
+        return path
+
+    def test_source(self):
+        response = assemble({'id': 7, 'source': "start: LDA #1\nJMP start",
+                             'org': '$C000'})
+        self.assertTrue(response['ok'])
+        self.assertEqual(response['id'], 7)
+        self.assertEqual(base64.b64decode(response['data']),
+                         b'\xa9\x01\x4c\x00\xc0')
+        self.assertEqual(response['symbols'], {'start': 0xc000})
+        self.assertEqual(response['size'], 5)
+        self.assertEqual(response['diagnostics'], [])
+
+    def test_segments(self):
+        response = assemble({'source': ".ORG $10\nNOP\n.ORG $20\nRTS",
+                             'format': 'segments'})
+        self.assertEqual(
+            [(start, base64.b64decode(data))
+             for start, data in response['segments']],
+            [(0x10, b'\x1a'), (0x20, b'\x60')]
+        )
+
+    def test_path(self):
+        self._path("lib.asm", "RTS\n")
+        path = self._path("a.asm", 'NOP\n.INCLUDE "lib.asm"\n')
+        out = self._path("a.bin")
+        response = assemble({'path': path, 'output': out, 'format': 'none',
+                             'listing': self._path("a.lst"),
+                             'symbols': self._path("a.sym")})
+        self.assertTrue(response['ok'])
+        self.assertFalse('data' in response)
+        with open(out, 'rb') as f:
+            self.assertEqual(f.read(), b'\x1a\x60')
+        self.assertTrue(os.path.exists(self._path("a.lst")))
+
+    def test_object(self):
+        out = self._path("a.o")
+        response = assemble({'source': ".EXPORT start\nstart: JMP far",
+                             'output': out, 'object': True})
+        self.assertTrue(response['ok'])
+        with open(out) as f:
+            m = ObjectModule.read(f)
+        self.assertEqual(m.exports, ['start'])
+        self.assertEqual(m.imports, ['far'])
+
+    def test_diagnostics(self):
+        response = assemble({'source': "NOP\nLDA [1]\nNOP"})
+        self.assertFalse(response['ok'])
+        self.assertEqual(response['diagnostics'][0]['line'], 2)
+        self.assertEqual(response['diagnostics'][0]['severity'], 'error')
+
+        # Errors found by the sizing passes still point at their line
+        for options in [{'relax': True}, {'zero_page': True}]:
+            for source, line in [("NOP\nLDA [1]\nNOP", 2),
+                                 ("NOP\n\nBNE end\nLDA #300\nend: RTS", 4)]:
+                request = dict(options, source=source)
+                response = assemble(request)
+                self.assertEqual(response['diagnostics'][0]['line'], line)
+
+        response = assemble({'source': "NOP\nJMP nowhere"})
+        self.assertEqual(response['diagnostics'], [{
+            'severity': 'error', 'message': 'Undefined symbol: nowhere',
+            'line': None,
+        }])
+
+        response = assemble({'source': "NOP", 'format': 'hex'})
+        self.assertEqual(response['diagnostics'][0]['message'],
+                         "Unknown format: hex")
+
+    def test_stream(self):
+        requests = io.StringIO(
+            u'{"id": 1, "source": "RTS"}\n\nnot json\n'
+            u'{"command": "reload"}\n{"command": "shutdown"}\n'
+            u'{"id": 2, "source": "RTS"}\n'
+        )
+        out = io.StringIO()
+        self.assertFalse(serveStream(requests, out))
+        responses = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([r['ok'] for r in responses],
+                         [True, False, False, True])
+        self.assertEqual(responses[1]['diagnostics'][0]['message'][:16],
+                         "Invalid request:")
+        self.assertEqual(responses[2]['diagnostics'][0]['message'],
+                         "Unknown command: reload")
+
+    def test_client(self):
+        socketPath = self._path("server.sock")
+        server = threading.Thread(target=serveSocket, args=(socketPath,))
+        server.start()
+        try:
+            for i in range(100):
+                if os.path.exists(socketPath):
+                    break
+                time.sleep(0.01)
+
+            source = self._path("a.asm", ".ORG $C000\nstart: JMP start")
+            bad = self._path("bad.asm", "NOP\nJMP nowhere")
+            stderr = sys.stderr
+            sys.stderr = tempfile.TemporaryFile('w+')
+            try:
+                self.assertEqual(client.main(
+                    ['-q', '-s', '--socket', socketPath, source]), 0)
+                self.assertEqual(client.main(
+                    ['-q', '-k', '--socket', socketPath, bad, source]), 1)
+                sys.stderr.seek(0)
+                error = sys.stderr.read()
+            finally:
+                sys.stderr.close()
+                sys.stderr = stderr
+        finally:
+            s = socket.socket(socket.AF_UNIX)
+            s.connect(socketPath)
+            s.sendall(b'{"command": "shutdown"}\n')
+            s.recv(100)
+            s.close()
+            server.join()
+
+        with open(self._path("a.bin"), 'rb') as f:
+            self.assertEqual(f.read(), b'\x4c\x00\xc0')
+        with open(self._path("a.sym")) as f:
+            self.assertEqual(f.read(), "start = $C000\n")
+        self.assertEqual(error, "%s: error: Undefined symbol: nowhere\n" %
+                         bad)
+        self.assertFalse(os.path.exists(socketPath))
+
+
+if __name__ == '__main__':
+    unittest.main()
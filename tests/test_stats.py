@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_stats
+----------------------------------
+
+Tests for `Assembler.stats`.
+"""
+
+import os
+import tempfile
+import unittest
+
+from py65asm.assembler import Assembler
+from py65asm.cache import LRUCache
+from py65asm.stats import PHASES
+
+
+class TestStats(unittest.TestCase):
+
+    source = "ptr = $10\nstart: LDA (ptr),Y\nBNE end\n\nJMP start\nend: RTS"
+
+    def test_disabled(self):
+        a = Assembler()
+        a.assemble(self.source)
+        self.assertEqual(a.stats, None)
+
+    def test_stats(self):
+        a = Assembler(cache=LRUCache(), stats=True)
+        fd, out = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            a.assemble(self.source, out)
+        finally:
+            os.remove(out)
+
+        for phase in PHASES + ['total']:
+            self.assertTrue(a.stats['time'][phase] >= 0)
+        self.assertEqual(a.stats['lines'], 6)
+        self.assertEqual(a.stats['instructions'], 4)
+        self.assertEqual(a.stats['labels'], 2)
+        self.assertEqual(a.stats['fixups'], 2)
+        self.assertEqual(a.stats['operands_parsed'], 4)
+        self.assertEqual(a.stats['bytes'], 8)
+        self.assertEqual(a.stats['bytes_written'], 8)
+
+        # The operands are cached the second time round
+        a.assemble(self.source)
+        self.assertEqual(a.stats['operands_parsed'], 0)
+        self.assertEqual(a.stats['bytes_written'], 0)
+
+    def test_hook(self):
+        seen = []
+        a = Assembler(hook=seen.append)
+        self.assertEqual(
+            a.assemble(self.source), Assembler().assemble(self.source)
+        )
+        self.assertEqual(seen, [a.stats])
+        self.assertRaises(Exception, a.assemble, "JMP nowhere")
+        self.assertEqual(len(seen), 1)
+
+    def test_sizing_passes(self):
+        # Only the final pass is counted
+        a = Assembler(stats=True, relax=True)
+        a.assemble("BNE far\n" + "NOP\n" * 200 + "far: RTS")
+        self.assertEqual(a.stats['fixups'], 1)
+        self.assertEqual(a.stats['instructions'], 202)
+        self.assertEqual(a.stats['branches_relaxed'], 1)
+        self.assertEqual(a.stats['size_passes'], 2)
+
+        # The time they take is a phase of its own, within the total
+        times = a.stats['time']
+        self.assertTrue(times['size'] > 0)
+        self.assertTrue(sum([times[p] for p in PHASES]) <= times['total'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_timing
+----------------------------------
+
+Tests for `py65asm.timing` module and the .CYCLES directive.
+"""
+
+import unittest
+
+from py65asm.assembler import Assembler
+
+
+class TestTiming(unittest.TestCase):
+
+    source = ".ORG $80E8\nstart: LDX #0\nloop: LDA $1234,X\nSTA $2000,X\n" \
+        "LDA ($10),Y\nLDA $3000,Y\nDEX\nBNE loop\nfar: BEQ next\n" \
+        ".ORG $8100\nnext: RTS"
+
+    def _blocks(self, source):
+        a = Assembler()
+        a.assemble(source)
+        return a.cycles()
+
+    def test_instructions(self):
+        blocks = self._blocks(self.source)
+        self.assertEqual(
+            [(i.mnemonic, i.cycles, i.max_cycles, i.flags)
+             for i in blocks[1].instructions],
+            [('LDA', 4, 5, ['index']), ('STA', 5, 5, []),
+             ('LDA', 5, 6, ['index']), ('LDA', 4, 4, []),
+             ('DEX', 2, 2, []), ('BNE', 2, 3, [])]
+        )
+
+    def test_blocks(self):
+        self.assertEqual(
+            [(b.label, b.address, b.cycles, b.max_cycles)
+             for b in self._blocks(self.source)],
+            [('start', 0x80e8, 2, 2), ('loop', 0x80ea, 22, 25),
+             ('far', 0x80f8, 2, 4), ('next', 0x8100, 6, 6)]
+        )
+
+    def test_unlabelled_code(self):
+        # The $FF would start a 3 byte instruction, which is cut off
+        blocks = self._blocks("NOP\nJMP end\n.BYTE $FF\nend: RTS")
+        self.assertEqual([(b.label, len(b.instructions)) for b in blocks],
+                         [(None, 2), ('end', 1)])
+
+    def test_budget(self):
+        a = Assembler()
+        a.assemble("loop: .CYCLES 25\nLDA $1234,X\nDEX\nBNE loop")
+        a.assemble("loop: LDA $1200,X\nDEX\nBNE loop\n.CYCLES 9")
+        self.assertRaises(
+            Exception, a.assemble, "loop: .CYCLES 7\nLDA $1234,X\nBNE loop"
+        )
+        self.assertRaises(Exception, a.assemble, ".CYCLES 9\nNOP")
+        self.assertRaises(Exception, list,
+                          a.assemble_iter("l: .CYCLES 9\nNOP"))
+
+
+if __name__ == '__main__':
+    unittest.main()